@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""
+Hysen benchmarks
+Codec, crypto and CRC micro benchmarks, setter round trip counts,
+fleet throughput / latency against the local emulator and capture replay
+Results are written as JSON (stdout or --output)
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from hysen import (
+    HysenHeatingDevice,
+    Hysen2PipeFanCoilDevice,
+    HYSENHEAT_DEV_TYPE,
+    HYSEN2PFC_DEV_TYPE,
+    HYSEN2PFC_MODE_HEAT
+)
+from hysen.hysendevice import crc16, _frame_request
+from hysen.hysenheating import HYSENHEAT_STATUS_REQUEST
+from hysen.emulator import HysenEmulator, HysenEmulatedDevice
+from hysen.capture import HysenCaptureReplayer, read_capture
+from hysen.transport import HysenTransport, LoopbackTransport
+
+DEVICE_CLASSES = {
+    HYSENHEAT_DEV_TYPE: HysenHeatingDevice,
+    HYSEN2PFC_DEV_TYPE: Hysen2PipeFanCoilDevice,
+}
+
+# Run func repeatedly for about duration seconds
+# Returns operations per second and microseconds per operation
+def measure(func, duration):
+    func()
+    iterations = 0
+    batch = 1
+    start = time.perf_counter()
+    elapsed = 0.0
+    while elapsed < duration:
+        for _ in range(batch):
+            func()
+        iterations += batch
+        batch = min(batch * 2, 10000)
+        elapsed = time.perf_counter() - start
+    return {
+        'ops_per_sec': iterations / elapsed,
+        'us_per_op': elapsed * 1e6 / iterations,
+        'iterations': iterations,
+    }
+
+# Transport answering with responses recorded from another transport
+# Responses are keyed by the encrypted payload, so the same session key must be kept
+# Used to measure the client side of a request without any device work
+class CannedTransport(HysenTransport):
+    def __init__(self, transport):
+        self.transport = transport
+        self.responses = {}
+
+    def exchange(self, packet, host, timeout):
+        key = bytes(packet[0x38:])
+        response = self.responses.get(key)
+        if response is None:
+            response = self.transport.exchange(packet, host, timeout)
+            self.responses[key] = response
+        return response
+
+# Transport counting the round trips made through it
+class CountingTransport(HysenTransport):
+    def __init__(self, transport):
+        self.transport = transport
+        self.round_trips = 0
+
+    def exchange(self, packet, host, timeout):
+        self.round_trips += 1
+        return self.transport.exchange(packet, host, timeout)
+
+def loopback_device(devtype):
+    emulated = HysenEmulatedDevice(devtype)
+    transport = LoopbackTransport([emulated])
+    device = DEVICE_CLASSES[devtype](emulated.host, emulated.mac, 1, False, 0)
+    device.transport = transport
+    device.resolve_after_timeouts = 0
+    device.get_device_status()
+    return device, emulated
+
+def bench_codec(duration):
+    results = {}
+    variable_request = bytearray([0x01, 0x10, 0x00, 0x0A, 0x00, 0x0C, 0x18]) + bytearray(range(24))
+    results['frame_request_variable'] = measure(lambda: _frame_request(variable_request), duration)
+    crc_payload = bytes(range(46))
+    results['crc16_46_bytes'] = measure(lambda: crc16(crc_payload), duration)
+    results['crc16_6_bytes'] = measure(lambda: crc16(HYSENHEAT_STATUS_REQUEST), duration)
+    device, _ = loopback_device(HYSENHEAT_DEV_TYPE)
+    for size in (16, 48, 64):
+        payload = os.urandom(size)
+        encrypted = device.encrypt(payload)
+        results['encrypt_%s_bytes' % size] = measure(lambda: device.encrypt(payload), duration)
+        results['decrypt_%s_bytes' % size] = measure(lambda: device.decrypt(encrypted), duration)
+    return results
+
+def bench_status(duration):
+    results = {}
+    for name, devtype in (('heating', HYSENHEAT_DEV_TYPE), ('2pfc', HYSEN2PFC_DEV_TYPE)):
+        device, _ = loopback_device(devtype)
+        results['get_device_status_loopback_%s' % name] = measure(device.get_device_status, duration)
+        device.transport = CannedTransport(device.transport)
+        results['get_device_status_canned_%s' % name] = measure(device.get_device_status, duration)
+    return results
+
+# Round trips of each public setter (status read, firmware read and write)
+def bench_round_trips():
+    heating, _ = loopback_device(HYSENHEAT_DEV_TYPE)
+    fan_coil, emulated = loopback_device(HYSEN2PFC_DEV_TYPE)
+    calls = (
+        ('heating.get_device_status', heating, lambda: heating.get_device_status()),
+        ('heating.set_target_temp', heating, lambda: heating.set_target_temp(21)),
+        ('heating.set_calibration', heating, lambda: heating.set_calibration(0.5)),
+        ('heating.set_period3', heating, lambda: heating.set_period3(None, None, 16)),
+        ('heating.set_time', heating, lambda: heating.set_time(10, 20, 30, 3)),
+        ('2pfc.get_device_status', fan_coil, lambda: fan_coil.get_device_status()),
+        ('2pfc.set_operation_mode', fan_coil, lambda: fan_coil.set_operation_mode(HYSEN2PFC_MODE_HEAT)),
+        ('2pfc.set_target_temp', fan_coil, lambda: fan_coil.set_target_temp(23)),
+        ('2pfc.set_fan_mode', fan_coil, lambda: fan_coil.set_fan_mode(2)),
+        ('2pfc.set_daily_schedule', fan_coil, lambda: fan_coil.set_daily_schedule(
+            1, 7, 0, 1, 9, 0, None, None, None, None, None, None)),
+    )
+    results = {}
+    for name, device, call in calls:
+        counting = CountingTransport(device.transport)
+        device.transport = counting
+        call()
+        device.transport = counting.transport
+        results[name] = counting.round_trips
+    return results
+
+# Poll devices emulated over UDP on loopback with a pool of worker threads
+# Returns requests per second (status polls) and latency percentiles in milliseconds
+def bench_fleet(devices, workers, duration):
+    with HysenEmulator() as emulator:
+        clients = []
+        for index in range(devices):
+            devtype = HYSENHEAT_DEV_TYPE if index % 2 == 0 else HYSEN2PFC_DEV_TYPE
+            emulated = emulator.add_device(devtype)
+            device = DEVICE_CLASSES[devtype](emulated.host, emulated.mac, 2, False, 0)
+            device.resolve_after_timeouts = 0
+            device.get_device_status()
+            clients.append(device)
+        latencies = [[] for _ in range(workers)]
+        errors = [0] * workers
+        deadline = time.perf_counter() + duration
+
+        def worker(index):
+            own = clients[index::workers]
+            while own and time.perf_counter() < deadline:
+                for device in own:
+                    start = time.perf_counter()
+                    try:
+                        device.get_device_status()
+                    except Exception:
+                        errors[index] += 1
+                        continue
+                    latencies[index].append(time.perf_counter() - start)
+
+        threads = [threading.Thread(target=worker, args=(index,)) for index in range(workers)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+    samples = sorted(latency for worker_latencies in latencies for latency in worker_latencies)
+    if not samples:
+        samples = [0.0]
+
+    def percentile(fraction):
+        return samples[min(len(samples) - 1, int(fraction * len(samples)))] * 1e3
+
+    return {
+        'devices': devices,
+        'workers': workers,
+        'requests': len(samples),
+        'errors': sum(errors),
+        'requests_per_sec': len(samples) / elapsed,
+        'p50_ms': percentile(0.50),
+        'p99_ms': percentile(0.99),
+        'max_ms': samples[-1] * 1e3,
+    }
+
+# Replay a capture (see hysen/capture.py) through the response checks and status decoding
+def bench_replay(path):
+    records = list(read_capture(path))
+    replayer = HysenCaptureReplayer()
+    start = time.perf_counter()
+    for record in records:
+        try:
+            replayer.replay_record(record)
+        except ValueError:
+            pass
+    elapsed = time.perf_counter() - start
+    return {
+        'records': replayer.records,
+        'statuses': replayer.statuses,
+        'errors': replayer.errors,
+        'records_per_sec': replayer.records / elapsed if elapsed else None,
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Hysen benchmarks')
+    parser.add_argument('--duration', type=float, default=0.5, help='seconds per micro benchmark')
+    parser.add_argument('--devices', type=int, default=50, help='emulated devices for the fleet benchmark')
+    parser.add_argument('--workers', type=int, default=8, help='polling threads for the fleet benchmark')
+    parser.add_argument('--fleet-duration', type=float, default=3.0, help='seconds of fleet polling')
+    parser.add_argument('--capture', help='also replay this capture file')
+    parser.add_argument('--output', help='write results to this file instead of stdout')
+    args = parser.parse_args(argv)
+
+    results = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'timestamp': time.time(),
+        'codec': bench_codec(args.duration),
+        'status': bench_status(args.duration),
+        'round_trips': bench_round_trips(),
+        'fleet': bench_fleet(args.devices, args.workers, args.fleet_duration),
+    }
+    if args.capture:
+        results['replay'] = bench_replay(args.capture)
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+if __name__ == '__main__':
+    main()
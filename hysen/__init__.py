@@ -29,7 +29,8 @@ from .hysenheating import (
     HYSENHEAT_MAX_TEMP,
     HYSENHEAT_MIN_TEMP,
     HYSENHEAT_WEEKDAY_MONDAY,
-    HYSENHEAT_WEEKDAY_SUNDAY
+    HYSENHEAT_WEEKDAY_SUNDAY,
+    HYSENHEAT_DEV_TYPE
 )
 from .hysen2pfc import (
     Hysen2PipeFanCoilDevice,
@@ -70,5 +71,11 @@ from .hysen2pfc import (
     HYSEN2PFC_MAX_TEMP,
     HYSEN2PFC_MIN_TEMP,
     HYSEN2PFC_WEEKDAY_MONDAY,
-    HYSEN2PFC_WEEKDAY_SUNDAY
+    HYSEN2PFC_WEEKDAY_SUNDAY,
+    HYSEN2PFC_DEV_TYPE
 )
+from .discovery import (
+    discover,
+    HYSEN_DEVICE_CLASSES
+)
+from .fleet import HysenFleet
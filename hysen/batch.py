@@ -0,0 +1,197 @@
+"""
+Hysen thermostats batch decoding
+Vectorized decoding of many raw status payloads with NumPy (optional dependency, pip install hysen[numpy])
+"""
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from .hysenheating import HYSENHEAT_DEV_TYPE
+from .hysen2pfc import HYSEN2PFC_DEV_TYPE
+from .snapshotlog import (
+    HYSEN_SNAPSHOT_LOG_HEADER,
+    HYSEN_SNAPSHOT_LOG_PAYLOAD_SIZE
+)
+
+# Payload byte of the fields decoded as is (uint8), see _decode_status of each device class
+HYSEN_BATCH_HEATING_BYTES = (
+    ('sensor', 8),
+    ('hysteresis', 10),
+    ('max_temp', 11),
+    ('min_temp', 12),
+    ('frost_protection', 15),
+    ('poweron', 16),
+    ('unknown1', 17),
+    ('clock_hour', 19),
+    ('clock_minute', 20),
+    ('clock_second', 21),
+    ('clock_weekday', 22),
+    ('period1_hour', 23),
+    ('period1_min', 24),
+    ('period2_hour', 25),
+    ('period2_min', 26),
+    ('period3_hour', 27),
+    ('period3_min', 28),
+    ('period4_hour', 29),
+    ('period4_min', 30),
+    ('period5_hour', 31),
+    ('period5_min', 32),
+    ('period6_hour', 33),
+    ('period6_min', 34),
+    ('we_period1_hour', 35),
+    ('we_period1_min', 36),
+    ('we_period2_hour', 37),
+    ('we_period2_min', 38),
+    ('unknown2', 47),
+    ('unknown3', 48),
+)
+
+# Payload byte of the temperatures in half degrees
+HYSEN_BATCH_HEATING_HALF_DEGREES = (
+    ('room_temp', 5),
+    ('target_temp', 6),
+    ('external_temp', 18),
+    ('period1_temp', 39),
+    ('period2_temp', 40),
+    ('period3_temp', 41),
+    ('period4_temp', 42),
+    ('period5_temp', 43),
+    ('period6_temp', 44),
+    ('we_period1_temp', 45),
+    ('we_period2_temp', 46),
+)
+
+HYSEN_BATCH_2PFC_BYTES = (
+    ('operation_mode', 5),
+    ('fan_mode', 6),
+    ('room_temp', 7),
+    ('target_temp', 8),
+    ('hysteresis', 9),
+    ('cooling_max_temp', 11),
+    ('cooling_min_temp', 12),
+    ('heating_max_temp', 13),
+    ('heating_min_temp', 14),
+    ('fan_control', 15),
+    ('frost_protection', 16),
+    ('clock_hour', 17),
+    ('clock_minute', 18),
+    ('clock_second', 19),
+    ('clock_weekday', 20),
+    ('unknown', 21),
+    ('schedule', 22),
+)
+
+# Payload byte of the period start / end: (enabled, hour, minute fields, byte), minute is in the next byte
+HYSEN_BATCH_2PFC_PERIODS = (
+    ('period1_start_enabled', 'period1_start_hour', 'period1_start_min', 23),
+    ('period1_end_enabled', 'period1_end_hour', 'period1_end_min', 25),
+    ('period2_start_enabled', 'period2_start_hour', 'period2_start_min', 27),
+    ('period2_end_enabled', 'period2_end_hour', 'period2_end_min', 29),
+)
+
+def _check_numpy():
+    if numpy is None:
+        raise ImportError('Can\'t decode batch (numpy is not installed, pip install hysen[numpy])')
+
+# 2-D uint8 array of payloads (one per row) from a 2-D array or a sequence of equal length bytes
+def _payload_array(payloads, length):
+    if isinstance(payloads, numpy.ndarray):
+        array = payloads
+    else:
+        array = numpy.frombuffer(b''.join(bytes(payload) for payload in payloads), dtype=numpy.uint8)
+        array = array.reshape(-1, length) if array.size else array.reshape(0, length)
+    if array.ndim != 2 or array.shape[1] < length:
+        raise ValueError('Can\'t decode batch (payloads of %s bytes expected, got shape %s)' % (
+            length, array.shape))
+    return array.astype(numpy.uint8, copy=False)
+
+# Decode heating status payloads (status_payload of HysenHeatingDevice, 49 bytes)
+# Returns {field: array}, with the values of HysenHeatingDevice._decode_status (fwversion excluded)
+def decode_heating_batch(payloads):
+    _check_numpy()
+    r = _payload_array(payloads, 3 + 2 * 0x17)
+    columns = {
+        'key_lock': r[:, 3] & 0x01,
+        'manual_in_auto': (r[:, 4] >> 6) & 0x01,
+        'valve_state': (r[:, 4] >> 4) & 0x01,
+        'power_state': r[:, 4] & 0x01,
+        'operation_mode': r[:, 7] & 0x01,
+        'schedule': (r[:, 7] >> 4) & 0x0F,
+        'external_max_temp': r[:, 9].astype(numpy.float64),
+    }
+    for field, position in HYSEN_BATCH_HEATING_HALF_DEGREES:
+        columns[field] = r[:, position] / 2.0
+    for field, position in HYSEN_BATCH_HEATING_BYTES:
+        columns[field] = r[:, position].copy()
+    calibration = (r[:, 13].astype(numpy.int32) << 8) + r[:, 14]
+    columns['calibration'] = numpy.where(calibration > 0x7FFF, calibration - 0x10000, calibration) / 2.0
+    return columns
+
+# Decode 2 pipe fan coil status payloads (status_payload of Hysen2PipeFanCoilDevice, 35 bytes)
+# Returns {field: array}, with the values of Hysen2PipeFanCoilDevice._decode_status (fwversion excluded)
+def decode_2pfc_batch(payloads):
+    _check_numpy()
+    r = _payload_array(payloads, 3 + 2 * 0x10)
+    columns = {
+        'key_lock': (r[:, 3] >> 4) & 1,
+        'key_lock_type': r[:, 3] & 3,
+        'valve_state': (r[:, 4] >> 4) & 1,
+        'power_state': r[:, 4] & 1,
+        'calibration': r[:, 10].view(numpy.int8) / 10.0,
+        'time_valve_on': (
+            (r[:, 31].astype(numpy.uint32) << 24) |
+            (r[:, 32].astype(numpy.uint32) << 16) |
+            (r[:, 33].astype(numpy.uint32) << 8) |
+            r[:, 34]),
+    }
+    for field, position in HYSEN_BATCH_2PFC_BYTES:
+        columns[field] = r[:, position].copy()
+    for enabled, hour, minute, position in HYSEN_BATCH_2PFC_PERIODS:
+        columns[enabled] = (r[:, position] >> 7) & 1
+        columns[hour] = r[:, position] & 0x1F
+        columns[minute] = r[:, position + 1] & 0x3F
+    return columns
+
+HYSEN_BATCH_DECODERS = {
+    HYSENHEAT_DEV_TYPE: decode_heating_batch,
+    HYSEN2PFC_DEV_TYPE: decode_2pfc_batch,
+}
+
+def decode_batch(devtype, payloads):
+    decoder = HYSEN_BATCH_DECODERS.get(devtype)
+    if decoder is None:
+        raise ValueError('Can\'t decode batch (unknown device type 0x%04x)' % (
+            devtype))
+    return decoder(payloads)
+
+# Columns (see decode_batch) as a NumPy structured array, one record per payload
+def as_structured(columns):
+    _check_numpy()
+    fields = list(columns)
+    array = numpy.empty(
+        len(columns[fields[0]]) if fields else 0,
+        dtype=[(field, columns[field].dtype) for field in fields])
+    for field in fields:
+        array[field] = columns[field]
+    return array
+
+# Records of a snapshot log (see snapshotlog.py) as a NumPy structured array
+# (timestamp, devtype, mac, length, payload), copied from the map in one go
+# decode_batch(devtype, records['payload'][records['devtype'] == devtype]) decodes the payloads of a model
+def snapshot_log_records(log):
+    _check_numpy()
+    dtype = numpy.dtype([
+        ('timestamp', '<f8'),
+        ('devtype', '<u2'),
+        ('mac', 'u1', (6,)),
+        ('length', 'u1'),
+        ('payload', 'u1', (HYSEN_SNAPSHOT_LOG_PAYLOAD_SIZE,))])
+    with log._lock:
+        count = len(log)
+        log._check_map(count)
+        view = numpy.frombuffer(log._map, dtype=dtype, count=count, offset=HYSEN_SNAPSHOT_LOG_HEADER.size)
+        records = view.copy()
+        del view
+    return records
@@ -0,0 +1,156 @@
+"""
+Hysen thermostats traffic capture
+Records the decrypted request / response payloads exchanged with devices in a binary file,
+and replays a capture offline through the response checks and the status decoding
+"""
+
+import collections
+import struct
+import threading
+import time
+
+from .discovery import HYSEN_DEVICE_CLASSES
+
+HYSEN_CAPTURE_MAGIC             = b'HYSNCAP\x01'
+
+# Record header: timestamp (float64), device type, MAC address, request length, response length
+# followed by the request payload (without length and CRC) and the decrypted response payload
+HYSEN_CAPTURE_RECORD            = struct.Struct('<dH6sHH')
+
+HYSEN_CAPTURE_BUFFERING         = 65536
+
+# A captured payload pair
+# request = payload passed to _send_request, response = decrypted response, length and CRC included
+HysenCaptureRecord = collections.namedtuple(
+    'HysenCaptureRecord',
+    ['timestamp', 'devtype', 'mac', 'request', 'response'])
+
+class HysenCaptureRecorder:
+    # Writes the payload pairs of the devices it is attached to in the capture file path
+    # Records are buffered, they are on disk after flush or close
+    # A recorder can be shared by devices used from several threads
+    def __init__(self, path, buffering=HYSEN_CAPTURE_BUFFERING):
+        self.path = path
+        self.records = 0
+        self._lock = threading.Lock()
+        self._file = open(path, 'wb', buffering=buffering)
+        self._file.write(HYSEN_CAPTURE_MAGIC)
+
+    def attach(self, device):
+        device.recorder = self
+
+    def detach(self, device):
+        if device.recorder is self:
+            device.recorder = None
+
+    # Called by HysenDevice._send_request with every decrypted response
+    def record(self, device, request, response):
+        request = bytes(request)
+        response = bytes(response)
+        header = HYSEN_CAPTURE_RECORD.pack(
+            time.time(),
+            device.devtype,
+            bytes(device.mac),
+            len(request),
+            len(response))
+        with self._lock:
+            self._file.write(header + request + response)
+            self.records += 1
+
+    def flush(self):
+        with self._lock:
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# Records of a capture file, in order
+# A truncated last record (e.g. capture of a process that was killed) is ignored
+def read_capture(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    if data[:len(HYSEN_CAPTURE_MAGIC)] != HYSEN_CAPTURE_MAGIC:
+        raise ValueError('Can\'t read capture (%s is not a Hysen capture file)' % (
+            path))
+    offset = len(HYSEN_CAPTURE_MAGIC)
+    header_size = HYSEN_CAPTURE_RECORD.size
+    while offset + header_size <= len(data):
+        timestamp, devtype, mac, request_len, response_len = HYSEN_CAPTURE_RECORD.unpack_from(data, offset)
+        offset += header_size
+        end = offset + request_len + response_len
+        if end > len(data):
+            break
+        yield HysenCaptureRecord(
+            timestamp,
+            devtype,
+            mac,
+            data[offset:offset + request_len],
+            data[offset + request_len:end])
+        offset = end
+
+class HysenCaptureReplayer:
+    # Feeds captured responses through the checks of _send_request and the status decoding,
+    # as fast as they are read, without network or encryption
+    # devices = unique_id -> replay device (of the device class of the capture, never connected)
+    # records, statuses, errors = replayed records, decoded status reads, responses rejected by the checks
+    def __init__(self):
+        self.devices = {}
+        self.records = 0
+        self.statuses = 0
+        self.errors = 0
+
+    def _device(self, devtype, mac):
+        unique_id = ''.join(format(x, '02x') for x in mac)
+        device = self.devices.get(unique_id)
+        if device is None:
+            device_class = HYSEN_DEVICE_CLASSES.get(devtype)
+            if device_class is None:
+                raise ValueError('Can\'t replay record (unknown device type 0x%04x)' % (
+                    devtype))
+            device = device_class(('0.0.0.0', 0), mac, 0, False, 0)
+            device.resolve_after_timeouts = 0
+            self.devices[unique_id] = device
+        return device
+
+    # Replay one record, status reads update the attributes of the replay device
+    # Raises a ValueError for a response the device would have rejected
+    # Returns the replay device
+    def replay_record(self, record):
+        device = self._device(record.devtype, record.mac)
+        self.records += 1
+        try:
+            return_payload, expected = device._check_response(record.request, record.response)
+            if not expected:
+                raise ValueError(
+                    'Hysen_response_error: request %s response %s',
+                    ' '.join(format(x, '02x') for x in record.request),
+                    ' '.join(format(x, '02x') for x in bytes(return_payload)))
+        except IndexError as err:
+            self.errors += 1
+            raise ValueError('hysen_response_error','response is too short') from err
+        except ValueError:
+            self.errors += 1
+            raise
+        if record.request == device.STATUS_REQUEST:
+            device._decode_status(return_payload)
+            self.statuses += 1
+        return device
+
+    # Replay a capture file
+    # Yields (record, replay device, error) for every record, error = None or the raised ValueError
+    def replay(self, path):
+        for record in read_capture(path):
+            try:
+                device = self.replay_record(record)
+                error = None
+            except ValueError as err:
+                device = self.devices.get(''.join(format(x, '02x') for x in record.mac))
+                error = err
+            yield record, device, error
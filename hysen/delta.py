@@ -0,0 +1,341 @@
+"""
+Hysen thermostats delta encoded history
+Status payloads stored as the bytes changed since the previous payload of the same device,
+with periodic keyframes (full payloads) for random access by time
+"""
+
+import bisect
+import mmap
+import os
+import struct
+import threading
+import time
+
+from .discovery import HYSEN_DEVICE_CLASSES
+
+HYSEN_DELTA_MAGIC                   = b'HYSNDLT\x01'
+HYSEN_DELTA_INDEX_MAGIC             = b'HYSNDIX\x01'
+
+# Keyframe index written next to the file (path + HYSEN_DELTA_INDEX_SUFFIX)
+HYSEN_DELTA_INDEX_SUFFIX            = '.idx'
+
+HYSEN_DELTA_DEFAULT_KEYFRAME_INTERVAL = 60
+
+# Records, each starting with a tag byte and the device slot (a number given to a device in a session)
+# S = session, written by every writer, device slots are numbered again from 0
+# N = new device: slot, device type, MAC address
+# K = keyframe: slot, timestamp (float64), payload length, payload
+# D = delta: slot, milliseconds since the previous record of the device, number of changed bytes,
+#     (position, value) of every changed byte
+HYSEN_DELTA_SESSION                 = b'S'
+HYSEN_DELTA_DEVICE                  = b'N'
+HYSEN_DELTA_KEYFRAME                = b'K'
+HYSEN_DELTA_DELTA                   = b'D'
+
+_DEVICE = struct.Struct('<cHH6s')
+_KEYFRAME = struct.Struct('<cHdB')
+_DELTA = struct.Struct('<cHIB')
+
+# Keyframe index entry: MAC address, device type, timestamp, offset of the keyframe in the file
+_INDEX = struct.Struct('<6sHdQ')
+
+_MAX_DELTA_MS = 0xFFFFFFFF
+
+class _DeltaSlot:
+    def __init__(self, slot):
+        self.slot = slot
+        self.payload = None
+        self.timestamp = None
+        self.since_keyframe = 0
+
+# Encode a payload of a device (a _DeltaSlot) as a keyframe or a delta, and update the slot
+def _encode(slot, timestamp, payload, keyframe_interval):
+    previous = slot.payload
+    if previous is not None and len(previous) == len(payload) and slot.since_keyframe < keyframe_interval:
+        delta_ms = round((timestamp - slot.timestamp) * 1000)
+        changes = bytearray()
+        for position in range(len(payload)):
+            if payload[position] != previous[position]:
+                changes.append(position)
+                changes.append(payload[position])
+        # a delta is only kept if it is smaller than a keyframe
+        if (0 <= delta_ms <= _MAX_DELTA_MS) and (len(changes) < len(payload)):
+            slot.payload = payload
+            slot.timestamp += delta_ms / 1000
+            slot.since_keyframe += 1
+            return _DELTA.pack(HYSEN_DELTA_DELTA, slot.slot, delta_ms, len(changes) // 2) + changes
+    slot.payload = payload
+    slot.timestamp = timestamp
+    slot.since_keyframe = 1
+    return _KEYFRAME.pack(HYSEN_DELTA_KEYFRAME, slot.slot, timestamp, len(payload)) + payload
+
+class HysenDeltaWriter:
+    # Appends the status payloads of any number of devices to a delta encoded file, created if needed
+    # A keyframe is written for the first payload of a device, then every keyframe_interval payloads,
+    # and indexed in the keyframe index file
+    # Delta timestamps have a millisecond resolution, the payloads of a device are kept in time order
+    # (one older than the previous payload of the device is not appended)
+    def __init__(self, path, keyframe_interval=HYSEN_DELTA_DEFAULT_KEYFRAME_INTERVAL):
+        self.path = path
+        self.keyframe_interval = keyframe_interval
+        self.records = 0
+        self.keyframes = 0
+        self._slots = {}
+        self._lock = threading.Lock()
+        new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+        index_path = path + HYSEN_DELTA_INDEX_SUFFIX
+        if not new_file and not os.path.exists(index_path):
+            # a file without index is indexed by the reader once, new keyframes are then appended to the index
+            HysenDeltaReader(path).close()
+        self._file = open(path, 'ab')
+        self._index = open(index_path, 'wb' if new_file else 'ab')
+        if new_file:
+            self._file.write(HYSEN_DELTA_MAGIC)
+            self._index.write(HYSEN_DELTA_INDEX_MAGIC)
+        self._file.write(HYSEN_DELTA_SESSION)
+        self._offset = self._file.tell()
+
+    # Append the last status read by device (its status_payload)
+    # Returns False if the payload is older than the previous one of the device and was not appended
+    def append(self, device, timestamp=None):
+        return self.append_payload(device.devtype, device.mac, device.status_payload, timestamp)
+
+    # timestamp = None stamps the payload with the current time, taken under the append lock
+    # (and never older than the previous payload of the device, should the clock step back)
+    # Returns False if timestamp is older than the previous payload of the device, which is then not appended
+    def append_payload(self, devtype, mac, payload, timestamp=None):
+        payload = bytes(payload)
+        mac = bytes(mac)
+        with self._lock:
+            slot = self._slots.get(mac)
+            if timestamp is None:
+                timestamp = time.time() if slot is None else max(time.time(), slot.timestamp)
+            elif slot is not None and timestamp < slot.timestamp:
+                return False
+            if slot is None:
+                slot = self._slots[mac] = _DeltaSlot(len(self._slots))
+                self._offset += self._file.write(_DEVICE.pack(HYSEN_DELTA_DEVICE, slot.slot, devtype, mac))
+            record = _encode(slot, timestamp, payload, self.keyframe_interval)
+            self._file.write(record)
+            if record[0:1] == HYSEN_DELTA_KEYFRAME:
+                self._index.write(_INDEX.pack(mac, devtype, timestamp, self._offset))
+                self.keyframes += 1
+            self._offset += len(record)
+            self.records += 1
+        return True
+
+    # Append every status read by the fleet (see HysenFleet.add_status_callback)
+    # Fleet callbacks run in concurrent workers, records are stamped when appended
+    def attach_fleet(self, fleet):
+        def append_state(device_id, changes):
+            device = fleet.devices.get(device_id)
+            if device is not None:
+                self.append(device)
+        fleet.add_status_callback(append_state)
+
+    # Append every status read by device.get_device_status
+    def attach_device(self, device):
+        device.add_status_callback(lambda device, changes: self.append(device))
+
+    # The index is written after the file, so it never points past the records written
+    def flush(self):
+        with self._lock:
+            self._file.flush()
+            self._index.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+            self._index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class HysenDeltaReader:
+    # Reads a delta encoded file written by HysenDeltaWriter, memory mapped
+    # Keyframes by device and time are loaded from the keyframe index when the file is opened,
+    # a time range is then decoded from the last keyframe before its start
+    # A file without index (or with an index from another file) is scanned once and its index written
+    # A truncated last record (e.g. writer killed) is ignored
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._data[:len(HYSEN_DELTA_MAGIC)] != HYSEN_DELTA_MAGIC:
+            self.close()
+            raise ValueError('Can\'t read delta history (%s is not a Hysen delta file)' % (
+                path))
+        self._devtypes = {}
+        self._keyframes = {}
+        self._decoders = {}
+        if not self._load_index():
+            self._devtypes = {}
+            self._keyframes = {}
+            self._index()
+            self._write_index()
+
+    # Length of the record at offset, None if truncated
+    def _record_size(self, offset):
+        data = self._data
+        tag = data[offset:offset + 1]
+        if tag == HYSEN_DELTA_SESSION:
+            size = 1
+        elif tag == HYSEN_DELTA_DEVICE:
+            size = _DEVICE.size
+        elif tag == HYSEN_DELTA_KEYFRAME:
+            if offset + _KEYFRAME.size > len(data):
+                return None
+            size = _KEYFRAME.size + data[offset + _KEYFRAME.size - 1]
+        elif tag == HYSEN_DELTA_DELTA:
+            if offset + _DELTA.size > len(data):
+                return None
+            size = _DELTA.size + 2 * data[offset + _DELTA.size - 1]
+        else:
+            raise ValueError('Can\'t read delta history (unknown record 0x%02x at %s)' % (
+                data[offset], offset))
+        if offset + size > len(data):
+            return None
+        return size
+
+    def _add_keyframe(self, device_id, devtype, timestamp, offset):
+        self._devtypes[device_id] = devtype
+        timestamps, offsets = self._keyframes.setdefault(device_id, ([], []))
+        timestamps.append(timestamp)
+        offsets.append(offset)
+
+    # Load the keyframe index, entries past the end of the file are ignored
+    # Returns False if there is no usable index
+    def _load_index(self):
+        try:
+            with open(self.path + HYSEN_DELTA_INDEX_SUFFIX, 'rb') as f:
+                index = f.read()
+        except FileNotFoundError:
+            return False
+        if index[:len(HYSEN_DELTA_INDEX_MAGIC)] != HYSEN_DELTA_INDEX_MAGIC:
+            return False
+        data = self._data
+        entries = index[len(HYSEN_DELTA_INDEX_MAGIC):]
+        for mac, devtype, timestamp, offset in _INDEX.iter_unpack(entries[:len(entries) - len(entries) % _INDEX.size]):
+            if offset + _KEYFRAME.size > len(data):
+                break
+            # an index from another file (e.g. the file was replaced) is rebuilt
+            if data[offset:offset + 1] != HYSEN_DELTA_KEYFRAME or \
+               _KEYFRAME.unpack_from(data, offset)[2] != timestamp:
+                return False
+            self._add_keyframe(''.join(format(x, '02x') for x in mac), devtype, timestamp, offset)
+        return True
+
+    # Index the keyframes by scanning the whole file
+    def _index(self):
+        data = self._data
+        offset = len(HYSEN_DELTA_MAGIC)
+        macs = {}
+        while offset < len(data):
+            size = self._record_size(offset)
+            if size is None:
+                break
+            tag = data[offset:offset + 1]
+            if tag == HYSEN_DELTA_SESSION:
+                macs = {}
+            elif tag == HYSEN_DELTA_DEVICE:
+                _, slot, devtype, mac = _DEVICE.unpack_from(data, offset)
+                macs[slot] = (mac, devtype)
+            elif tag == HYSEN_DELTA_KEYFRAME:
+                _, slot, timestamp, payload_len = _KEYFRAME.unpack_from(data, offset)
+                mac, devtype = macs[slot]
+                self._add_keyframe(''.join(format(x, '02x') for x in mac), devtype, timestamp, offset)
+            offset += size
+
+    def _write_index(self):
+        entries = sorted(
+            (offset, device_id, timestamp)
+            for device_id, (timestamps, offsets) in self._keyframes.items()
+            for timestamp, offset in zip(timestamps, offsets))
+        with open(self.path + HYSEN_DELTA_INDEX_SUFFIX, 'wb') as f:
+            f.write(HYSEN_DELTA_INDEX_MAGIC)
+            for offset, device_id, timestamp in entries:
+                f.write(_INDEX.pack(bytes.fromhex(device_id), self._devtypes[device_id], timestamp, offset))
+
+    # Devices of the file as {device_id: devtype}
+    def devices(self):
+        return dict(self._devtypes)
+
+    # Payloads of a device with start <= timestamp < end, None = unbounded, in time order
+    # Yields (timestamp, payload)
+    def payloads(self, device_id, start=None, end=None):
+        keyframes = self._keyframes.get(device_id)
+        if not keyframes or not keyframes[0]:
+            return
+        timestamps, offsets = keyframes
+        first = 0
+        if start is not None:
+            first = max(0, bisect.bisect_right(timestamps, start) - 1)
+        data = self._data
+        offset = offsets[first]
+        slot = _KEYFRAME.unpack_from(data, offset)[1]
+        payload = None
+        timestamp = None
+        while offset < len(data):
+            size = self._record_size(offset)
+            if size is None:
+                return
+            tag = data[offset:offset + 1]
+            if tag == HYSEN_DELTA_SESSION:
+                slot = None
+            elif tag == HYSEN_DELTA_DEVICE:
+                _, record_slot, devtype, mac = _DEVICE.unpack_from(data, offset)
+                if ''.join(format(x, '02x') for x in mac) == device_id:
+                    slot = record_slot
+            elif tag == HYSEN_DELTA_KEYFRAME:
+                _, record_slot, record_timestamp, payload_len = _KEYFRAME.unpack_from(data, offset)
+                if record_slot == slot:
+                    timestamp = record_timestamp
+                    payload = bytearray(data[offset + _KEYFRAME.size:offset + size])
+            elif payload is not None:
+                _, record_slot, delta_ms, count = _DELTA.unpack_from(data, offset)
+                if record_slot == slot:
+                    timestamp += delta_ms / 1000
+                    for position in range(offset + _DELTA.size, offset + size, 2):
+                        payload[data[position]] = data[position + 1]
+            if payload is not None and tag in (HYSEN_DELTA_KEYFRAME, HYSEN_DELTA_DELTA) and record_slot == slot:
+                if end is not None and timestamp >= end:
+                    return
+                if start is None or timestamp >= start:
+                    yield timestamp, bytes(payload)
+            offset += size
+
+    # Decoded status of a device with start <= timestamp < end
+    # Yields (timestamp, status dict with the fields of the device class status_snapshot)
+    def range(self, device_id, start=None, end=None):
+        decoder = self._decoder(self._devtypes.get(device_id))
+        for timestamp, payload in self.payloads(device_id, start, end):
+            decoder._decode_status(payload)
+            status = decoder.status_snapshot()
+            del status['fwversion']
+            yield timestamp, status
+
+    # Device used to decode the payloads of a device type, never connected
+    def _decoder(self, devtype):
+        decoder = self._decoders.get(devtype)
+        if decoder is None:
+            device_class = HYSEN_DEVICE_CLASSES.get(devtype)
+            if device_class is None:
+                raise ValueError('Can\'t decode delta history (unknown device type %s)' % (
+                    devtype))
+            decoder = self._decoders[devtype] = device_class(('0.0.0.0', 0), bytes(6), 0, False, 0)
+        return decoder
+
+    def close(self):
+        if self._data is not None:
+            self._data.close()
+            self._data = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,136 @@
+"""
+Hysen thermostats discovery
+Concurrent broadlink discovery restricted to Hysen device types
+"""
+
+import threading
+import queue
+
+from broadlink.const import DEFAULT_BCAST_ADDR, DEFAULT_PORT, DEFAULT_TIMEOUT
+from broadlink.device import scan
+
+from .hysenheating import HysenHeatingDevice, HYSENHEAT_DEV_TYPE
+from .hysen2pfc import Hysen2PipeFanCoilDevice, HYSEN2PFC_DEV_TYPE
+
+HYSEN_DEVICE_CLASSES = {
+    HYSENHEAT_DEV_TYPE: HysenHeatingDevice,
+    HYSEN2PFC_DEV_TYPE: Hysen2PipeFanCoilDevice,
+}
+
+# Run one broadlink scan and put every Hysen response in the results queue
+# Non Hysen device types are dropped here, so they never reach the consumer
+# The probe gives up as soon as stop is set (checked on every response)
+# A None marks the end of the probe, whatever the reason (timeout, stop or socket error)
+def _probe(results, stop, timeout, local_ip_address, discover_ip_address, discover_ip_port):
+    try:
+        for devtype, host, mac, name, is_locked in scan(
+            timeout,
+            local_ip_address,
+            discover_ip_address,
+            discover_ip_port):
+            if stop.is_set():
+                break
+            if devtype in HYSEN_DEVICE_CLASSES:
+                results.put((devtype, host, mac))
+    except OSError:
+        pass
+    finally:
+        results.put(None)
+
+# Start one probe thread for every local address / discover address pair
+# Returns the number of started probes
+def _start_probes(results, stop, timeout, local_ip_addresses, discover_ip_addresses, discover_ip_port):
+    if not local_ip_addresses:
+        local_ip_addresses = [None]
+    if not discover_ip_addresses:
+        discover_ip_addresses = [DEFAULT_BCAST_ADDR]
+    probes = 0
+    for local_ip_address in local_ip_addresses:
+        for discover_ip_address in discover_ip_addresses:
+            threading.Thread(
+                target=_probe,
+                args=(
+                    results,
+                    stop,
+                    timeout,
+                    local_ip_address,
+                    discover_ip_address,
+                    discover_ip_port),
+                daemon=True).start()
+            probes += 1
+    return probes
+
+# Discover Hysen thermostats
+# Probes are sent concurrently from every local_ip_addresses entry
+# to every discover_ip_addresses entry (e.g. several interfaces and subnet broadcasts)
+# Only HYSENHEAT_DEV_TYPE and HYSEN2PFC_DEV_TYPE responses are kept
+# Returns a generator that yields a ready device object as soon as it answers,
+# a device answering on several probes is yielded only once
+# device_timeout, sync_clock and sync_hour are passed to the device constructor
+def discover(
+    timeout=DEFAULT_TIMEOUT,
+    local_ip_addresses=None,
+    discover_ip_addresses=None,
+    discover_ip_port=DEFAULT_PORT,
+    device_timeout=DEFAULT_TIMEOUT,
+    sync_clock=False,
+    sync_hour=0):
+    results = queue.Queue()
+    stop = threading.Event()
+    running = _start_probes(
+        results,
+        stop,
+        timeout,
+        local_ip_addresses,
+        discover_ip_addresses,
+        discover_ip_port)
+    discovered = set()
+    try:
+        while running:
+            response = results.get()
+            if response is None:
+                running -= 1
+                continue
+            devtype, host, mac = response
+            if mac in discovered:
+                continue
+            discovered.add(mac)
+            yield HYSEN_DEVICE_CLASSES[devtype](
+                host,
+                mac,
+                device_timeout,
+                sync_clock,
+                sync_hour)
+    finally:
+        stop.set()
+
+# Look up the current host of a single Hysen thermostat by its MAC address
+# Same concurrent probes as discover(), but no device object is built
+# and the lookup ends as soon as the requested device answers
+# Returns the (ip, port) tuple of the device, or None if it did not answer within timeout
+def find_host(
+    mac,
+    timeout=DEFAULT_TIMEOUT,
+    local_ip_addresses=None,
+    discover_ip_addresses=None,
+    discover_ip_port=DEFAULT_PORT):
+    mac = bytes(mac)
+    results = queue.Queue()
+    stop = threading.Event()
+    running = _start_probes(
+        results,
+        stop,
+        timeout,
+        local_ip_addresses,
+        discover_ip_addresses,
+        discover_ip_port)
+    try:
+        while running:
+            response = results.get()
+            if response is None:
+                running -= 1
+            elif bytes(response[2]) == mac:
+                return response[1]
+        return None
+    finally:
+        stop.set()
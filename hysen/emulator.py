@@ -0,0 +1,383 @@
+"""
+Hysen thermostats emulator
+Local UDP emulator of Hysen HY03-x-Wifi (heating) and HY03AC-x-Wifi (2 pipe fan coil) devices
+speaking the broadlink handshake and the Hysen read (0x03), write (0x06) and multi-write (0x10) commands
+"""
+
+import os
+import random
+import selectors
+import socket
+import threading
+import time
+from datetime import datetime
+
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+from .hysendevice import crc16
+from .hysenheating import HYSENHEAT_DEV_TYPE
+from .hysen2pfc import HYSEN2PFC_DEV_TYPE, HYSEN2PFC_MODE_COOL, HYSEN2PFC_MODE_HEAT
+
+EMULATOR_INIT_KEY               = bytes.fromhex('097628343fe99e23765c1513accf8b02')
+EMULATOR_INIT_VECT              = bytes.fromhex('562e17996d093d28ddb3ba695a2e6f58')
+EMULATOR_MAGIC                  = bytes.fromhex('5aa5aa555aa5aa55')
+
+EMULATOR_HELLO                  = 0x06
+EMULATOR_AUTH                   = 0x65
+EMULATOR_COMMAND                = 0x6A
+EMULATOR_AUTH_RESPONSE          = 0x3E9
+EMULATOR_COMMAND_RESPONSE       = 0x3EE
+EMULATOR_FWVERSION              = 0x68
+
+EMULATOR_ERROR_UNKNOWN_COMMAND  = 0x01
+EMULATOR_ERROR_LENGTH           = 0x02
+EMULATOR_ERROR_WRONG_LENGTH     = 0x03
+
+EMULATOR_DEFAULT_FWVERSION      = 53
+EMULATOR_AMBIENT_TEMP           = 16.0
+EMULATOR_HEATING_RATE           = 2.0   # degrees Celsius per hour when the valve is on
+EMULATOR_COOLING_RATE           = 2.0   # degrees Celsius per hour when the valve is on
+EMULATOR_DRIFT_RATE             = 0.5   # degrees Celsius per hour towards ambient when the valve is off
+
+# Memory layouts, memory byte n is byte n+3 of a 0x03 read response (see get_device_status)
+# Each layout is (number of words, default memory, writable bits of each byte)
+# Bytes and bits not writable are owned by the device (room temperature, valve, counters)
+
+# Heating, 0x17 words
+# 0xr, 0xavp, Rt, Tt, 0xlm, Sen, Osv, Dif, Svh, Svl, AdjMSB, AdjLSB, Fre, POn, Unk1, Ext, hh, mm, ss, wd,
+# P1h, P1m, P2h, P2m, P3h, P3m, P4h, P4m, P5h, P5m, P6h, P6m, weP1h, weP1m, weP2h, weP2m,
+# P1t, P2t, P3t, P4t, P5t, P6t, weP1t, weP2t, Unk2, Unk3
+EMULATOR_HEATING_LAYOUT = (
+    0x17,
+    bytes([
+        0x00, 0x01, 40, 44, 0x30, 0x00, 42, 2, 35, 5, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0, 0, 0, 1,
+        6, 0, 8, 0, 11, 30, 12, 30, 17, 30, 22, 0, 8, 0, 23, 0,
+        40, 30, 30, 30, 44, 30, 44, 30, 0x01, 0x02]),
+    bytes([
+        0x01, 0x01, 0x00, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0x00, 0x00, 0xFF, 0xFF, 0xFF, 0xFF,
+        0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF,
+        0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0x00, 0x00]))
+
+# 2 pipe fan coil, 0x10 words
+# 0xrk, 0xvp, Mod, Fs, Rt, Tt, Dif, Adj, Sh1, Sl1, Sh2, Sl2, Fan, Fre, hh, mm, ss, wd, Unk, Lm,
+# P1OnH, P1OnMin, P1OffH, P1OffM, P2OnH, P2OnMin, P2OffH, P2OffM, Tv1, Tv2, Tv3, Tv4
+EMULATOR_2PFC_LAYOUT = (
+    0x10,
+    bytes([
+        0x00, 0x01, 0x02, 0x01, 24, 22, 0x01, 0x00, 40, 10, 40, 10, 0x00, 0x01, 0, 0, 0, 1, 0x00, 0x00,
+        8, 0, 11, 30, 12, 30, 17, 30, 0, 0, 0, 0]),
+    bytes([
+        0x13, 0x01, 0xFF, 0xFF, 0x00, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF,
+        0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0x00, 0x00, 0x00, 0x00]))
+
+EMULATOR_LAYOUTS = {
+    HYSENHEAT_DEV_TYPE: EMULATOR_HEATING_LAYOUT,
+    HYSEN2PFC_DEV_TYPE: EMULATOR_2PFC_LAYOUT,
+}
+
+# memory offset of the clock (hh, mm, ss, wd)
+EMULATOR_CLOCK_OFFSET = {
+    HYSENHEAT_DEV_TYPE: 16,
+    HYSEN2PFC_DEV_TYPE: 14,
+}
+
+EMULATOR_WEEK_SECONDS           = 7 * 24 * 3600
+
+_mac_counter = 0
+
+# A MAC address unique within the process, in a locally administered range
+def _next_mac():
+    global _mac_counter
+    _mac_counter += 1
+    return bytes([0x02, 0x48, 0x59]) + _mac_counter.to_bytes(3, 'big')
+
+def _aes(key, payload, encrypt):
+    cipher = Cipher(algorithms.AES(key), modes.CBC(EMULATOR_INIT_VECT), backend=default_backend())
+    context = cipher.encryptor() if encrypt else cipher.decryptor()
+    return context.update(bytes(payload)) + context.finalize()
+
+def _checksum(packet):
+    return sum(packet, 0xBEAF) & 0xFFFF
+
+class HysenEmulatedDevice:
+    # A virtual Hysen thermostat
+    # memory holds the word addressed register memory read by get_device_status
+    # time_scale speeds up the simulated room (e.g. 3600 = one simulated hour per second)
+    def __init__(self, devtype, mac=None, name='', fwversion=EMULATOR_DEFAULT_FWVERSION, time_scale=1.0):
+        if devtype not in EMULATOR_LAYOUTS:
+            raise ValueError(
+                'Can\'t emulate device type (%s) outside supported values (%s), (%s).' % ( \
+                hex(devtype),
+                hex(HYSENHEAT_DEV_TYPE),
+                hex(HYSEN2PFC_DEV_TYPE)))
+        self.devtype = devtype
+        self.mac = bytes(mac) if mac is not None else _next_mac()
+        self.name = name
+        self.fwversion = fwversion
+        self.time_scale = time_scale
+        self.host = None
+        self.words, default_memory, self._writable = EMULATOR_LAYOUTS[devtype]
+        self.memory = bytearray(default_memory)
+        self.requests = 0
+        self._id = random.randint(1, 0xFFFFFFFF)
+        self._session_key = os.urandom(16)
+        self._key = EMULATOR_INIT_KEY
+        self._clock_offset = 0
+        self._last_update = time.monotonic()
+        self._valve_time = 0.0
+        if devtype == HYSENHEAT_DEV_TYPE:
+            self.room_temp = self.memory[2] / 2.0
+        else:
+            self.room_temp = float(self.memory[4])
+        self._lock = threading.Lock()
+
+    # Answer a packet received from the network
+    # Returns the response packet, or None if the packet has to be ignored
+    def handle(self, packet):
+        with self._lock:
+            if len(packet) == 0x30 and packet[0x26] == EMULATOR_HELLO:
+                return self._hello_response()
+            if len(packet) < 0x38 or packet[0x00:0x08] != EMULATOR_MAGIC:
+                return None
+            if int.from_bytes(packet[0x20:0x22], 'little') != \
+               (_checksum(packet) - sum(packet[0x20:0x22])) & 0xFFFF:
+                return None
+            packet_type = int.from_bytes(packet[0x26:0x28], 'little')
+            count = packet[0x28:0x2A]
+            if packet_type == EMULATOR_AUTH:
+                self._key = EMULATOR_INIT_KEY
+                payload = bytearray(0x20)
+                payload[0x00:0x04] = self._id.to_bytes(4, 'little')
+                payload[0x04:0x14] = self._session_key
+                response = self._packet(EMULATOR_AUTH_RESPONSE, count, payload)
+                self._key = self._session_key
+                return response
+            if packet_type == EMULATOR_COMMAND:
+                if int.from_bytes(packet[0x30:0x34], 'little') != self._id:
+                    return None
+                if len(packet) == 0x38 or (len(packet) - 0x38) % 16:
+                    return None
+                request = _aes(self._key, packet[0x38:], False)
+                if request[0] == EMULATOR_FWVERSION:
+                    payload = bytearray(0x10)
+                    payload[0x04:0x06] = self.fwversion.to_bytes(2, 'little')
+                    return self._packet(EMULATOR_COMMAND_RESPONSE, count, payload)
+                payload = self._hysen_response(request)
+                if payload is None:
+                    return None
+                return self._packet(EMULATOR_COMMAND_RESPONSE, count, payload)
+            return None
+
+    def _hello_response(self):
+        response = bytearray(0x80)
+        response[0x34:0x36] = self.devtype.to_bytes(2, 'little')
+        response[0x3A:0x40] = self.mac[::-1]
+        name = self.name.encode()[:0x3E]
+        response[0x40:0x40 + len(name)] = name
+        response[0x20:0x22] = _checksum(response).to_bytes(2, 'little')
+        return bytes(response)
+
+    def _packet(self, packet_type, count, payload):
+        payload = bytes(payload) + bytes((16 - len(payload)) % 16)
+        packet = bytearray(0x38)
+        packet[0x00:0x08] = EMULATOR_MAGIC
+        packet[0x24:0x26] = self.devtype.to_bytes(2, 'little')
+        packet[0x26:0x28] = packet_type.to_bytes(2, 'little')
+        packet[0x28:0x2A] = count
+        packet[0x2A:0x30] = self.mac[::-1]
+        packet[0x30:0x34] = self._id.to_bytes(4, 'little')
+        packet[0x34:0x36] = _checksum(payload).to_bytes(2, 'little')
+        packet.extend(_aes(self._key, payload, True))
+        packet[0x20:0x22] = _checksum(packet).to_bytes(2, 'little')
+        return bytes(packet)
+
+    # Execute a Hysen frame (length, 0x00, command, CRC) and return the response frame
+    # Frames with a wrong length or CRC are ignored, like the devices do
+    def _hysen_response(self, frame):
+        frame_len = frame[0]
+        if frame_len < 4 or frame_len + 2 > len(frame):
+            return None
+        command = frame[2:frame_len]
+        crc = crc16(command)
+        if frame[frame_len] != crc & 0xFF or frame[frame_len + 1] != (crc >> 8) & 0xFF:
+            return None
+        self.requests += 1
+        response = self.execute(command)
+        crc = crc16(response)
+        return bytes([len(response) + 2, 0x00]) + response + bytes([crc & 0xFF, (crc >> 8) & 0xFF])
+
+    # Execute a Hysen command on the register memory and return the response bytes
+    def execute(self, command):
+        if len(command) < 2 or command[0] != 0x01:
+            return bytes([0x01, 0x80, EMULATOR_ERROR_UNKNOWN_COMMAND])
+        command_type = command[1]
+        if command_type == 0x03:
+            if len(command) != 6:
+                return bytes([0x01, 0x83, EMULATOR_ERROR_WRONG_LENGTH])
+            index = command[3]
+            words = command[5]
+            if words == 0 or index + words > self.words:
+                return bytes([0x01, 0x83, EMULATOR_ERROR_LENGTH])
+            self.update()
+            return bytes([0x01, 0x03, 2 * words]) + bytes(self.memory[2 * index:2 * (index + words)])
+        if command_type == 0x06:
+            if len(command) != 6:
+                return bytes([0x01, 0x86, EMULATOR_ERROR_WRONG_LENGTH])
+            index = command[3]
+            if index >= self.words:
+                return bytes([0x01, 0x86, EMULATOR_ERROR_LENGTH])
+            self.update()
+            self._write(2 * index, command[4:6])
+            return bytes(command)
+        if command_type == 0x10:
+            if len(command) < 7:
+                return bytes([0x01, 0x90, EMULATOR_ERROR_WRONG_LENGTH])
+            index = command[3]
+            words = command[5]
+            if command[6] != 2 * words or len(command) != 7 + 2 * words:
+                return bytes([0x01, 0x90, EMULATOR_ERROR_WRONG_LENGTH])
+            if words == 0 or index + words > self.words:
+                return bytes([0x01, 0x90, EMULATOR_ERROR_LENGTH])
+            self.update()
+            self._write(2 * index, command[7:])
+            return bytes(command[0:6])
+        return bytes([0x01, 0x80 | command_type, EMULATOR_ERROR_UNKNOWN_COMMAND])
+
+    # Write bytes at a memory offset, keeping the bits owned by the device
+    def _write(self, offset, data):
+        clock = EMULATOR_CLOCK_OFFSET[self.devtype]
+        for position, value in enumerate(data, offset):
+            writable = self._writable[position]
+            self.memory[position] = (self.memory[position] & ~writable & 0xFF) | (value & writable)
+        if offset < clock + 4 and offset + len(data) > clock:
+            hour, minute, second, weekday = self.memory[clock:clock + 4]
+            set_seconds = (((weekday - 1) * 24 + hour) * 60 + minute) * 60 + second
+            self._clock_offset = set_seconds - self._week_seconds(0)
+
+    def _week_seconds(self, offset):
+        now = datetime.now()
+        seconds = (((now.isoweekday() - 1) * 24 + now.hour) * 60 + now.minute) * 60 + now.second
+        return (seconds + offset) % EMULATOR_WEEK_SECONDS
+
+    # Advance the simulated room since the last update
+    # The valve opens when the room temperature is beyond target by more than half the hysteresis
+    # and closes once target is reached, the room then drifts back to ambient
+    # The 2 pipe fan coil counts the seconds its valve is on
+    def update(self):
+        now = time.monotonic()
+        hours = (now - self._last_update) * self.time_scale / 3600.0
+        self._last_update = now
+        memory = self.memory
+        if self.devtype == HYSENHEAT_DEV_TYPE:
+            power = memory[1] & 0x01
+            target = memory[3] / 2.0
+            hysteresis = memory[7] / 2.0
+            heating = power
+            cooling = False
+        else:
+            power = memory[1] & 0x01
+            target = float(memory[5])
+            hysteresis = 1.0 if memory[6] else 0.5
+            heating = power and memory[2] == HYSEN2PFC_MODE_HEAT
+            cooling = power and memory[2] == HYSEN2PFC_MODE_COOL
+        valve = (memory[1] >> 4) & 0x01
+        if heating:
+            if self.room_temp < target - hysteresis / 2:
+                valve = 1
+            elif self.room_temp >= target:
+                valve = 0
+        elif cooling:
+            if self.room_temp > target + hysteresis / 2:
+                valve = 1
+            elif self.room_temp <= target:
+                valve = 0
+        else:
+            valve = 0
+        if valve and heating:
+            self.room_temp += EMULATOR_HEATING_RATE * hours
+        elif valve and cooling:
+            self.room_temp -= EMULATOR_COOLING_RATE * hours
+        elif self.room_temp > EMULATOR_AMBIENT_TEMP:
+            self.room_temp = max(EMULATOR_AMBIENT_TEMP, self.room_temp - EMULATOR_DRIFT_RATE * hours)
+        else:
+            self.room_temp = min(EMULATOR_AMBIENT_TEMP, self.room_temp + EMULATOR_DRIFT_RATE * hours)
+        memory[1] = (memory[1] & 0xEF) | (valve << 4)
+        if valve:
+            self._valve_time += hours * 3600
+        clock = EMULATOR_CLOCK_OFFSET[self.devtype]
+        seconds = self._week_seconds(self._clock_offset)
+        memory[clock:clock + 4] = bytes([
+            (seconds // 3600) % 24,
+            (seconds // 60) % 60,
+            seconds % 60,
+            seconds // 86400 + 1])
+        if self.devtype == HYSENHEAT_DEV_TYPE:
+            memory[2] = max(0, min(0xFF, int(round(self.room_temp * 2))))
+        else:
+            memory[4] = max(0, min(0xFF, int(round(self.room_temp))))
+            memory[28:32] = (int(self._valve_time) & 0xFFFFFFFF).to_bytes(4, 'big')
+
+class HysenEmulator:
+    # UDP server running virtual Hysen thermostats, each on its own port of host
+    # Devices answer directed discovery (hello), authentication and Hysen commands
+    def __init__(self, host='127.0.0.1'):
+        self.host = host
+        self.devices = []
+        self._selector = selectors.DefaultSelector()
+        self._sockets = []
+        self._thread = None
+        self._running = False
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    # Add a virtual device listening on port (0 = any free port)
+    # The device's host (ip, port) is set once it is bound
+    def add_device(self, devtype, mac=None, port=0, name='', fwversion=EMULATOR_DEFAULT_FWVERSION, time_scale=1.0):
+        device = HysenEmulatedDevice(devtype, mac, name, fwversion, time_scale)
+        conn = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        conn.bind((self.host, port))
+        conn.setblocking(False)
+        device.host = conn.getsockname()
+        self._sockets.append(conn)
+        self._selector.register(conn, selectors.EVENT_READ, device)
+        self.devices.append(device)
+        return device
+
+    # Add count virtual devices of the same type, each on an ephemeral port of its own
+    def add_devices(self, devtype, count, time_scale=1.0):
+        return [self.add_device(devtype, time_scale=time_scale) for _ in range(count)]
+
+    # Serve requests in a background thread
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        for conn in self._sockets:
+            self._selector.unregister(conn)
+            conn.close()
+        self._sockets = []
+
+    def serve_forever(self, poll_interval=0.1):
+        while self._running:
+            for key, _ in self._selector.select(poll_interval):
+                try:
+                    packet, address = key.fileobj.recvfrom(2048)
+                except OSError:
+                    continue
+                response = key.data.handle(packet)
+                if response is not None:
+                    key.fileobj.sendto(response, address)
@@ -0,0 +1,117 @@
+"""
+Hysen thermostats Prometheus exporter
+Serves the cached state of a HysenFleet in Prometheus text format,
+scrapes are answered from memory and never reach the devices
+"""
+
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+HYSEN_EXPORTER_DEFAULT_HOST     = '127.0.0.1'
+HYSEN_EXPORTER_DEFAULT_PORT     = 9468
+HYSEN_EXPORTER_CONTENT_TYPE     = 'text/plain; version=0.0.4; charset=utf-8'
+
+# (metric name, type, help, status field)
+# Devices without the field (e.g. external_temp on 2 pipe fan coil) are left out of the metric
+HYSEN_EXPORTER_STATUS_METRICS = (
+    ('hysen_room_temperature_celsius', 'gauge', 'Room temperature.', 'room_temp'),
+    ('hysen_target_temperature_celsius', 'gauge', 'Target temperature.', 'target_temp'),
+    ('hysen_external_temperature_celsius', 'gauge', 'External sensor temperature.', 'external_temp'),
+    ('hysen_valve_state', 'gauge', 'Valve state, 1 = on.', 'valve_state'),
+    ('hysen_power_state', 'gauge', 'Power state, 1 = on.', 'power_state'),
+    ('hysen_operation_mode', 'gauge', 'Operation mode (device specific value).', 'operation_mode'),
+    ('hysen_time_valve_on_seconds_total', 'counter', 'Total time the valve has been on.', 'time_valve_on'),
+)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _labels(state):
+    return '{device_id="%s",model="%s"}' % (_escape(state.device_id), _escape(state.model))
+
+def _format_value(value):
+    return repr(float(value))
+
+# Render the fleet's cached state in Prometheus text exposition format
+def render_metrics(fleet):
+    version, states = fleet.snapshot()
+    lines = []
+    for name, metric_type, help_text, field in HYSEN_EXPORTER_STATUS_METRICS:
+        samples = [
+            '%s%s %s' % (name, _labels(state), _format_value(state.status[field]))
+            for state in states
+            if state.status is not None and field in state.status]
+        if samples:
+            lines.append('# HELP %s %s' % (name, help_text))
+            lines.append('# TYPE %s %s' % (name, metric_type))
+            lines.extend(samples)
+    poll_metrics = (
+        ('hysen_up', 'gauge', 'Whether the last poll of the device succeeded.',
+         lambda state: 1 if state.ok else 0),
+        ('hysen_poll_latency_seconds', 'gauge', 'Duration of the last poll.',
+         lambda state: state.poll_latency),
+        ('hysen_last_poll_timestamp_seconds', 'gauge', 'Time of the last successful poll.',
+         lambda state: state.updated),
+        ('hysen_polls_total', 'counter', 'Polls of the device.',
+         lambda state: state.polls),
+        ('hysen_poll_errors_total', 'counter', 'Failed polls of the device.',
+         lambda state: state.errors),
+    )
+    for name, metric_type, help_text, value in poll_metrics:
+        lines.append('# HELP %s %s' % (name, help_text))
+        lines.append('# TYPE %s %s' % (name, metric_type))
+        for state in states:
+            sample = value(state)
+            if sample is not None:
+                lines.append('%s%s %s' % (name, _labels(state), _format_value(sample)))
+    return version, ('\n'.join(lines) + '\n').encode('utf-8')
+
+class HysenPrometheusExporter:
+    # Small HTTP server answering GET /metrics with render_metrics(fleet)
+    # The rendered page is kept until the fleet version changes
+    def __init__(self, fleet, host=HYSEN_EXPORTER_DEFAULT_HOST, port=HYSEN_EXPORTER_DEFAULT_PORT):
+        self.fleet = fleet
+        self._page = (None, b'')
+        self._page_lock = threading.Lock()
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/metrics', '/'):
+                    self.send_error(404)
+                    return
+                body = exporter.metrics()
+                self.send_response(200)
+                self.send_header('Content-Type', HYSEN_EXPORTER_CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self.host, self.port = self._server.server_address[:2]
+        self._thread = None
+
+    # Current metrics page, rendered again only if the fleet changed
+    def metrics(self):
+        with self._page_lock:
+            version, page = self._page
+            if version != self.fleet.version:
+                self._page = render_metrics(self.fleet)
+                page = self._page[1]
+            return page
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._server.shutdown()
+            self._thread.join()
+            self._thread = None
+        self._server.server_close()
@@ -0,0 +1,334 @@
+"""
+Hysen thermostats fleet
+Polls many devices and keeps their last known state in memory
+"""
+
+import copy
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .hysendevice import status_delta
+from .watch import HysenWatch
+from .hysenheating import HYSENHEAT_DEV_TYPE
+from .hysen2pfc import HYSEN2PFC_DEV_TYPE
+
+HYSEN_FLEET_DEFAULT_WORKERS     = 8
+HYSEN_FLEET_DEFAULT_INTERVAL    = 60
+
+# Status fields indexed by the fleet (see HysenFleet.find), besides model and zone
+HYSEN_FLEET_INDEXED_FIELDS = (
+    'operation_mode',
+    'power_state',
+    'valve_state',
+    'fan_mode',
+    'schedule',
+    'sensor',
+)
+
+HYSEN_MODELS = {
+    HYSENHEAT_DEV_TYPE: 'heating',
+    HYSEN2PFC_DEV_TYPE: '2pfc',
+}
+
+class HysenDeviceState:
+    # Last known state of a fleet device
+    # status = status_snapshot() of the last successful poll, None before the first one
+    # status is replaced by a new dict on every successful poll, never modified
+    # changes = fields of status changed by the last successful poll (every field after the first one)
+    # changed = time of the last successful poll that changed something
+    # zone = user assigned zone (any hashable value), None if not assigned
+    # version = fleet version of the last change of this state (every poll changes polls, updated, poll_latency)
+    # revision = fleet revision of the last change of its model, zone, status, ok or errors, not moved by polls
+    #            that changed nothing (e.g. for HTTP ETags, see gateway.py)
+    # poll_latency = duration in seconds of the last poll, successful or not
+    # ok = whether the last poll succeeded, last_error = error of the last failed poll
+    def __init__(self, device, zone=None):
+        self.device_id = device.unique_id
+        self.model = HYSEN_MODELS.get(device.devtype, hex(device.devtype))
+        self.zone = zone
+        self.version = 0
+        self.revision = 0
+        self.status = None
+        self.changes = {}
+        self.updated = None
+        self.changed = None
+        self.poll_latency = None
+        self.polls = 0
+        self.errors = 0
+        self.ok = False
+        self.last_error = None
+
+class HysenFleet:
+    # A set of devices polled concurrently by workers threads
+    # Readers get the cached state from states (device_id -> HysenDeviceState) without touching devices
+    # version increases whenever the cached state changes, revision only when something else than the poll
+    # counters and times of a device changes (a device added or removed, a zone, a status, an error)
+    # Change callbacks (see add_change_callback) get only the fields changed by each poll
+    # model, zone and the HYSEN_FLEET_INDEXED_FIELDS are indexed (value -> device ids) from the poll changes,
+    # find returns the matching devices without looking at the others
+    # Each device has a lock (see device_lock) held while it is polled, other users of the device
+    # (e.g. the gateway writes) take it too so a device runs one exchange at a time
+    def __init__(self, devices=None, workers=HYSEN_FLEET_DEFAULT_WORKERS):
+        self.devices = {}
+        self.states = {}
+        self._device_locks = {}
+        self.version = 0
+        self.revision = 0
+        self._workers = workers
+        self._executor = None
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self._change_callbacks = []
+        self._status_callbacks = []
+        self._indexes = {field: {} for field in ('model', 'zone') + HYSEN_FLEET_INDEXED_FIELDS}
+        for device in devices or []:
+            self.add_device(device)
+
+    def _index_add(self, field, value, device_id):
+        self._indexes[field].setdefault(value, set()).add(device_id)
+
+    def _index_discard(self, field, value, device_id):
+        device_ids = self._indexes[field].get(value)
+        if device_ids is not None:
+            device_ids.discard(device_id)
+            if not device_ids:
+                del self._indexes[field][value]
+
+    def _unindex(self, state):
+        self._index_discard('model', state.model, state.device_id)
+        self._index_discard('zone', state.zone, state.device_id)
+        if state.status is not None:
+            for field in HYSEN_FLEET_INDEXED_FIELDS:
+                if field in state.status:
+                    self._index_discard(field, state.status[field], state.device_id)
+
+    def add_device(self, device, zone=None):
+        with self._lock:
+            state = self.states.get(device.unique_id)
+            if state is not None:
+                self._unindex(state)
+            state = HysenDeviceState(device, zone)
+            self.devices[device.unique_id] = device
+            self.states[device.unique_id] = state
+            self._device_locks.setdefault(device.unique_id, threading.RLock())
+            self._index_add('model', state.model, state.device_id)
+            self._index_add('zone', state.zone, state.device_id)
+            self.version += 1
+            state.version = self.version
+            self.revision += 1
+            state.revision = self.revision
+
+    def remove_device(self, device_id):
+        with self._lock:
+            self._unindex(self.states[device_id])
+            del self.devices[device_id]
+            del self.states[device_id]
+            del self._device_locks[device_id]
+            self.version += 1
+            self.revision += 1
+
+    def set_zone(self, device_id, zone):
+        with self._lock:
+            state = self.states[device_id]
+            self._index_discard('zone', state.zone, device_id)
+            state.zone = zone
+            self._index_add('zone', zone, device_id)
+            self.version += 1
+            state.version = self.version
+            self.revision += 1
+            state.revision = self.revision
+
+    # Device ids matching every criterion (field=value) on model, zone or HYSEN_FLEET_INDEXED_FIELDS,
+    # e.g. find(model='2pfc', operation_mode=HYSEN2PFC_MODE_COOL, valve_state=HYSEN2PFC_VALVE_ON)
+    # The index sets are intersected smallest first, devices never polled successfully only match model and zone
+    # Returns a set of device ids
+    def find(self, **criteria):
+        with self._lock:
+            matches = []
+            for field, value in criteria.items():
+                index = self._indexes.get(field)
+                if index is None:
+                    raise ValueError('Can\'t find devices (%s is not indexed)' % (
+                        field))
+                matches.append(index.get(value, ()))
+            if not matches:
+                return set(self.states)
+            matches.sort(key=len)
+            return set(matches[0]).intersection(*matches[1:])
+
+    # Number of devices of each value of an indexed field, as {value: count}
+    def counts(self, field):
+        with self._lock:
+            index = self._indexes.get(field)
+            if index is None:
+                raise ValueError('Can\'t count devices (%s is not indexed)' % (
+                    field))
+            return {value: len(device_ids) for value, device_ids in index.items()}
+
+    # Register a callback called as callback(device_id, changes) after a poll that changed something
+    # changes = {field: new value}, every field on the first successful poll of a device
+    # Callbacks run in the polling worker threads, they should be quick
+    def add_change_callback(self, callback):
+        self._change_callbacks.append(callback)
+
+    def remove_change_callback(self, callback):
+        self._change_callbacks.remove(callback)
+
+    # Register a callback called as callback(device_id, changes) after every successful poll,
+    # changes is empty if nothing changed (e.g. to sample time series)
+    def add_status_callback(self, callback):
+        self._status_callbacks.append(callback)
+
+    def remove_status_callback(self, callback):
+        self._status_callbacks.remove(callback)
+
+    # Lock of a device (a reentrant lock), hold it to use the device without racing the fleet polls
+    # Raises KeyError if the device is unknown
+    def device_lock(self, device_id):
+        with self._lock:
+            return self._device_locks[device_id]
+
+    # Read the status of one device and update its cached state
+    # Errors are counted in the device state, not raised
+    # Returns True if the poll succeeded
+    def poll_device(self, device_id):
+        with self._lock:
+            device = self.devices.get(device_id)
+            device_lock = self._device_locks.get(device_id)
+        if device is None:
+            return False
+        with device_lock:
+            changes = self._poll_device(device_id, device)
+        if changes:
+            for callback in list(self._change_callbacks):
+                callback(device_id, changes)
+        if changes is not None:
+            for callback in list(self._status_callbacks):
+                callback(device_id, changes)
+        return changes is not None
+
+    # Poll a device and update its state, under the device lock
+    # Returns the changes, None if the poll failed
+    def _poll_device(self, device_id, device):
+        start = time.perf_counter()
+        try:
+            device.get_device_status()
+            status = device.status_snapshot()
+            error = None
+        except Exception as err:
+            status = None
+            error = err
+        latency = time.perf_counter() - start
+        changes = None
+        with self._lock:
+            state = self.states.get(device_id)
+            if state is None:
+                return None
+            state.polls += 1
+            state.poll_latency = latency
+            revised = state.ok != (error is None)
+            state.ok = error is None
+            if error is None:
+                changes = status_delta(state.status, status)
+                for field in HYSEN_FLEET_INDEXED_FIELDS:
+                    if field in changes:
+                        if state.status is not None:
+                            self._index_discard(field, state.status[field], device_id)
+                        self._index_add(field, changes[field], device_id)
+                state.status = status
+                state.changes = changes
+                state.updated = time.time()
+                if changes:
+                    state.changed = state.updated
+                    revised = True
+            else:
+                state.errors += 1
+                state.last_error = error
+                revised = True
+            self.version += 1
+            state.version = self.version
+            if revised:
+                self.revision += 1
+                state.revision = self.revision
+        return changes
+
+    # Poll every device once, concurrently
+    # Returns the number of successful polls
+    def poll(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self._workers)
+        with self._lock:
+            device_ids = list(self.devices)
+        return sum(self._executor.map(self.poll_device, device_ids))
+
+    # Poll every interval seconds in a background thread
+    def start(self, interval=HYSEN_FLEET_DEFAULT_INTERVAL):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(interval,), daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def _run(self, interval):
+        while not self._stop.is_set():
+            start = time.monotonic()
+            self.poll()
+            self._stop.wait(max(0.0, interval - (time.monotonic() - start)))
+
+    # Poll every device every interval seconds, as an iterable and an async iterable (see watch.HysenWatch)
+    # Yields {device_id: status} of the devices read so far (status dicts are shared, not copied),
+    # or with changes=True {device_id: changed fields} of the devices changed since the previous item,
+    # cycles that changed nothing are then skipped
+    def watch(self, interval=HYSEN_FLEET_DEFAULT_INTERVAL, changes=False):
+        if not changes:
+            def poll():
+                self.poll()
+                with self._lock:
+                    return {
+                        device_id: state.status
+                        for device_id, state in self.states.items()
+                        if state.status is not None}
+            return HysenWatch(poll, interval)
+
+        collected = {}
+        collected_lock = threading.Lock()
+
+        def collect(device_id, device_changes):
+            with collected_lock:
+                collected.setdefault(device_id, {}).update(device_changes)
+
+        def poll():
+            self.poll()
+            with collected_lock:
+                delta = dict(collected)
+                collected.clear()
+            return delta or None
+
+        return HysenWatch(
+            poll,
+            interval,
+            on_start=lambda: self.add_change_callback(collect),
+            on_end=lambda: self.remove_change_callback(collect))
+
+    # Copy of the cached state of a device, None if unknown
+    def state(self, device_id):
+        with self._lock:
+            state = self.states.get(device_id)
+            return copy.copy(state) if state is not None else None
+
+    # Consistent copy of the cached states, with the version they correspond to
+    # status dicts are replaced on every poll, never modified, so they are shared, not copied
+    def snapshot(self):
+        with self._lock:
+            return self.version, [copy.copy(state) for state in self.states.values()]
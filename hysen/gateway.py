@@ -0,0 +1,320 @@
+"""
+Hysen thermostats HTTP gateway
+One process owns the device sessions (a HysenFleet) and serves their cached state as JSON to any number of clients,
+writes are funneled through one queue per device
+"""
+
+import collections
+import inspect
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .fleet import HYSEN_FLEET_DEFAULT_INTERVAL
+from .stream import HYSEN_STREAM_CONTENT_TYPE, HYSEN_STREAM_SEND_TIMEOUT, HysenChangeStream
+
+HYSEN_GATEWAY_DEFAULT_HOST      = '127.0.0.1'
+HYSEN_GATEWAY_DEFAULT_PORT      = 9469
+HYSEN_GATEWAY_DEFAULT_WORKERS   = 4
+HYSEN_GATEWAY_WRITE_TIMEOUT     = 30
+HYSEN_GATEWAY_WRITE_BATCH       = 8
+HYSEN_GATEWAY_CONTENT_TYPE      = 'application/json'
+
+# Cached state of a device as a JSON serializable dict
+# Only the fields that move the state revision, so the page (and its ETag) stays the same across polls
+# that changed nothing, poll counters and times are exported by exporter.py
+def state_dict(state):
+    return {
+        'device_id': state.device_id,
+        'model': state.model,
+        'zone': state.zone,
+        'status': state.status,
+        'changed': state.changed,
+        'ok': state.ok,
+        'errors': state.errors,
+        'last_error': str(state.last_error) if state.last_error is not None else None,
+    }
+
+def _json(value):
+    return json.dumps(value, sort_keys=True).encode('utf-8')
+
+# Parameters a setter call sets (its arguments other than None) by name, whether passed by position or keyword,
+# e.g. set_period1(7, None, None) and set_period1(period1_hour=8) both set {'period1_hour'}
+# Raises ValueError if the arguments don't match the setter
+def _set_parameters(device, method, args, kwargs):
+    # the setter of the class, not the instance wrapper of set_stats, for its real signature
+    setter = getattr(type(device), method).__get__(device)
+    try:
+        arguments = inspect.signature(setter).bind(*args, **kwargs).arguments
+    except TypeError as err:
+        raise ValueError('Can\'t write (bad arguments of %s: %s)' % (
+            method, err))
+    return frozenset(name for name, value in arguments.items() if value is not None)
+
+class _Write:
+    # A setter call queued for a device, shared by the clients asking for the same setter before it runs
+    def __init__(self, method, args, kwargs, parameters):
+        self.method = method
+        self.args = args
+        self.kwargs = kwargs
+        self.parameters = parameters
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class HysenWriteQueue:
+    # Setter calls of each device of a fleet run one at a time, in order, whatever the number of clients,
+    # under the fleet's lock of the device so they never overlap a poll of the device
+    # A call to a setter already queued (and not started) for the device setting the same parameters
+    # (see _set_parameters) replaces its arguments, the last value wins and both callers get its result
+    # Once the queue of a device is drained, or after batch writes, the device is polled to refresh its cached state,
+    # then the calls run so far are answered, so a steady stream of writes doesn't keep the first callers waiting
+    def __init__(self, fleet, workers=HYSEN_GATEWAY_DEFAULT_WORKERS, batch=HYSEN_GATEWAY_WRITE_BATCH):
+        self.fleet = fleet
+        self.batch = batch
+        self._queues = {}
+        self._draining = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+
+    # Queue device.method(*args, **kwargs), method must be a public set_* method of the device
+    # Raises KeyError if the device is unknown, ValueError if method is not a setter or the arguments don't match it
+    # Returns the queued write, wait on write.done for its result / error (raised by the setter or the device)
+    def submit(self, device_id, method, args=(), kwargs=None):
+        device = self.fleet.devices.get(device_id)
+        if device is None:
+            raise KeyError(device_id)
+        if not method.startswith('set_') or method == 'set_stats' or not callable(getattr(device, method, None)):
+            raise ValueError('Can\'t write (%s is not a setter of device %s)' % (
+                method, device_id))
+        args = tuple(args)
+        kwargs = dict(kwargs or {})
+        parameters = _set_parameters(device, method, args, kwargs)
+        with self._lock:
+            queue = self._queues.setdefault(device_id, collections.deque())
+            for write in queue:
+                # only a call setting exactly the same parameters supersedes a queued one,
+                # e.g. set_period1(7, None, None) and set_period1(None, 45, None) both run
+                if write.method == method and write.parameters == parameters:
+                    write.args = args
+                    write.kwargs = kwargs
+                    return write
+            write = _Write(method, args, kwargs, parameters)
+            queue.append(write)
+            if device_id not in self._draining:
+                self._draining.add(device_id)
+                self._executor.submit(self._drain, device_id)
+        return write
+
+    # Queue a call and wait for it, returns its result or raises its error
+    def call(self, device_id, method, args=(), kwargs=None, timeout=HYSEN_GATEWAY_WRITE_TIMEOUT):
+        write = self.submit(device_id, method, args, kwargs)
+        if not write.done.wait(timeout):
+            raise TimeoutError('Can\'t write (%s of device %s still queued after %ss)' % (
+                method, device_id, timeout))
+        if write.error is not None:
+            raise write.error
+        return write.result
+
+    def _drain(self, device_id):
+        finished = []
+        while True:
+            with self._lock:
+                queue = self._queues.get(device_id)
+                write = queue.popleft() if queue and len(finished) < self.batch else None
+                if write is None and not finished:
+                    self._draining.discard(device_id)
+                    self._queues.pop(device_id, None)
+                    return
+            if write is None:
+                # queue drained or batch done, refresh the cached state before answering the callers
+                self.fleet.poll_device(device_id)
+                for write in finished:
+                    write.done.set()
+                finished = []
+                continue
+            device = self.fleet.devices.get(device_id)
+            try:
+                if device is None:
+                    raise KeyError(device_id)
+                with self.fleet.device_lock(device_id):
+                    write.result = getattr(device, write.method)(*write.args, **write.kwargs)
+            except Exception as err:
+                write.error = err
+            finished.append(write)
+
+    def close(self):
+        self._executor.shutdown()
+
+class HysenGateway:
+    # HTTP server over a fleet
+    # GET /devices = {device_id: state} of every device, GET /devices/<device_id> = state of a device,
+    #   both with an ETag (the fleet / device state revision, polls that change nothing keep it),
+    #   If-None-Match answers 304 without any body
+    # POST /devices/<device_id>/<setter> with a JSON list (positional arguments) or object (keyword arguments)
+    #   runs the setter through the device write queue and answers {"result": ...},
+    #   400 for a bad setter or arguments (checked before queueing), 502 for any error raised while the write runs
+    #   (rejected value, device error or timeout), 504 if the write is still queued after write_timeout
+    # GET /events = server-sent events of the status changes, see HysenChangeStream.events
+    # Devices are only polled by the fleet (see start) and after writes, never by client requests
+    def __init__(
+        self,
+        fleet,
+        host=HYSEN_GATEWAY_DEFAULT_HOST,
+        port=HYSEN_GATEWAY_DEFAULT_PORT,
+        workers=HYSEN_GATEWAY_DEFAULT_WORKERS,
+        write_timeout=HYSEN_GATEWAY_WRITE_TIMEOUT):
+        self.fleet = fleet
+        self.writes = HysenWriteQueue(fleet, workers)
+        self.write_timeout = write_timeout
+        self.stream = HysenChangeStream(fleet)
+        self._pages = {}
+        self._pages_lock = threading.Lock()
+        gateway = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _send(self, code, body=b'', etag=None):
+                self.send_response(code)
+                if etag is not None:
+                    self.send_header('ETag', etag)
+                if code != 304:
+                    self.send_header('Content-Type', HYSEN_GATEWAY_CONTENT_TYPE)
+                    self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                if code != 304:
+                    self.wfile.write(body)
+
+            def _error(self, code, message):
+                self._send(code, _json({'error': message}))
+
+            def _events(self):
+                client = gateway.stream.subscribe()
+                try:
+                    self.connection.settimeout(HYSEN_STREAM_SEND_TIMEOUT)
+                    self.send_response(200)
+                    self.send_header('Content-Type', HYSEN_STREAM_CONTENT_TYPE)
+                    self.send_header('Cache-Control', 'no-cache')
+                    self.end_headers()
+                    for event in gateway.stream.events(client):
+                        self.wfile.write(event)
+                        self.wfile.flush()
+                except OSError:
+                    # client gone or too slow to read
+                    pass
+                finally:
+                    gateway.stream.unsubscribe(client)
+                    self.close_connection = True
+
+            def do_GET(self):
+                parts = [part for part in self.path.split('?')[0].split('/') if part]
+                if parts == ['events']:
+                    self._events()
+                    return
+                if parts == ['devices']:
+                    page = gateway.devices_page()
+                elif len(parts) == 2 and parts[0] == 'devices':
+                    page = gateway.device_page(parts[1])
+                    if page is None:
+                        self._error(404, 'unknown device %s' % parts[1])
+                        return
+                else:
+                    self._error(404, 'not found')
+                    return
+                etag, body = page
+                if etag in [tag.strip() for tag in self.headers.get('If-None-Match', '').split(',')]:
+                    self._send(304, etag=etag)
+                else:
+                    self._send(200, body, etag)
+
+            def do_POST(self):
+                parts = [part for part in self.path.split('?')[0].split('/') if part]
+                if len(parts) != 3 or parts[0] != 'devices':
+                    self._error(404, 'not found')
+                    return
+                length = int(self.headers.get('Content-Length') or 0)
+                try:
+                    arguments = json.loads(self.rfile.read(length) or b'[]')
+                except ValueError:
+                    self._error(400, 'body is not JSON')
+                    return
+                if isinstance(arguments, dict):
+                    args, kwargs = (), arguments
+                elif isinstance(arguments, list):
+                    args, kwargs = arguments, {}
+                else:
+                    self._error(400, 'body must be a JSON list or object')
+                    return
+                try:
+                    write = gateway.writes.submit(parts[1], parts[2], args, kwargs)
+                except KeyError:
+                    self._error(404, 'unknown device %s' % parts[1])
+                    return
+                except ValueError as err:
+                    self._error(400, str(err))
+                    return
+                if not write.done.wait(gateway.write_timeout):
+                    self._error(504, 'Can\'t write (%s of device %s still queued after %ss)' % (
+                        parts[2], parts[1], gateway.write_timeout))
+                elif write.error is not None:
+                    self._error(502, str(write.error))
+                else:
+                    self._send(200, _json({'result': write.result}))
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self.host, self.port = self._server.server_address[:2]
+        self._thread = None
+        self._polling = False
+
+    # (ETag, JSON) of every device state, rendered again only if the fleet revision changed
+    def devices_page(self):
+        with self._pages_lock:
+            page = self._pages.get(None)
+            revision = self.fleet.revision
+            if page is None or page[0] != revision:
+                # read before the snapshot, a change in between renders the page again on the next request
+                version, states = self.fleet.snapshot()
+                page = self._pages[None] = (
+                    revision,
+                    '"%s"' % revision,
+                    _json({state.device_id: state_dict(state) for state in states}))
+            return page[1:]
+
+    # (ETag, JSON) of a device state, rendered again only if the device state revision changed, None if unknown
+    def device_page(self, device_id):
+        state = self.fleet.state(device_id)
+        if state is None:
+            return None
+        with self._pages_lock:
+            page = self._pages.get(device_id)
+            if page is None or page[0] != state.revision:
+                page = self._pages[device_id] = (
+                    state.revision,
+                    '"%s-%s"' % (device_id, state.revision),
+                    _json(state_dict(state)))
+            return page[1:]
+
+    # Serve in a background thread, and poll the fleet every poll_interval seconds (None = the fleet is polled elsewhere)
+    def start(self, poll_interval=HYSEN_FLEET_DEFAULT_INTERVAL):
+        if poll_interval is not None:
+            self.fleet.start(poll_interval)
+            self._polling = True
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self.stream.close()
+        if self._thread is not None:
+            self._server.shutdown()
+            self._thread.join()
+            self._thread = None
+        self._server.server_close()
+        self.writes.close()
+        if self._polling:
+            self.fleet.stop()
+            self._polling = False
@@ -0,0 +1,184 @@
+"""
+Hysen thermostats history
+In memory time series of device status, one fixed size ring of typed columns per device
+"""
+
+import array
+import threading
+import time
+
+from .fleet import HYSEN_MODELS
+
+HYSEN_HISTORY_DEFAULT_CAPACITY  = 3600
+
+# Columns of each model: (field, array typecode, scale), a value is stored as round(value * scale)
+# Temperatures are stored in half degrees
+HYSEN_HISTORY_COLUMNS = {
+    'heating': (
+        ('room_temp', 'h', 2),
+        ('target_temp', 'h', 2),
+        ('external_temp', 'h', 2),
+        ('schedule', 'B', 1),
+    ),
+    '2pfc': (
+        ('room_temp', 'h', 2),
+        ('target_temp', 'h', 2),
+        ('operation_mode', 'B', 1),
+        ('fan_mode', 'B', 1),
+        ('schedule', 'B', 1),
+        ('time_valve_on', 'I', 1),
+    ),
+}
+
+# On / off fields of each model, packed in one byte per record (first field = bit 0)
+HYSEN_HISTORY_FLAGS = {
+    'heating': ('power_state', 'valve_state', 'key_lock', 'manual_in_auto', 'operation_mode', 'frost_protection'),
+    '2pfc': ('power_state', 'valve_state', 'key_lock', 'frost_protection', 'fan_control'),
+}
+
+class HysenDeviceHistory:
+    # Ring of the last capacity records of a device, the oldest record is overwritten when it is full
+    # Records must be appended in time order
+    def __init__(self, model, capacity=HYSEN_HISTORY_DEFAULT_CAPACITY):
+        if model not in HYSEN_HISTORY_COLUMNS:
+            raise ValueError('Can\'t create history (unknown model %s)' % (
+                model))
+        self.model = model
+        self.capacity = capacity
+        self.count = 0
+        self._next = 0
+        self._columns = HYSEN_HISTORY_COLUMNS[model]
+        self._flags = HYSEN_HISTORY_FLAGS[model]
+        self.fields = tuple(field for field, typecode, scale in self._columns) + self._flags
+        self.timestamps = array.array('d', bytes(8 * capacity))
+        self.columns = {
+            field: array.array(typecode, bytes(array.array(typecode).itemsize * capacity))
+            for field, typecode, scale in self._columns}
+        self.flags = array.array('B', bytes(capacity))
+
+    # Memory used by the columns, in bytes
+    def nbytes(self):
+        return sum(
+            len(column) * column.itemsize
+            for column in [self.timestamps, self.flags] + list(self.columns.values()))
+
+    # Append a status (a status_snapshot dict) read at timestamp
+    def append(self, timestamp, status):
+        position = self._next
+        self.timestamps[position] = timestamp
+        for field, typecode, scale in self._columns:
+            self.columns[field][position] = round(status[field] * scale)
+        flags = 0
+        for bit, field in enumerate(self._flags):
+            if status[field]:
+                flags |= 1 << bit
+        self.flags[position] = flags
+        self._next = (position + 1) % self.capacity
+        if self.count < self.capacity:
+            self.count += 1
+
+    # Ring position of the index-th record, oldest first
+    def _position(self, index):
+        return (self._next - self.count + index) % self.capacity
+
+    # Index of the first record at or after timestamp (binary search)
+    def _bisect(self, timestamp):
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.timestamps[self._position(middle)] < timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    # Ring slices holding the records from index start to index end (at most 2 slices)
+    def _slices(self, start, end):
+        if start >= end:
+            return []
+        first = self._position(start)
+        last = first + end - start
+        if last <= self.capacity:
+            return [(first, last)]
+        return [(first, self.capacity), (0, last - self.capacity)]
+
+    def _read(self, column, slices):
+        values = array.array(column.typecode)
+        for first, last in slices:
+            values.extend(column[first:last])
+        return values
+
+    # Records with start <= timestamp < end, None = unbounded
+    # Returns {'timestamp': [...], field: [...]} with the values decoded as in status_snapshot
+    def window(self, start=None, end=None, fields=None):
+        first = 0 if start is None else self._bisect(start)
+        last = self.count if end is None else self._bisect(end)
+        slices = self._slices(first, last)
+        result = {'timestamp': self._read(self.timestamps, slices).tolist()}
+        flags = None
+        for field, typecode, scale in self._columns:
+            if fields is None or field in fields:
+                values = self._read(self.columns[field], slices)
+                if scale == 1:
+                    result[field] = values.tolist()
+                else:
+                    result[field] = [value / scale for value in values]
+        for bit, field in enumerate(self._flags):
+            if fields is None or field in fields:
+                if flags is None:
+                    flags = self._read(self.flags, slices)
+                result[field] = [(value >> bit) & 1 for value in flags]
+        return result
+
+    # Last record as (timestamp, {field: value}), None if empty
+    def latest(self):
+        if not self.count:
+            return None
+        position = self._position(self.count - 1)
+        status = {}
+        for field, typecode, scale in self._columns:
+            value = self.columns[field][position]
+            status[field] = value if scale == 1 else value / scale
+        for bit, field in enumerate(self._flags):
+            status[field] = (self.flags[position] >> bit) & 1
+        return self.timestamps[position], status
+
+class HysenHistory:
+    # History of many devices (device_id -> HysenDeviceHistory), created on their first record
+    # Fed explicitly with record, or by the devices and fleets it is attached to
+    def __init__(self, capacity=HYSEN_HISTORY_DEFAULT_CAPACITY):
+        self.capacity = capacity
+        self.devices = {}
+        self._lock = threading.Lock()
+
+    def record(self, device_id, model, status, timestamp=None):
+        if timestamp is None:
+            timestamp = time.time()
+        with self._lock:
+            history = self.devices.get(device_id)
+            if history is None:
+                history = self.devices[device_id] = HysenDeviceHistory(model, self.capacity)
+            history.append(timestamp, status)
+
+    # Record every status read by device.get_device_status (see add_status_callback)
+    def attach_device(self, device):
+        model = HYSEN_MODELS.get(device.devtype)
+        device.add_status_callback(
+            lambda device, changes: self.record(device.unique_id, model, device.status_snapshot()))
+
+    # Record every fleet poll (see HysenFleet.add_status_callback)
+    def attach_fleet(self, fleet):
+        def record_state(device_id, changes):
+            state = fleet.states.get(device_id)
+            if state is not None:
+                self.record(device_id, state.model, state.status, state.updated)
+        fleet.add_status_callback(record_state)
+
+    def window(self, device_id, start=None, end=None, fields=None):
+        with self._lock:
+            return self.devices[device_id].window(start, end, fields)
+
+    # Memory used by the columns of every device, in bytes
+    def nbytes(self):
+        with self._lock:
+            return sum(history.nbytes() for history in self.devices.values())
@@ -4,6 +4,7 @@ Hysen HY03AC-x-Wifi device and derivative
 """
 
 from .hysendevice import HysenDevice as hysen
+from .hysendevice import precompute_request
 from datetime import datetime
 
 HYSEN2PFC_KEY_LOCK_OFF          = 0
@@ -63,8 +64,52 @@ HYSEN2PFC_DEFAULT_CALIBRATION   = 0.0
 
 HYSEN2PFC_DEV_TYPE              = 0x4F5B
 
+HYSEN2PFC_STATUS_REQUEST        = precompute_request([0x01, 0x03, 0x00, 0x00, 0x00, 0x10])
+
 class Hysen2PipeFanCoilDevice(hysen):
-    
+
+    # request sent by get_device_status
+    STATUS_REQUEST = HYSEN2PFC_STATUS_REQUEST
+
+    # attributes read from the device by get_device_status
+    STATUS_FIELDS = (
+        'key_lock',
+        'key_lock_type',
+        'valve_state',
+        'power_state',
+        'operation_mode',
+        'fan_mode',
+        'room_temp',
+        'target_temp',
+        'hysteresis',
+        'calibration',
+        'cooling_max_temp',
+        'cooling_min_temp',
+        'heating_max_temp',
+        'heating_min_temp',
+        'fan_control',
+        'frost_protection',
+        'clock_hour',
+        'clock_minute',
+        'clock_second',
+        'clock_weekday',
+        'unknown',
+        'schedule',
+        'period1_start_enabled',
+        'period1_start_hour',
+        'period1_start_min',
+        'period1_end_enabled',
+        'period1_end_hour',
+        'period1_end_min',
+        'period2_start_enabled',
+        'period2_start_hour',
+        'period2_start_min',
+        'period2_end_enabled',
+        'period2_end_hour',
+        'period2_end_min',
+        'time_valve_on',
+        'fwversion')
+
     def __init__ (self, host, mac, timeout, sync_clock, sync_hour):
         hysen.__init__(self, host, mac, HYSEN2PFC_DEV_TYPE, timeout)
 
@@ -737,45 +782,50 @@ class Hysen2PipeFanCoilDevice(hysen):
                             _dt.second,
                             _dt.isoweekday())
                         self._is_sync_clock_done = True
-            _request = bytearray([0x01, 0x03, 0x00, 0x00, 0x00, 0x10])
-            _response = self._send_request(_request)
-            self.key_lock = (_response[3]>>4) & 1
-            self.key_lock_type = _response[3] & 3
-            self.valve_state = (_response[4]>>4) & 1
-            self.power_state = _response[4] & 1
-            self.operation_mode = _response[5]
-            self.fan_mode = _response[6]
-            self.room_temp = _response[7]
-            self.target_temp = _response[8]
-            self.hysteresis = _response[9]
-            self.calibration = _response[10]
-            if self.calibration > 0x7F:
-                self.calibration = self.calibration - 0x100
-            self.calibration = float(self.calibration / 10.0)
-            self.cooling_max_temp = _response[11]
-            self.cooling_min_temp = _response[12]
-            self.heating_max_temp = _response[13]
-            self.heating_min_temp = _response[14]
-            self.fan_control = _response[15]
-            self.frost_protection = _response[16]
-            self.clock_hour = _response[17]
-            self.clock_minute = _response[18]
-            self.clock_second = _response[19]
-            self.clock_weekday = _response[20]
-            self.unknown = _response[21]
-            self.schedule = _response[22]
-            self.period1_start_enabled = (_response[23]>>7) & 1
-            self.period1_start_hour = _response[23] & 0x1F
-            self.period1_start_min = _response[24] & 0x3F
-            self.period1_end_enabled = (_response[25]>>7) & 1
-            self.period1_end_hour = _response[25] & 0x1F
-            self.period1_end_min = _response[26] & 0x3F
-            self.period2_start_enabled = (_response[27]>>7) & 1
-            self.period2_start_hour = _response[27] & 0x1F
-            self.period2_start_min = _response[28] & 0x3F
-            self.period2_end_enabled = (_response[29]>>7) & 1
-            self.period2_end_hour = _response[29] & 0x1F
-            self.period2_end_min = _response[30] & 0x3F
-            self.time_valve_on = (_response[31] << 24) + (_response[32] << 16) + (_response[33] << 8) + _response[34]
+            _response = self._send_request(HYSEN2PFC_STATUS_REQUEST)
+            self.status_payload = bytes(_response)
+            self._decode_status(_response)
             self.fwversion = self.get_fwversion()
+            self._notify_changes()
+
+    # Decode the return payload of a status read (see get_device_status) into the device attributes
+    def _decode_status(self, _response):
+        self.key_lock = (_response[3]>>4) & 1
+        self.key_lock_type = _response[3] & 3
+        self.valve_state = (_response[4]>>4) & 1
+        self.power_state = _response[4] & 1
+        self.operation_mode = _response[5]
+        self.fan_mode = _response[6]
+        self.room_temp = _response[7]
+        self.target_temp = _response[8]
+        self.hysteresis = _response[9]
+        self.calibration = _response[10]
+        if self.calibration > 0x7F:
+            self.calibration = self.calibration - 0x100
+        self.calibration = float(self.calibration / 10.0)
+        self.cooling_max_temp = _response[11]
+        self.cooling_min_temp = _response[12]
+        self.heating_max_temp = _response[13]
+        self.heating_min_temp = _response[14]
+        self.fan_control = _response[15]
+        self.frost_protection = _response[16]
+        self.clock_hour = _response[17]
+        self.clock_minute = _response[18]
+        self.clock_second = _response[19]
+        self.clock_weekday = _response[20]
+        self.unknown = _response[21]
+        self.schedule = _response[22]
+        self.period1_start_enabled = (_response[23]>>7) & 1
+        self.period1_start_hour = _response[23] & 0x1F
+        self.period1_start_min = _response[24] & 0x3F
+        self.period1_end_enabled = (_response[25]>>7) & 1
+        self.period1_end_hour = _response[25] & 0x1F
+        self.period1_end_min = _response[26] & 0x3F
+        self.period2_start_enabled = (_response[27]>>7) & 1
+        self.period2_start_hour = _response[27] & 0x1F
+        self.period2_start_min = _response[28] & 0x3F
+        self.period2_end_enabled = (_response[29]>>7) & 1
+        self.period2_end_hour = _response[29] & 0x1F
+        self.period2_end_min = _response[30] & 0x3F
+        self.time_valve_on = (_response[31] << 24) + (_response[32] << 16) + (_response[33] << 8) + _response[34]
             
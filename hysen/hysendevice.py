@@ -1,15 +1,384 @@
 """Support for Hysen thermostats."""
 
+import threading
+import time
+
 from broadlink.device import Device as broadlink_device
-from broadlink.exceptions import check_error
-from broadlink.helpers import CRC16
+from broadlink.exceptions import check_error, DataValidationError, NetworkTimeoutError
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+from .transport import UdpTransport
+from .watch import HysenWatch, HYSEN_WATCH_DEFAULT_INTERVAL
+from .stats import HYSEN_STATS_AUTH, HYSEN_STATS_RESOLVE, HYSEN_STATS_TIMEOUT
+
+HYSEN_RESOLVE_AFTER_TIMEOUTS    = 2
+HYSEN_RESOLVE_TIMEOUT           = 5
+
+HYSEN_AUTH_PACKET_TYPE          = 0x65
+
+HYSEN_AES_BLOCK_SIZE            = 16
+
+# Size of the response buffer of each thread, broadlink's maximum packet size + one AES block
+HYSEN_RESPONSE_BUFFER_SIZE      = 2048 + HYSEN_AES_BLOCK_SIZE
+
+HYSEN_PACKET_MAGIC              = bytes.fromhex('5aa5aa555aa5aa55')
+
+# CRC-16/MODBUS (reflected polynomial 0xA001, initial value 0xFFFF) lookup table
+def _crc16_table():
+    table = []
+    for dividend in range(256):
+        remainder = dividend
+        for _ in range(8):
+            if remainder & 1:
+                remainder = (remainder >> 1) ^ 0xA001
+            else:
+                remainder = remainder >> 1
+        table.append(remainder)
+    return tuple(table)
+
+_CRC16_TABLE = _crc16_table()
+
+# Table driven CRC-16/MODBUS of a sequence of bytes
+# Used for both request framing and response checking
+def crc16(data):
+    table = _CRC16_TABLE
+    crc = 0xFFFF
+    for byte in data:
+        crc = (crc >> 8) ^ table[(crc ^ byte) & 0xFF]
+    return crc
+
+# Frame a request: prepend length (2 bytes, +2 for CRC16) and append CRC (LSB first)
+def _frame_request(input_payload):
+    crc = crc16(input_payload)
+    request_payload = bytearray(len(input_payload) + 4)
+    request_payload[0] = len(input_payload) + 2
+    request_payload[2:-2] = input_payload
+    request_payload[-2] = crc & 0xFF
+    request_payload[-1] = (crc >> 8) & 0xFF
+    return bytes(request_payload)
+
+_precomputed_frames = {}
+
+# Precompute the frame of a constant request (e.g. the status read)
+# Returns the request as bytes, _send_request then uses the precomputed frame
+# instead of framing it and computing its CRC again on every call
+def precompute_request(input_payload):
+    input_payload = bytes(input_payload)
+    _precomputed_frames[input_payload] = _frame_request(input_payload)
+    return input_payload
+
+# Device clock fields, they change on every read and are left out of status deltas
+HYSEN_STATUS_CLOCK_FIELDS       = ('clock_hour', 'clock_minute', 'clock_second', 'clock_weekday')
+
+# Fields of status (a status_snapshot dict) whose value differs from previous, as a dict
+# Every field of status if previous is None, the ignored fields otherwise never count as changes
+def status_delta(previous, status, ignored=HYSEN_STATUS_CLOCK_FIELDS):
+    if previous is None:
+        return dict(status)
+    return {field: value for field, value in status.items() 
+            if field not in ignored and (field not in previous or previous[field] != value)}
 
 class HysenDevice(broadlink_device):
+    # request sent by get_device_status, set by each device class
+    STATUS_REQUEST = None
+
+    # attributes read from the device by get_device_status, set by each device class
+    STATUS_FIELDS = ()
+
+    # session key the cached AES contexts were built for
+    _aes_key = None
+
     def __init__ (self, host, mac, devtype, timeout):
+        # cached AES contexts are shared by the threads using the device, see update_aes
+        self._aes_lock = threading.Lock()
         broadlink_device.__init__(self, host, mac, devtype, timeout)
-        
+
+        # Send/receive step of every packet, see transport.py
+        self.transport = UdpTransport()
+        # Re-resolution of the device host by MAC address (e.g. after a DHCP lease change)
+        # resolve_after_timeouts = consecutive timeouts before looking the device up, 0 = never
+        # resolve_timeout = how long to wait for the device to answer the lookup
+        # local_ip_addresses, discover_ip_addresses = where to send the lookup probes, None = broadcast
+        self.resolve_after_timeouts = HYSEN_RESOLVE_AFTER_TIMEOUTS
+        self.resolve_timeout = HYSEN_RESOLVE_TIMEOUT
+        self.local_ip_addresses = None
+        self.discover_ip_addresses = None
+        self._consecutive_timeouts = 0
+        self._resolving = False
+        # Responses are decrypted into a buffer per thread (see _decrypt_response)
+        self._response_buffers = threading.local()
+        # Instrumentation, see set_stats
+        # the operation being recorded is per thread, e.g. a fleet poll and a gateway write may run at the same time
+        self._stats = None
+        self._operation = threading.local()
+        # Traffic capture, see capture.py
+        # recorder.record(device, input_payload, response_payload) is called with every decrypted response
+        self.recorder = None
+        # Return payload of the last status read (bytes), decoded by _decode_status
+        self.status_payload = None
+        # Change detection, see add_change_callback and add_status_callback
+        self._change_callbacks = []
+        self._status_callbacks = []
+        self._last_status = None
+
+    # Current values of the STATUS_FIELDS attributes, as a dict
+    # No request is sent, values are the ones of the last get_device_status
+    def status_snapshot(self):
+        return {field: getattr(self, field) for field in self.STATUS_FIELDS}
+
+    # Register a callback called as callback(device, changes) after a get_device_status that changed something
+    # changes = {field: new value} of the STATUS_FIELDS that differ from the previous get_device_status
+    # (see status_delta), the first call after the first callback is registered gets every field
+    # Callbacks run in the thread calling get_device_status, they should be quick
+    def add_change_callback(self, callback):
+        if not self._change_callbacks and not self._status_callbacks:
+            self._last_status = None
+        self._change_callbacks.append(callback)
+
+    def remove_change_callback(self, callback):
+        self._change_callbacks.remove(callback)
+
+    # Register a callback called as callback(device, changes) after every get_device_status,
+    # changes is empty if nothing changed (e.g. to sample time series)
+    def add_status_callback(self, callback):
+        if not self._change_callbacks and not self._status_callbacks:
+            self._last_status = None
+        self._status_callbacks.append(callback)
+
+    def remove_status_callback(self, callback):
+        self._status_callbacks.remove(callback)
+
+    # Changed fields since the previous call, as a dict (every field on the first call)
+    # The current status becomes the reference of the next call
+    def status_changes(self):
+        status = self.status_snapshot()
+        changes = status_delta(self._last_status, status)
+        self._last_status = status
+        return changes
+
+    # Poll the device every interval seconds, as an iterable and an async iterable (see watch.HysenWatch)
+    # Yields status snapshots, or with changes=True only the changed fields (every field first),
+    # polls that changed nothing are then skipped
+    def watch(self, interval=HYSEN_WATCH_DEFAULT_INTERVAL, changes=False):
+        last_status = [None]
+
+        def poll():
+            self.get_device_status()
+            status = self.status_snapshot()
+            if not changes:
+                return status
+            delta = status_delta(last_status[0], status)
+            last_status[0] = status
+            return delta or None
+
+        return HysenWatch(poll, interval)
+
+    # Called by get_device_status once the status is decoded
+    def _notify_changes(self):
+        if self._change_callbacks or self._status_callbacks:
+            changes = self.status_changes()
+            if changes:
+                for callback in list(self._change_callbacks):
+                    callback(self, changes)
+            for callback in list(self._status_callbacks):
+                callback(self, changes)
+
+    # Collect latency, round trips, timeouts, re-resolutions and authentications in stats (a stats.HysenStats)
+    # Public methods (get_*, set_*, auth) are wrapped on this instance only,
+    # None removes the wrappers, so a device without stats runs the plain methods
+    def set_stats(self, stats):
+        for name in [name for name in vars(self) if name in self._instrumented_methods()]:
+            delattr(self, name)
+        self._stats = stats
+        if stats is not None:
+            for name in self._instrumented_methods():
+                setattr(self, name, self._instrument(name, getattr(self, name)))
+
+    @classmethod
+    def _instrumented_methods(cls):
+        return [
+            name for name in dir(cls)
+            if (name.startswith('get_') or name.startswith('set_') or name == 'auth') and
+               name != 'set_stats' and callable(getattr(cls, name))]
+
+    # Wrap a bound method to record its latency and round trips
+    # Calls nested in another public method (e.g. the status read of a setter) count for the outer one
+    def _instrument(self, name, method):
+        def instrumented(*args, **kwargs):
+            operation = self._operation
+            if getattr(operation, 'name', None) is not None:
+                return method(*args, **kwargs)
+            operation.name = name
+            operation.round_trips = 0
+            error = True
+            start = time.perf_counter()
+            try:
+                result = method(*args, **kwargs)
+                error = False
+                return result
+            finally:
+                seconds = time.perf_counter() - start
+                operation.name = None
+                stats = self._stats
+                if stats is not None:
+                    stats.record_operation(self.unique_id, name, seconds, operation.round_trips, error)
+        return instrumented
+
+    # Update AES with a new key (initial key or session key after auth)
+    # broadlink builds a new CBC context for every encrypt and decrypt,
+    # here one CBC encryptor and one CBC decryptor are built per session key and reused for all traffic
+    # A CBC context chains every payload to the last block of the previous one, so each payload is preceded
+    # by a block bringing the chaining back to the IV (see encrypt and _decrypt_into)
+    # A re-auth with a different key invalidates the cached contexts
+    def update_aes(self, key):
+        key = bytes(key)
+        if key == self._aes_key:
+            return
+        cipher = Cipher(algorithms.AES(key), modes.CBC(self.iv), backend=default_backend())
+        iv_decrypted = Cipher(algorithms.AES(key), modes.ECB(), backend=default_backend()).decryptor().update(self.iv)
+        with self._aes_lock:
+            self._aes_encryptor = cipher.encryptor()
+            self._aes_decryptor = cipher.decryptor()
+            self._aes_iv_decrypted = int.from_bytes(iv_decrypted, 'big')
+            # last ciphertext block of the encryptor
+            self._aes_last_block = int.from_bytes(self.iv, 'big')
+            self._aes_key = key
+
+    # Encrypt a payload (multiple of the AES block size) with AES-CBC
+    # The block decrypt(IV) xor last ciphertext block is encrypted first, its ciphertext is the IV,
+    # which becomes the block the payload is chained to
+    def encrypt(self, payload):
+        if len(payload) % HYSEN_AES_BLOCK_SIZE:
+            raise ValueError('The length of the provided data is not a multiple of the block length.')
+        with self._aes_lock:
+            encryptor = self._aes_encryptor
+            encryptor.update((self._aes_iv_decrypted ^ self._aes_last_block).to_bytes(HYSEN_AES_BLOCK_SIZE, 'big'))
+            encrypted_payload = encryptor.update(payload)
+            if encrypted_payload:
+                self._aes_last_block = int.from_bytes(encrypted_payload[-HYSEN_AES_BLOCK_SIZE:], 'big')
+        return encrypted_payload
+
+    # Decrypt a payload (multiple of the AES block size) with AES-CBC
+    def decrypt(self, payload):
+        decrypted_payload = bytearray(len(payload) + HYSEN_AES_BLOCK_SIZE)
+        return bytes(self._decrypt_into(payload, decrypted_payload))
+
+    # Decrypt a payload into buffer (at least one AES block longer than payload), in place
+    # The IV is decrypted first as a ciphertext block, so the payload is chained to it
+    # Returns a memoryview on the decrypted bytes of buffer
+    def _decrypt_into(self, payload, buffer):
+        if len(payload) % HYSEN_AES_BLOCK_SIZE:
+            raise ValueError('The length of the provided data is not a multiple of the block length.')
+        with self._aes_lock:
+            decryptor = self._aes_decryptor
+            decryptor.update(self.iv)
+            return memoryview(buffer)[:decryptor.update_into(payload, buffer)]
+
+    # Send a packet to the device
+    # After resolve_after_timeouts consecutive timeouts the device is looked up by its MAC address,
+    # its host is updated, the session is authenticated again and the packet is sent once more
+    def send_packet(self, packet_type, payload):
+        try:
+            response = self._send_packet(packet_type, payload)
+        except NetworkTimeoutError:
+            self._consecutive_timeouts += 1
+            if self._stats is not None:
+                self._stats.record_event(self.unique_id, HYSEN_STATS_TIMEOUT)
+            if self._resolving or \
+               (self.resolve_after_timeouts <= 0) or \
+               (self._consecutive_timeouts < self.resolve_after_timeouts) or \
+               not self._resolve_host(packet_type):
+                raise
+            response = self._send_packet(packet_type, payload)
+        self._consecutive_timeouts = 0
+        return response
+
+    # Build a broadlink packet, exchange it through the device's transport and check the response
+    # Same packet format and checks as broadlink's send_packet
+    def _send_packet(self, packet_type, payload):
+        self.count = ((self.count + 1) | 0x8000) & 0xFFFF
+        packet = bytearray(0x38)
+        packet[0x00:0x08] = HYSEN_PACKET_MAGIC
+        packet[0x24:0x26] = self.devtype.to_bytes(2, 'little')
+        packet[0x26:0x28] = packet_type.to_bytes(2, 'little')
+        packet[0x28:0x2A] = self.count.to_bytes(2, 'little')
+        packet[0x2A:0x30] = self.mac[::-1]
+        packet[0x30:0x34] = self.id.to_bytes(4, 'little')
+
+        p_checksum = sum(payload, 0xBEAF) & 0xFFFF
+        packet[0x34:0x36] = p_checksum.to_bytes(2, 'little')
+
+        padding = (16 - len(payload)) % 16
+        packet.extend(self.encrypt(bytes(payload) + bytes(padding)))
+
+        checksum = sum(packet, 0xBEAF) & 0xFFFF
+        packet[0x20:0x22] = checksum.to_bytes(2, 'little')
+
+        stats = self._stats
+        if stats is None:
+            with self.lock:
+                response = self.transport.exchange(packet, self.host, self.timeout)
+        else:
+            if packet_type == HYSEN_AUTH_PACKET_TYPE:
+                stats.record_event(self.unique_id, HYSEN_STATS_AUTH)
+            with self.lock:
+                # timed under the lock, waiting for another thread's exchange is not part of the round trip
+                start = time.perf_counter()
+                response = self.transport.exchange(packet, self.host, self.timeout)
+                seconds = time.perf_counter() - start
+            stats.record_round_trip(self.unique_id, packet_type, seconds)
+            operation = self._operation
+            if getattr(operation, 'name', None) is not None:
+                operation.round_trips += 1
+
+        if len(response) < 0x30:
+            raise DataValidationError(
+                -4007,
+                'Received data packet length error',
+                'Expected at least 48 bytes and received %s' % len(response))
+
+        nom_checksum = int.from_bytes(response[0x20:0x22], 'little')
+        real_checksum = (sum(response, 0xBEAF) - sum(response[0x20:0x22])) & 0xFFFF
+        if nom_checksum != real_checksum:
+            raise DataValidationError(
+                -4008,
+                'Received data packet check error',
+                'Expected a checksum of %s and received %s' % (nom_checksum, real_checksum))
+
+        return response
+
+    # Look up the device by its MAC address and switch to the host it answers from
+    # Only this device is waited for, the lookup ends as soon as it answers
+    # Re-authenticates unless the packet to be resent is the authentication itself
+    # Returns False if the device did not answer the lookup
+    def _resolve_host(self, packet_type):
+        # imported here, discovery builds device classes derived from HysenDevice
+        from .discovery import find_host
+        host = find_host(
+            self.mac,
+            self.resolve_timeout,
+            self.local_ip_addresses,
+            self.discover_ip_addresses,
+            self.host[1])
+        if host is None:
+            return False
+        self.host = host
+        self._host = host[0]
+        self._consecutive_timeouts = 0
+        if self._stats is not None:
+            self._stats.record_event(self.unique_id, HYSEN_STATS_RESOLVE)
+        if packet_type != HYSEN_AUTH_PACKET_TYPE:
+            self._resolving = True
+            try:
+                self._authenticated = self.auth()
+            finally:
+                self._resolving = False
+        return True
+
     # Send a request to the device
-    # Returns decrypted payload
+    # Returns decrypted payload, as a memoryview on the response buffer of the calling thread,
+    # only valid until the next request of the thread (copy it to keep it)
     # Device's memory data is structured in an array of bytes, word (2 bytes) aligned
     # input_payload should be a bytearray
     # There are three known different request types (commands)
@@ -108,60 +477,70 @@ class HysenDevice(broadlink_device):
     # New behavior: raises a ValueError if the device response indicates an error or CRC check fails
     # The function prepends length (2 bytes) and appends CRC
     # This function is adapted from the original broadlink.climate.py code by mjg59
+    # Constant requests built with precompute_request are sent as precomputed frames
     def _send_request(self, input_payload):
-        crc = CRC16(bytes(input_payload))
-                
-        # first byte is length, +2 for CRC16
-        request_payload = bytearray([len(input_payload) + 2,0x00])
-        request_payload.extend(input_payload)
-
-        # append CRC
-        request_payload.append(crc & 0xFF)
-        request_payload.append((crc >> 8) & 0xFF)
+        request_payload = None
+        if type(input_payload) is bytes:
+            request_payload = _precomputed_frames.get(input_payload)
+        if request_payload is None:
+            request_payload = _frame_request(input_payload)
 
         # send to device
-        response = self.send_packet(0x6a, request_payload)
+        response = memoryview(self.send_packet(0x6a, request_payload))
         check_error(response[0x22:0x24])
-        response_payload = self.decrypt(response[0x38:])
-        
+        response_payload = self._decrypt_response(response[0x38:])
+        if self.recorder is not None:
+            self.recorder.record(self, input_payload, response_payload)
+
+        return_payload, expected = self._check_response(input_payload, response_payload)
+        if expected:
+            return return_payload
+        self.auth()
+        raise ValueError(
+            'Hysen_response_error: request %s response %s',
+            ' '.join(format(x, '02x') for x in bytes(input_payload)),
+            ' '.join(format(x, '02x') for x in bytes(return_payload))
+        )
+
+    # Check the length and CRC of a decrypted response to input_payload and strip them
+    # Raises a ValueError if they are wrong
+    # Returns the return payload and whether it is the expected answer to input_payload
+    def _check_response(self, input_payload, response_payload):
+        if not len(response_payload):
+            raise ValueError('Can\'t check response (%s bytes, no length)' % (
+                len(response_payload)))
         # experimental check on CRC in response (first 2 bytes are len, and trailing bytes are crc)
         response_payload_len = response_payload[0]
         if response_payload_len + 2 > len(response_payload):
             raise ValueError('hysen_response_error','first byte of response is not length')
-        crc = CRC16(response_payload[2:response_payload_len])
-        if (response_payload[response_payload_len] == crc & 0xFF) and \
-           (response_payload[response_payload_len+1] == (crc >> 8) & 0xFF):
-            return_payload = response_payload[2:response_payload_len]
-        else:
+        return_payload = response_payload[2:response_payload_len]
+        crc = crc16(return_payload)
+        if (response_payload[response_payload_len] != crc & 0xFF) or \
+           (response_payload[response_payload_len+1] != (crc >> 8) & 0xFF):
             raise ValueError('hysen_response_error','CRC check on response failed')
-            
+
         # check if return response is right
-        if (input_payload[0:2] == bytearray([0x01, 0x06])) and \
-           (input_payload != return_payload):
-            self.auth()
-            raise ValueError(
-                'Hysen_response_error: request %s response %s',
-                ' '.join(format(x, '02x') for x in bytearray(input_payload)),
-                ' '.join(format(x, '02x') for x in bytearray(return_payload))
-            )
-        elif (input_payload[0:2] == bytearray([0x01, 0x10])) and \
-             (input_payload[0:6] != return_payload):
-            self.auth()
-            raise ValueError(
-                'Hysen_response_error: request %s response %s',
-                ' '.join(format(x, '02x') for x in bytearray(input_payload)),
-                ' '.join(format(x, '02x') for x in bytearray(return_payload))
-            )
-        elif (input_payload[0:2] == bytearray([0x01, 0x03])) and \
-             ((input_payload[0:2] != return_payload[0:2]) or \
-             ((2 * input_payload[5]) != return_payload[2]) or \
-             ((2 * input_payload[5]) != len(return_payload[3:]))):
-            self.auth()
-            raise ValueError(
-                'Hysen_response_error: request %s response %s',
-                ' '.join(format(x, '02x') for x in bytearray(input_payload)),
-                ' '.join(format(x, '02x') for x in bytearray(return_payload))
-            )
-        else:
-            return return_payload
+        if input_payload[0] == 0x01:
+            command = input_payload[1]
+            if command == 0x06:
+                return return_payload, return_payload == input_payload
+            elif command == 0x10:
+                return return_payload, return_payload == input_payload[0:6]
+            elif command == 0x03:
+                return return_payload, \
+                    (len(return_payload) >= 3) and \
+                    (return_payload[0] == 0x01) and \
+                    (return_payload[1] == 0x03) and \
+                    ((2 * input_payload[5]) == return_payload[2]) and \
+                    ((2 * input_payload[5]) == len(return_payload) - 3)
+        return return_payload, True
+
+    # Decrypt a response payload into the response buffer of the calling thread, reused by its next requests
+    # Requests to a device may run concurrently (e.g. a poll and a setter), so threads don't share a buffer
+    # Returns a memoryview on the buffer, no intermediate copy is made
+    def _decrypt_response(self, encrypted_payload):
+        buffer = getattr(self._response_buffers, 'buffer', None)
+        if buffer is None:
+            buffer = self._response_buffers.buffer = bytearray(HYSEN_RESPONSE_BUFFER_SIZE)
+        return self._decrypt_into(encrypted_payload, buffer)
 
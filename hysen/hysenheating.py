@@ -4,6 +4,7 @@ Hysen HY03-x-Wifi device and derivative
 """
 
 from .hysendevice import HysenDevice as hysen
+from .hysendevice import precompute_request
 from datetime import datetime
 
 HYSENHEAT_KEY_LOCK_OFF         = 0
@@ -58,8 +59,65 @@ HYSENHEAT_DEFAULT_HYSTERESIS         = 2
 
 HYSENHEAT_DEV_TYPE             = 0x4EAD
 
+HYSENHEAT_STATUS_REQUEST       = precompute_request([0x01, 0x03, 0x00, 0x00, 0x00, 0x17])
+
 class HysenHeatingDevice(hysen):
-    
+
+    # request sent by get_device_status
+    STATUS_REQUEST = HYSENHEAT_STATUS_REQUEST
+
+    # attributes read from the device by get_device_status
+    STATUS_FIELDS = (
+        'key_lock',
+        'manual_in_auto',
+        'valve_state',
+        'power_state',
+        'room_temp',
+        'target_temp',
+        'operation_mode',
+        'schedule',
+        'sensor',
+        'external_max_temp',
+        'hysteresis',
+        'max_temp',
+        'min_temp',
+        'calibration',
+        'frost_protection',
+        'poweron',
+        'unknown1',
+        'external_temp',
+        'clock_hour',
+        'clock_minute',
+        'clock_second',
+        'clock_weekday',
+        'period1_hour',
+        'period1_min',
+        'period2_hour',
+        'period2_min',
+        'period3_hour',
+        'period3_min',
+        'period4_hour',
+        'period4_min',
+        'period5_hour',
+        'period5_min',
+        'period6_hour',
+        'period6_min',
+        'we_period1_hour',
+        'we_period1_min',
+        'we_period2_hour',
+        'we_period2_min',
+        'period1_temp',
+        'period2_temp',
+        'period3_temp',
+        'period4_temp',
+        'period5_temp',
+        'period6_temp',
+        'we_period1_temp',
+        'we_period2_temp',
+        'unknown2',
+        'unknown3',
+        'fwversion')
+
     def __init__ (self, host, mac, timeout, sync_clock, sync_hour):
         hysen.__init__(self, host, mac, HYSENHEAT_DEV_TYPE, timeout)
 
@@ -1110,58 +1168,63 @@ class HysenHeatingDevice(hysen):
                             _dt.second,
                             _dt.isoweekday())
                         self._is_sync_clock_done = True
-            _request = bytearray([0x01, 0x03, 0x00, 0x00, 0x00, 0x17])
-            _response = self._send_request(_request)
-            self.key_lock = _response[3] & 0x01
-            self.manual_in_auto = (_response[4] >> 6) & 0x01
-            self.valve_state =  (_response[4] >> 4) & 0x01
-            self.power_state =  _response[4] & 0x01
-            self.room_temp = float((_response[5] & 0xFF) / 2.0)
-            self.target_temp = float((_response[6] & 0xFF) / 2.0)
-            self.operation_mode = _response[7] & 0x01
-            self.schedule = (_response[7] >> 4) & 0x0F
-            self.sensor = _response[8]
-            self.external_max_temp = float(_response[9])
-            self.hysteresis = _response[10]
-            self.max_temp = _response[11]
-            self.min_temp = _response[12]
-            self.calibration = (_response[13] << 8) + _response[14]
-            if self.calibration > 0x7FFF:
-                self.calibration = self.calibration - 0x10000
-            self.calibration = float(self.calibration / 2.0)
-            self.frost_protection = _response[15]
-            self.poweron = _response[16]
-            self.unknown1 = _response[17]
-            self.external_temp = float((_response[18] & 0xFF) / 2.0)
-            self.clock_hour = _response[19]
-            self.clock_minute = _response[20]
-            self.clock_second = _response[21]
-            self.clock_weekday = _response[22]
-            self.period1_hour = _response[23]
-            self.period1_min = _response[24]
-            self.period2_hour = _response[25]
-            self.period2_min = _response[26]
-            self.period3_hour = _response[27]
-            self.period3_min = _response[28]
-            self.period4_hour = _response[29]
-            self.period4_min = _response[30]
-            self.period5_hour = _response[31]
-            self.period5_min = _response[32]
-            self.period6_hour = _response[33]
-            self.period6_min = _response[34]
-            self.we_period1_hour = _response[35]
-            self.we_period1_min = _response[36]
-            self.we_period2_hour = _response[37]
-            self.we_period2_min = _response[38]
-            self.period1_temp = float(_response[39] / 2.0)
-            self.period2_temp = float(_response[40] / 2.0)
-            self.period3_temp = float(_response[41] / 2.0)
-            self.period4_temp = float(_response[42] / 2.0)
-            self.period5_temp = float(_response[43] / 2.0)
-            self.period6_temp = float(_response[44] / 2.0)
-            self.we_period1_temp = float(_response[45] / 2.0)
-            self.we_period2_temp = float(_response[46] / 2.0)
-            self.unknown2 = _response[47]
-            self.unknown3 = _response[48]
+            _response = self._send_request(HYSENHEAT_STATUS_REQUEST)
+            self.status_payload = bytes(_response)
+            self._decode_status(_response)
             self.fwversion = self.get_fwversion()
+            self._notify_changes()
+
+    # Decode the return payload of a status read (see get_device_status) into the device attributes
+    def _decode_status(self, _response):
+        self.key_lock = _response[3] & 0x01
+        self.manual_in_auto = (_response[4] >> 6) & 0x01
+        self.valve_state =  (_response[4] >> 4) & 0x01
+        self.power_state =  _response[4] & 0x01
+        self.room_temp = float((_response[5] & 0xFF) / 2.0)
+        self.target_temp = float((_response[6] & 0xFF) / 2.0)
+        self.operation_mode = _response[7] & 0x01
+        self.schedule = (_response[7] >> 4) & 0x0F
+        self.sensor = _response[8]
+        self.external_max_temp = float(_response[9])
+        self.hysteresis = _response[10]
+        self.max_temp = _response[11]
+        self.min_temp = _response[12]
+        self.calibration = (_response[13] << 8) + _response[14]
+        if self.calibration > 0x7FFF:
+            self.calibration = self.calibration - 0x10000
+        self.calibration = float(self.calibration / 2.0)
+        self.frost_protection = _response[15]
+        self.poweron = _response[16]
+        self.unknown1 = _response[17]
+        self.external_temp = float((_response[18] & 0xFF) / 2.0)
+        self.clock_hour = _response[19]
+        self.clock_minute = _response[20]
+        self.clock_second = _response[21]
+        self.clock_weekday = _response[22]
+        self.period1_hour = _response[23]
+        self.period1_min = _response[24]
+        self.period2_hour = _response[25]
+        self.period2_min = _response[26]
+        self.period3_hour = _response[27]
+        self.period3_min = _response[28]
+        self.period4_hour = _response[29]
+        self.period4_min = _response[30]
+        self.period5_hour = _response[31]
+        self.period5_min = _response[32]
+        self.period6_hour = _response[33]
+        self.period6_min = _response[34]
+        self.we_period1_hour = _response[35]
+        self.we_period1_min = _response[36]
+        self.we_period2_hour = _response[37]
+        self.we_period2_min = _response[38]
+        self.period1_temp = float(_response[39] / 2.0)
+        self.period2_temp = float(_response[40] / 2.0)
+        self.period3_temp = float(_response[41] / 2.0)
+        self.period4_temp = float(_response[42] / 2.0)
+        self.period5_temp = float(_response[43] / 2.0)
+        self.period6_temp = float(_response[44] / 2.0)
+        self.we_period1_temp = float(_response[45] / 2.0)
+        self.we_period2_temp = float(_response[46] / 2.0)
+        self.unknown2 = _response[47]
+        self.unknown3 = _response[48]
 
@@ -0,0 +1,167 @@
+"""
+Hysen thermostats rolling statistics
+Per device room temperature mean, min / max, rate of change and time above target over a sliding time window,
+maintained incrementally as status snapshots arrive
+"""
+
+import collections
+import threading
+import time
+
+HYSEN_ROLLING_DEFAULT_WINDOW    = 3600
+
+# The regression sums are rebuilt from the window when the newest sample is this many windows past their time origin
+HYSEN_ROLLING_REBASE_WINDOWS    = 10
+
+class HysenRollingWindow:
+    # Statistics of field over the samples of the last window seconds (the window ends at the newest sample)
+    # Every update is amortized O(1): running sums for the mean and the least squares slope,
+    # monotonic deques for min / max, and a running total of the time field was above target_temp
+    # (the state of a sample is held until the next one)
+    def __init__(self, window=HYSEN_ROLLING_DEFAULT_WINDOW, field='room_temp'):
+        self.window = window
+        self.field = field
+        self._samples = collections.deque()
+        self._minimums = collections.deque()
+        self._maximums = collections.deque()
+        self._origin = None
+        self._sum_t = 0.0
+        self._sum_v = 0.0
+        self._sum_tt = 0.0
+        self._sum_tv = 0.0
+        self._above = 0.0
+
+    def _add_sums(self, timestamp, value, sign):
+        t = timestamp - self._origin
+        self._sum_t += sign * t
+        self._sum_v += sign * value
+        self._sum_tt += sign * t * t
+        self._sum_tv += sign * t * value
+
+    def _rebase(self, origin):
+        self._origin = origin
+        self._sum_t = self._sum_v = self._sum_tt = self._sum_tv = 0.0
+        for timestamp, value, above in self._samples:
+            self._add_sums(timestamp, value, 1)
+
+    # Add a status (a status_snapshot dict) read at timestamp
+    # Returns False if the sample is older than the newest one and was dropped
+    def add(self, timestamp, status):
+        samples = self._samples
+        if samples and timestamp < samples[-1][0]:
+            return False
+        value = status[self.field]
+        above = value > status['target_temp']
+        if samples and samples[-1][2]:
+            self._above += timestamp - samples[-1][0]
+        if self._origin is None:
+            self._origin = timestamp
+        samples.append((timestamp, value, above))
+        self._add_sums(timestamp, value, 1)
+        while self._minimums and self._minimums[-1][1] >= value:
+            self._minimums.pop()
+        self._minimums.append((timestamp, value))
+        while self._maximums and self._maximums[-1][1] <= value:
+            self._maximums.pop()
+        self._maximums.append((timestamp, value))
+
+        cutoff = timestamp - self.window
+        while samples[0][0] < cutoff:
+            oldest_timestamp, oldest_value, oldest_above = samples.popleft()
+            if oldest_above:
+                self._above -= samples[0][0] - oldest_timestamp
+            self._add_sums(oldest_timestamp, oldest_value, -1)
+        while self._minimums[0][0] < cutoff:
+            self._minimums.popleft()
+        while self._maximums[0][0] < cutoff:
+            self._maximums.popleft()
+        if timestamp - self._origin > HYSEN_ROLLING_REBASE_WINDOWS * self.window:
+            self._rebase(samples[0][0])
+        return True
+
+    @property
+    def samples(self):
+        return len(self._samples)
+
+    @property
+    def mean(self):
+        return self._sum_v / len(self._samples) if self._samples else None
+
+    @property
+    def minimum(self):
+        return self._minimums[0][1] if self._minimums else None
+
+    @property
+    def maximum(self):
+        return self._maximums[0][1] if self._maximums else None
+
+    # Least squares slope of field in degrees per hour, None with less than 2 samples at different times
+    @property
+    def rate(self):
+        count = len(self._samples)
+        denominator = count * self._sum_tt - self._sum_t * self._sum_t
+        if count < 2 or denominator <= 0:
+            return None
+        return (count * self._sum_tv - self._sum_t * self._sum_v) / denominator * 3600
+
+    # Seconds of the window field was above target_temp
+    @property
+    def time_above_target(self):
+        return self._above
+
+    def as_dict(self):
+        return {
+            'samples': self.samples,
+            'mean': self.mean,
+            'min': self.minimum,
+            'max': self.maximum,
+            'rate': self.rate,
+            'time_above_target': self.time_above_target,
+        }
+
+class HysenRollingStats:
+    # Rolling windows of many devices, created on their first sample
+    def __init__(self, window=HYSEN_ROLLING_DEFAULT_WINDOW, field='room_temp'):
+        self.window = window
+        self.field = field
+        self.devices = {}
+        self._lock = threading.Lock()
+
+    def record(self, device_id, status, timestamp=None):
+        if timestamp is None:
+            timestamp = time.time()
+        with self._lock:
+            rolling = self.devices.get(device_id)
+            if rolling is None:
+                rolling = self.devices[device_id] = HysenRollingWindow(self.window, self.field)
+            return rolling.add(timestamp, status)
+
+    # Sample every fleet poll (see HysenFleet.add_status_callback)
+    def attach_fleet(self, fleet):
+        def record_state(device_id, changes):
+            state = fleet.states.get(device_id)
+            if state is not None:
+                self.record(device_id, state.status, state.updated)
+        fleet.add_status_callback(record_state)
+
+    # Sample every status read by device.get_device_status
+    def attach_device(self, device):
+        device.add_status_callback(
+            lambda device, changes: self.record(device.unique_id, device.status_snapshot()))
+
+    # Current statistics of a device, see HysenRollingWindow.as_dict
+    def stats(self, device_id):
+        with self._lock:
+            rolling = self.devices.get(device_id)
+            if rolling is None:
+                raise ValueError('Can\'t read rolling statistics (unknown device %s)' % (
+                    device_id))
+            return rolling.as_dict()
+
+    # Current statistics of the devices for which predicate(statistics) is true,
+    # e.g. lambda stats: stats['rate'] is not None and stats['rate'] < 0.5
+    # Returns {device_id: statistics}
+    def select(self, predicate):
+        with self._lock:
+            current = {device_id: rolling.as_dict() for device_id, rolling in self.devices.items()}
+        return {device_id: stats for device_id, stats in current.items() if predicate(stats)}
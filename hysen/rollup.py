@@ -0,0 +1,242 @@
+"""
+Hysen thermostats rollups
+Per device min / max / mean of temperatures and valve on fraction over 1 minute, 1 hour and 1 day buckets,
+updated as status snapshots arrive, and Largest-Triangle-Three-Buckets downsampling for charts
+"""
+
+import array
+import math
+import threading
+import time
+
+# (bucket length in seconds, buckets kept)
+HYSEN_ROLLUP_RESOLUTIONS = (
+    (60, 1440),
+    (3600, 24 * 31),
+    (86400, 366),
+)
+
+HYSEN_ROLLUP_FIELDS         = ('room_temp', 'external_temp', 'target_temp')
+
+HYSEN_ROLLUP_CHART_POINTS   = 500
+
+# A chart is read from the finest resolution with at most points * HYSEN_ROLLUP_CHART_OVERSAMPLING buckets
+HYSEN_ROLLUP_CHART_OVERSAMPLING = 4
+
+# Largest-Triangle-Three-Buckets downsampling of the points (x[i], y[i]) to at most threshold points
+# Keeps the first and last points and, in each bucket, the point making the largest triangle with
+# the previous kept point and the mean of the next bucket, so peaks and dips survive
+# Returns the kept points as two lists
+def lttb(x, y, threshold):
+    count = len(x)
+    if threshold >= count or threshold < 3:
+        return list(x), list(y)
+    sampled_x = [x[0]]
+    sampled_y = [y[0]]
+    every = (count - 2) / (threshold - 2)
+    previous = 0
+    for index in range(threshold - 2):
+        average_start = int((index + 1) * every) + 1
+        average_end = min(int((index + 2) * every) + 1, count)
+        average_len = average_end - average_start
+        average_x = sum(x[average_start:average_end]) / average_len
+        average_y = sum(y[average_start:average_end]) / average_len
+        range_start = int(index * every) + 1
+        range_end = int((index + 1) * every) + 1
+        previous_x = x[previous]
+        previous_y = y[previous]
+        largest_area = -1.0
+        selected = range_start
+        for point in range(range_start, range_end):
+            area = abs(
+                (previous_x - average_x) * (y[point] - previous_y) -
+                (previous_x - x[point]) * (average_y - previous_y))
+            if area > largest_area:
+                largest_area = area
+                selected = point
+        sampled_x.append(x[selected])
+        sampled_y.append(y[selected])
+        previous = selected
+    sampled_x.append(x[-1])
+    sampled_y.append(y[-1])
+    return sampled_x, sampled_y
+
+class HysenDeviceRollup:
+    # Buckets of one device at one resolution, the last capacity closed buckets are kept in a ring
+    # The open bucket (the one of the last sample) is closed by the first sample of a later bucket
+    # Samples older than the open bucket are dropped
+    def __init__(self, resolution, capacity, fields):
+        self.resolution = resolution
+        self.capacity = capacity
+        self.fields = tuple(fields)
+        self.count = 0
+        self._next = 0
+        self.starts = array.array('d', bytes(8 * capacity))
+        self.samples = array.array('I', bytes(4 * capacity))
+        self.valve_on = array.array('I', bytes(4 * capacity))
+        self.minimums = {field: array.array('d', bytes(8 * capacity)) for field in self.fields}
+        self.maximums = {field: array.array('d', bytes(8 * capacity)) for field in self.fields}
+        self.sums = {field: array.array('d', bytes(8 * capacity)) for field in self.fields}
+        self._open_start = None
+
+    def _open(self, start):
+        self._open_start = start
+        self._open_samples = 0
+        self._open_valve_on = 0
+        self._open_minimums = dict.fromkeys(self.fields, math.inf)
+        self._open_maximums = dict.fromkeys(self.fields, -math.inf)
+        self._open_sums = dict.fromkeys(self.fields, 0.0)
+
+    def _close(self):
+        position = self._next
+        self.starts[position] = self._open_start
+        self.samples[position] = self._open_samples
+        self.valve_on[position] = self._open_valve_on
+        for field in self.fields:
+            self.minimums[field][position] = self._open_minimums[field]
+            self.maximums[field][position] = self._open_maximums[field]
+            self.sums[field][position] = self._open_sums[field]
+        self._next = (position + 1) % self.capacity
+        if self.count < self.capacity:
+            self.count += 1
+
+    # Add a status (a status_snapshot dict) read at timestamp
+    # Returns False if the sample was dropped
+    def add(self, timestamp, status):
+        start = timestamp - timestamp % self.resolution
+        if self._open_start is None:
+            self._open(start)
+        elif start > self._open_start:
+            self._close()
+            self._open(start)
+        elif start < self._open_start:
+            return False
+        self._open_samples += 1
+        if status.get('valve_state'):
+            self._open_valve_on += 1
+        for field in self.fields:
+            value = status[field]
+            if value < self._open_minimums[field]:
+                self._open_minimums[field] = value
+            if value > self._open_maximums[field]:
+                self._open_maximums[field] = value
+            self._open_sums[field] += value
+        return True
+
+    def _position(self, index):
+        return (self._next - self.count + index) % self.capacity
+
+    # Whether the buckets from start on are all kept (start = None: since the first sample)
+    def covers(self, start):
+        if self.count < self.capacity:
+            return True
+        return start is not None and start >= self.starts[self._position(0)]
+
+    def _bisect(self, timestamp):
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.starts[self._position(middle)] < timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    # Buckets starting in [start, end), None = unbounded, the open bucket included
+    # Returns {'start': [...], 'samples': [...], 'valve_on': [fraction of samples with the valve on],
+    #          '<field>_min': [...], '<field>_max': [...], '<field>_mean': [...]}
+    def buckets(self, start=None, end=None):
+        first = 0 if start is None else self._bisect(start)
+        last = self.count if end is None else self._bisect(end)
+        positions = [self._position(index) for index in range(first, last)]
+        result = {
+            'start': [self.starts[position] for position in positions],
+            'samples': [self.samples[position] for position in positions],
+            'valve_on': [self.valve_on[position] / self.samples[position] for position in positions],
+        }
+        for field in self.fields:
+            result[field + '_min'] = [self.minimums[field][position] for position in positions]
+            result[field + '_max'] = [self.maximums[field][position] for position in positions]
+            result[field + '_mean'] = [
+                self.sums[field][position] / self.samples[position] for position in positions]
+        if self._open_start is not None and self._open_samples and \
+           (start is None or self._open_start >= start) and \
+           (end is None or self._open_start < end):
+            result['start'].append(self._open_start)
+            result['samples'].append(self._open_samples)
+            result['valve_on'].append(self._open_valve_on / self._open_samples)
+            for field in self.fields:
+                result[field + '_min'].append(self._open_minimums[field])
+                result[field + '_max'].append(self._open_maximums[field])
+                result[field + '_mean'].append(self._open_sums[field] / self._open_samples)
+        return result
+
+class HysenRollups:
+    # Rollups of many devices at every resolution, created on their first status
+    # Only the fields of HYSEN_ROLLUP_FIELDS a device has are rolled up (no external_temp on 2 pipe fan coil)
+    def __init__(self, resolutions=HYSEN_ROLLUP_RESOLUTIONS, fields=HYSEN_ROLLUP_FIELDS):
+        self.resolutions = tuple(resolutions)
+        self.fields = tuple(fields)
+        self.devices = {}
+        self._lock = threading.Lock()
+
+    def record(self, device_id, status, timestamp=None):
+        if timestamp is None:
+            timestamp = time.time()
+        with self._lock:
+            rollups = self.devices.get(device_id)
+            if rollups is None:
+                fields = [field for field in self.fields if field in status]
+                rollups = self.devices[device_id] = {
+                    resolution: HysenDeviceRollup(resolution, capacity, fields)
+                    for resolution, capacity in self.resolutions}
+            for rollup in rollups.values():
+                rollup.add(timestamp, status)
+
+    # Roll up every fleet poll (see HysenFleet.add_status_callback)
+    def attach_fleet(self, fleet):
+        def record_state(device_id, changes):
+            state = fleet.states.get(device_id)
+            if state is not None:
+                self.record(device_id, state.status, state.updated)
+        fleet.add_status_callback(record_state)
+
+    # Roll up every status read by device.get_device_status
+    def attach_device(self, device):
+        device.add_status_callback(
+            lambda device, changes: self.record(device.unique_id, device.status_snapshot()))
+
+    # Buckets of a device at resolution (seconds), see HysenDeviceRollup.buckets
+    def buckets(self, device_id, resolution, start=None, end=None):
+        with self._lock:
+            rollups = self.devices.get(device_id)
+            if rollups is None or resolution not in rollups:
+                raise ValueError('Can\'t read rollup (no %ss rollup of device %s)' % (
+                    resolution, device_id))
+            return rollups[resolution].buckets(start, end)
+
+    # At most points (timestamp, mean of field) of a device over [start, end), for charts
+    # Read from the finest resolution still holding start with at most points * HYSEN_ROLLUP_CHART_OVERSAMPLING
+    # buckets in the range (a coarser one is only used if it has at least points buckets),
+    # then downsampled with lttb
+    def chart(self, device_id, field, start=None, end=None, points=HYSEN_ROLLUP_CHART_POINTS):
+        with self._lock:
+            rollups = self.devices.get(device_id)
+            if rollups is None:
+                raise ValueError('Can\'t chart rollup (unknown device %s)' % (
+                    device_id))
+            chosen = None
+            for index, (resolution, capacity) in enumerate(self.resolutions):
+                rollup = rollups[resolution]
+                if not rollup.covers(start) and index < len(self.resolutions) - 1:
+                    continue
+                buckets = rollup.buckets(start, end)
+                if chosen is not None and len(buckets['start']) < points:
+                    break
+                chosen = buckets
+                if len(buckets['start']) <= points * HYSEN_ROLLUP_CHART_OVERSAMPLING:
+                    break
+        if field + '_mean' not in chosen:
+            raise ValueError('Can\'t chart rollup (no %s rollup of device %s)' % (
+                field, device_id))
+        return lttb(chosen['start'], chosen[field + '_mean'], points)
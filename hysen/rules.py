@@ -0,0 +1,151 @@
+"""
+Hysen thermostats rule engine
+Alerts evaluated on status changes, only the rules depending on the changed fields are evaluated
+"""
+
+import collections
+import heapq
+import threading
+import time
+
+HYSEN_ALERT_FIRED               = 'fired'
+HYSEN_ALERT_CLEARED             = 'cleared'
+
+# Alert passed to the engine callbacks
+# kind = HYSEN_ALERT_FIRED or HYSEN_ALERT_CLEARED, since = when the condition became true
+HysenAlert = collections.namedtuple(
+    'HysenAlert',
+    ['rule', 'device_id', 'kind', 'timestamp', 'since', 'status'])
+
+class HysenRule:
+    # name = unique name of the rule
+    # fields = status fields the rule depends on, it is only evaluated when one of them changes
+    # condition(device_id, status) = True when the alert should be active,
+    #   None fires an alert on every change of the fields (e.g. key_lock changed), never cleared,
+    #   the first status of a device is not a change
+    # duration = seconds the condition must stay true before the alert fires
+    def __init__(self, name, fields, condition=None, duration=0):
+        self.name = name
+        self.fields = tuple(fields)
+        self.condition = condition
+        self.duration = duration
+
+class HysenRuleEngine:
+    # Rules evaluated per device on status changes (see update), the cost of an update is the number
+    # of rules depending on the changed fields, not rules x devices
+    # Duration conditions are timers fired by tick, called on every update and by the caller if needed
+    # active = (rule name, device_id) -> time the condition became true, for conditions currently true
+    # (fired or waiting for their duration)
+    def __init__(self):
+        self.rules = {}
+        self.active = {}
+        self.fired = set()
+        self._rules_by_field = {}
+        self._timers = []
+        self._statuses = {}
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def add_rule(self, rule):
+        with self._lock:
+            if rule.name in self.rules:
+                raise ValueError('Can\'t add rule (a rule named %s exists)' % (
+                    rule.name))
+            self.rules[rule.name] = rule
+            for field in rule.fields:
+                self._rules_by_field.setdefault(field, []).append(rule)
+
+    def remove_rule(self, name):
+        with self._lock:
+            rule = self.rules.pop(name)
+            for field in rule.fields:
+                self._rules_by_field[field].remove(rule)
+            for key in [key for key in self.active if key[0] == name]:
+                del self.active[key]
+                self.fired.discard(key)
+
+    # Register a callback called with a HysenAlert when an alert fires or clears
+    # Callbacks run in the thread calling update or tick, they should be quick
+    def add_callback(self, callback):
+        self._callbacks.append(callback)
+
+    def remove_callback(self, callback):
+        self._callbacks.remove(callback)
+
+    # Evaluate the rules depending on changes ({field: new value}) of a device
+    # status = the whole current status of the device (a status_snapshot dict)
+    def update(self, device_id, changes, status, timestamp=None):
+        if timestamp is None:
+            timestamp = time.time()
+        alerts = []
+        with self._lock:
+            first = device_id not in self._statuses
+            self._statuses[device_id] = status
+            rules = {}
+            for field in changes:
+                for rule in self._rules_by_field.get(field, ()):
+                    rules[rule.name] = rule
+            for rule in rules.values():
+                key = (rule.name, device_id)
+                if rule.condition is None:
+                    if first:
+                        continue
+                    alerts.append(HysenAlert(rule.name, device_id, HYSEN_ALERT_FIRED, timestamp, timestamp, status))
+                elif rule.condition(device_id, status):
+                    if key not in self.active:
+                        self.active[key] = timestamp
+                        if rule.duration > 0:
+                            heapq.heappush(self._timers, (timestamp + rule.duration, rule.name, device_id, timestamp))
+                        else:
+                            self.fired.add(key)
+                            alerts.append(HysenAlert(
+                                rule.name, device_id, HYSEN_ALERT_FIRED, timestamp, timestamp, status))
+                elif key in self.active:
+                    since = self.active.pop(key)
+                    if key in self.fired:
+                        self.fired.discard(key)
+                        alerts.append(HysenAlert(
+                            rule.name, device_id, HYSEN_ALERT_CLEARED, timestamp, since, status))
+            alerts.extend(self._expire(timestamp))
+        self._notify(alerts)
+        return alerts
+
+    # Fire the duration conditions that held long enough by now
+    def tick(self, now=None):
+        if now is None:
+            now = time.time()
+        with self._lock:
+            alerts = self._expire(now)
+        self._notify(alerts)
+        return alerts
+
+    def _expire(self, now):
+        alerts = []
+        timers = self._timers
+        while timers and timers[0][0] <= now:
+            due, name, device_id, since = heapq.heappop(timers)
+            key = (name, device_id)
+            # timers of conditions that became false (or were restarted) since are stale
+            if self.active.get(key) == since and key not in self.fired:
+                self.fired.add(key)
+                alerts.append(HysenAlert(
+                    name, device_id, HYSEN_ALERT_FIRED, due, since, self._statuses.get(device_id)))
+        return alerts
+
+    def _notify(self, alerts):
+        for alert in alerts:
+            for callback in list(self._callbacks):
+                callback(alert)
+
+    # Evaluate the rules on every fleet poll that changed something (see HysenFleet.add_change_callback)
+    def attach_fleet(self, fleet):
+        def update_state(device_id, changes):
+            state = fleet.states.get(device_id)
+            if state is not None:
+                self.update(device_id, changes, state.status, state.updated)
+        fleet.add_change_callback(update_state)
+
+    # Evaluate the rules on every status read by device.get_device_status that changed something
+    def attach_device(self, device):
+        device.add_change_callback(
+            lambda device, changes: self.update(device.unique_id, changes, device.status_snapshot()))
@@ -0,0 +1,208 @@
+"""
+Hysen thermostats snapshot log
+Append only file of fixed size records (timestamp, device and raw status payload),
+memory mapped for writing and for reading by time
+"""
+
+import mmap
+import os
+import struct
+import threading
+import time
+
+from .discovery import HYSEN_DEVICE_CLASSES
+
+HYSEN_SNAPSHOT_LOG_MAGIC        = b'HYSNLOG\x01'
+
+# File header: magic, number of records
+HYSEN_SNAPSHOT_LOG_HEADER       = struct.Struct('<8sQ')
+
+# Record: timestamp (float64), device type, MAC address, payload length, then the payload padded to
+# HYSEN_SNAPSHOT_LOG_PAYLOAD_SIZE, the largest status return payload (0x01, 0x03, len + 0x17 words)
+HYSEN_SNAPSHOT_LOG_PAYLOAD_SIZE = 3 + 2 * 0x17
+HYSEN_SNAPSHOT_LOG_RECORD       = struct.Struct('<dH6sB%ss' % HYSEN_SNAPSHOT_LOG_PAYLOAD_SIZE)
+HYSEN_SNAPSHOT_LOG_PAYLOAD      = HYSEN_SNAPSHOT_LOG_RECORD.size - HYSEN_SNAPSHOT_LOG_PAYLOAD_SIZE
+
+# Records added to the file when it is full
+HYSEN_SNAPSHOT_LOG_GROWTH       = 4096
+
+_TIMESTAMP = struct.Struct('<d')
+_MAC_OFFSET = 10
+_RECORD_HEADER = struct.Struct('<dH6sB')
+
+class HysenSnapshotLog:
+    # Log file opened for appending (readonly=False, created if needed) or for reading
+    # A reader sees the records appended by a writer of the same file as they are committed
+    # Records are kept in time order, lookups by time are binary searches: a record with a timestamp older
+    # than the last one is not appended
+    def __init__(self, path, readonly=False, growth=HYSEN_SNAPSHOT_LOG_GROWTH):
+        self.path = path
+        self.readonly = readonly
+        self.growth = growth
+        self._lock = threading.Lock()
+        self._decoders = {}
+        if readonly:
+            self._file = open(path, 'rb')
+        else:
+            if not os.path.exists(path):
+                with open(path, 'wb') as f:
+                    f.write(HYSEN_SNAPSHOT_LOG_HEADER.pack(HYSEN_SNAPSHOT_LOG_MAGIC, 0))
+            self._file = open(path, 'r+b')
+        self._map = None
+        self._map_file()
+        magic, count = HYSEN_SNAPSHOT_LOG_HEADER.unpack_from(self._map, 0)
+        if magic != HYSEN_SNAPSHOT_LOG_MAGIC:
+            self.close()
+            raise ValueError('Can\'t open snapshot log (%s is not a Hysen snapshot log)' % (
+                path))
+
+    def _map_file(self):
+        if self._map is not None:
+            self._map.close()
+        if self.readonly:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self._map = mmap.mmap(self._file.fileno(), 0)
+        self._capacity = (len(self._map) - HYSEN_SNAPSHOT_LOG_HEADER.size) // HYSEN_SNAPSHOT_LOG_RECORD.size
+
+    # Number of committed records
+    def __len__(self):
+        return HYSEN_SNAPSHOT_LOG_HEADER.unpack_from(self._map, 0)[1]
+
+    def _offset(self, index):
+        return HYSEN_SNAPSHOT_LOG_HEADER.size + index * HYSEN_SNAPSHOT_LOG_RECORD.size
+
+    # Append the last status read by device (its status_payload)
+    # Returns False if the record is older than the last one and was not appended
+    def append(self, device, timestamp=None):
+        return self.append_payload(device.devtype, device.mac, device.status_payload, timestamp)
+
+    # Append a raw status payload, the record is committed once written
+    # timestamp = None stamps the record with the current time, taken under the append lock
+    # (and never older than the last record, should the clock step back)
+    # Returns False if timestamp is older than the last record, which is then not appended
+    def append_payload(self, devtype, mac, payload, timestamp=None):
+        if len(payload) > HYSEN_SNAPSHOT_LOG_PAYLOAD_SIZE:
+            raise ValueError('Can\'t append snapshot (payload of %s bytes is too long)' % (
+                len(payload)))
+        with self._lock:
+            count = len(self)
+            last = self.timestamp(count - 1) if count else None
+            if timestamp is None:
+                timestamp = time.time() if last is None else max(time.time(), last)
+            elif last is not None and timestamp < last:
+                return False
+            if count >= self._capacity:
+                self._map.flush()
+                self._file.truncate(self._offset(count + self.growth))
+                self._map_file()
+            offset = self._offset(count)
+            _RECORD_HEADER.pack_into(self._map, offset, timestamp, devtype, bytes(mac), len(payload))
+            self._map[offset + HYSEN_SNAPSHOT_LOG_PAYLOAD:offset + HYSEN_SNAPSHOT_LOG_PAYLOAD + len(payload)] = payload
+            HYSEN_SNAPSHOT_LOG_HEADER.pack_into(self._map, 0, HYSEN_SNAPSHOT_LOG_MAGIC, count + 1)
+        return True
+
+    # Append every status read by the fleet (see HysenFleet.add_status_callback)
+    # Fleet callbacks run in concurrent workers, records are stamped when appended
+    def attach_fleet(self, fleet):
+        def append_state(device_id, changes):
+            device = fleet.devices.get(device_id)
+            if device is not None:
+                self.append(device)
+        fleet.add_status_callback(append_state)
+
+    # Append every status read by device.get_device_status
+    def attach_device(self, device):
+        device.add_status_callback(lambda device, changes: self.append(device))
+
+    # A reader remaps the file when a writer made it grow
+    def _check_map(self, count):
+        if count > self._capacity:
+            self._map_file()
+
+    def timestamp(self, index):
+        return _TIMESTAMP.unpack_from(self._map, self._offset(index))[0]
+
+    def _mac(self, index):
+        offset = self._offset(index) + _MAC_OFFSET
+        return self._map[offset:offset + 6]
+
+    # Index of the first record at or after timestamp
+    def bisect(self, timestamp):
+        with self._lock:
+            count = len(self)
+            self._check_map(count)
+            low, high = 0, count
+            while low < high:
+                middle = (low + high) // 2
+                if self.timestamp(middle) < timestamp:
+                    low = middle + 1
+                else:
+                    high = middle
+            return low
+
+    # Record as (timestamp, devtype, mac, payload), the payload is copied
+    def record(self, index):
+        with self._lock:
+            self._check_map(len(self))
+            offset = self._offset(index)
+            timestamp, devtype, mac, payload_len = _RECORD_HEADER.unpack_from(self._map, offset)
+            offset += HYSEN_SNAPSHOT_LOG_PAYLOAD
+            return timestamp, devtype, mac, self._map[offset:offset + payload_len]
+
+    # Decode a record straight from the map, without copying its payload
+    # Returns (timestamp, device unique_id, status dict with the fields of the device class status_snapshot)
+    def decode(self, index):
+        with self._lock:
+            self._check_map(len(self))
+            offset = self._offset(index)
+            timestamp, devtype, mac, payload_len = _RECORD_HEADER.unpack_from(self._map, offset)
+            decoder = self._decoder(devtype)
+            offset += HYSEN_SNAPSHOT_LOG_PAYLOAD
+            with memoryview(self._map) as view:
+                with view[offset:offset + payload_len] as payload:
+                    decoder._decode_status(payload)
+            status = decoder.status_snapshot()
+        del status['fwversion']
+        return timestamp, ''.join(format(x, '02x') for x in mac), status
+
+    # Device used to decode the payloads of a device type, never connected
+    def _decoder(self, devtype):
+        decoder = self._decoders.get(devtype)
+        if decoder is None:
+            device_class = HYSEN_DEVICE_CLASSES.get(devtype)
+            if device_class is None:
+                raise ValueError('Can\'t decode snapshot (unknown device type 0x%04x)' % (
+                    devtype))
+            decoder = self._decoders[devtype] = device_class(('0.0.0.0', 0), bytes(6), 0, False, 0)
+        return decoder
+
+    # Decoded records with start <= timestamp < end, None = unbounded, optionally of one device only
+    # Yields (timestamp, device unique_id, status)
+    def range(self, start=None, end=None, device_id=None):
+        first = 0 if start is None else self.bisect(start)
+        last = len(self) if end is None else self.bisect(end)
+        mac = None if device_id is None else bytes.fromhex(device_id)
+        for index in range(first, last):
+            if mac is None or self._mac(index) == mac:
+                yield self.decode(index)
+
+    def flush(self):
+        with self._lock:
+            if not self.readonly:
+                self._map.flush()
+
+    def close(self):
+        with self._lock:
+            if self._map is not None:
+                if not self.readonly:
+                    self._map.flush()
+                self._map.close()
+                self._map = None
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,189 @@
+"""
+Hysen thermostats SQLite history
+Status snapshots stored in a SQLite database (WAL mode), written in batches
+"""
+
+import sqlite3
+import threading
+import time
+
+from .discovery import HYSEN_DEVICE_CLASSES
+from .fleet import HYSEN_MODELS
+
+HYSEN_SQLITE_DEFAULT_BATCH_SIZE     = 1000
+HYSEN_SQLITE_DEFAULT_FLUSH_INTERVAL = 10
+
+# Status fields of each model, one column each in the hysen_<model>_status table
+HYSEN_SQLITE_FIELDS = {
+    HYSEN_MODELS[devtype]: device_class.STATUS_FIELDS
+    for devtype, device_class in HYSEN_DEVICE_CLASSES.items()}
+
+def _table(model):
+    return 'hysen_%s_status' % model
+
+class HysenSqliteHistory:
+    # Snapshots are queued and written in one transaction once batch_size are queued
+    # or, by a background thread, flush_interval seconds after the first of them was queued (None = no thread),
+    # close or flush write the queued snapshots at once
+    # Tables: hysen_devices (id, device_id, model) and one hysen_<model>_status table
+    # (device = hysen_devices.id, timestamp, a column per status field) indexed on (device, timestamp)
+    def __init__(
+        self,
+        path,
+        batch_size=HYSEN_SQLITE_DEFAULT_BATCH_SIZE,
+        flush_interval=HYSEN_SQLITE_DEFAULT_FLUSH_INTERVAL):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._queued = threading.Condition(self._lock)
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._create_tables()
+        self._device_ids = {
+            device_id: (row_id, model)
+            for row_id, device_id, model in self._connection.execute(
+                'SELECT id, device_id, model FROM hysen_devices')}
+        self._pending = {model: [] for model in HYSEN_SQLITE_FIELDS}
+        self._pending_count = 0
+        self._pending_since = None
+        self._closed = False
+        self._flusher = None
+        if flush_interval is not None:
+            self._flusher = threading.Thread(target=self._run_flusher, daemon=True)
+            self._flusher.start()
+
+    def _create_tables(self):
+        with self._connection:
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS hysen_devices ('
+                'id INTEGER PRIMARY KEY, device_id TEXT UNIQUE NOT NULL, model TEXT NOT NULL)')
+            for model, fields in HYSEN_SQLITE_FIELDS.items():
+                self._connection.execute(
+                    'CREATE TABLE IF NOT EXISTS %s (device INTEGER NOT NULL, timestamp REAL NOT NULL, %s)' % (
+                        _table(model), ', '.join(fields)))
+                self._connection.execute(
+                    'CREATE INDEX IF NOT EXISTS %s_device_timestamp ON %s (device, timestamp)' % (
+                        _table(model), _table(model)))
+
+    def _device_row_id(self, device_id, model):
+        known = self._device_ids.get(device_id)
+        if known is None:
+            cursor = self._connection.execute(
+                'INSERT INTO hysen_devices (device_id, model) VALUES (?, ?)', (device_id, model))
+            self._connection.commit()
+            known = self._device_ids[device_id] = (cursor.lastrowid, model)
+        return known[0]
+
+    # Queue a status (a status_snapshot dict) of a device of model ('heating' or '2pfc')
+    def record(self, device_id, model, status, timestamp=None):
+        if model not in HYSEN_SQLITE_FIELDS:
+            raise ValueError('Can\'t record status (unknown model %s)' % (
+                model))
+        if timestamp is None:
+            timestamp = time.time()
+        with self._lock:
+            row = [self._device_row_id(device_id, model), timestamp]
+            row.extend(status[field] for field in HYSEN_SQLITE_FIELDS[model])
+            self._pending[model].append(row)
+            self._pending_count += 1
+            if self._pending_count >= self.batch_size:
+                self._flush()
+            elif self._pending_since is None:
+                self._pending_since = time.monotonic()
+                self._queued.notify()
+
+    # Record every fleet poll (see HysenFleet.add_status_callback)
+    def attach_fleet(self, fleet):
+        def record_state(device_id, changes):
+            state = fleet.states.get(device_id)
+            if state is not None:
+                self.record(device_id, state.model, state.status, state.updated)
+        fleet.add_status_callback(record_state)
+
+    # Record every status read by device.get_device_status
+    def attach_device(self, device):
+        model = HYSEN_MODELS.get(device.devtype)
+        device.add_status_callback(
+            lambda device, changes: self.record(device.unique_id, model, device.status_snapshot()))
+
+    # Write the queued snapshots flush_interval seconds after the first of them was queued
+    def _run_flusher(self):
+        with self._queued:
+            while not self._closed:
+                if self._pending_since is None:
+                    self._queued.wait()
+                    continue
+                remaining = self._pending_since + self.flush_interval - time.monotonic()
+                if remaining > 0:
+                    self._queued.wait(remaining)
+                else:
+                    self._flush()
+
+    def _flush(self):
+        with self._connection:
+            for model, rows in self._pending.items():
+                if rows:
+                    fields = HYSEN_SQLITE_FIELDS[model]
+                    self._connection.executemany(
+                        'INSERT INTO %s (device, timestamp, %s) VALUES (%s)' % (
+                            _table(model), ', '.join(fields), ', '.join('?' * (len(fields) + 2))),
+                        rows)
+                    rows.clear()
+        self._pending_count = 0
+        self._pending_since = None
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    # Snapshots of a device with start <= timestamp < end, None = unbounded, in time order
+    # Queued snapshots are written first
+    # Returns a list of (timestamp, {field: value}), fields = all the status fields by default
+    def query(self, device_id, start=None, end=None, fields=None):
+        with self._lock:
+            self._flush()
+            known = self._device_ids.get(device_id)
+            if known is None:
+                return []
+            row_id, model = known
+            if fields is None:
+                fields = HYSEN_SQLITE_FIELDS[model]
+            for field in fields:
+                if field not in HYSEN_SQLITE_FIELDS[model]:
+                    raise ValueError('Can\'t query history (unknown field %s)' % (
+                        field))
+            conditions = ['device = ?']
+            parameters = [row_id]
+            if start is not None:
+                conditions.append('timestamp >= ?')
+                parameters.append(start)
+            if end is not None:
+                conditions.append('timestamp < ?')
+                parameters.append(end)
+            rows = self._connection.execute(
+                'SELECT timestamp, %s FROM %s WHERE %s ORDER BY timestamp' % (
+                    ', '.join(fields), _table(model), ' AND '.join(conditions)),
+                parameters).fetchall()
+        return [(row[0], dict(zip(fields, row[1:]))) for row in rows]
+
+    # Known devices as {device_id: model}
+    def devices(self):
+        with self._lock:
+            return {device_id: model for device_id, (row_id, model) in self._device_ids.items()}
+
+    def close(self):
+        with self._lock:
+            self._flush()
+            self._closed = True
+            self._queued.notify()
+            self._connection.close()
+        if self._flusher is not None:
+            self._flusher.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
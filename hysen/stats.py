@@ -0,0 +1,197 @@
+"""
+Hysen thermostats instrumentation
+Latency histograms, round trips and retry counters collected by HysenDevice.set_stats
+"""
+
+import bisect
+import collections
+import threading
+
+# Upper bounds in seconds of the latency histogram buckets, a last bucket catches anything slower
+HYSEN_STATS_BUCKETS = (
+    0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0, 10.0)
+
+HYSEN_STATS_OPERATION   = 'operation'
+HYSEN_STATS_ROUND_TRIP  = 'round_trip'
+HYSEN_STATS_TIMEOUT     = 'timeout'
+HYSEN_STATS_RESOLVE     = 'resolve'
+HYSEN_STATS_AUTH        = 'auth'
+
+# Event passed to the stats callbacks
+# kind = HYSEN_STATS_OPERATION (a public method call), HYSEN_STATS_ROUND_TRIP (a packet exchanged),
+#        HYSEN_STATS_TIMEOUT, HYSEN_STATS_RESOLVE (host re-resolved), HYSEN_STATS_AUTH (authentication sent)
+# name = method name for operations, packet type for round trips
+# seconds, round_trips and error are only set for operations and round trips
+HysenStatsEvent = collections.namedtuple(
+    'HysenStatsEvent',
+    ['kind', 'device_id', 'name', 'seconds', 'round_trips', 'error'])
+
+class LatencyHistogram:
+    def __init__(self, buckets=HYSEN_STATS_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def record(self, seconds):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        if self.min is None or seconds < self.min:
+            self.min = seconds
+        if self.max is None or seconds > self.max:
+            self.max = seconds
+
+    # Upper bound of the bucket holding the given fraction of the samples (e.g. 0.99)
+    # The maximum is returned for the last bucket
+    def percentile(self, fraction):
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                if index < len(self.buckets):
+                    return min(self.buckets[index], self.max)
+                return self.max
+        return self.max
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'mean': self.sum / self.count if self.count else None,
+            'min': self.min,
+            'max': self.max,
+            'p50': self.percentile(0.50),
+            'p99': self.percentile(0.99),
+            'buckets': dict(zip([str(bucket) for bucket in self.buckets] + ['+Inf'], self.counts)),
+        }
+
+class HysenDeviceStats:
+    def __init__(self, buckets=HYSEN_STATS_BUCKETS):
+        self.rtt = LatencyHistogram(buckets)
+        self.round_trips = 0
+        self.operations = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.resolves = 0
+        self.auths = 0
+
+    def as_dict(self):
+        return {
+            'rtt': self.rtt.as_dict(),
+            'round_trips': self.round_trips,
+            'operations': self.operations,
+            'errors': self.errors,
+            'timeouts': self.timeouts,
+            'resolves': self.resolves,
+            'auths': self.auths,
+        }
+
+class HysenOperationStats:
+    def __init__(self, buckets=HYSEN_STATS_BUCKETS):
+        self.latency = LatencyHistogram(buckets)
+        self.round_trips = 0
+        self.errors = 0
+
+    def as_dict(self):
+        calls = self.latency.count
+        return {
+            'latency': self.latency.as_dict(),
+            'calls': calls,
+            'errors': self.errors,
+            'round_trips': self.round_trips,
+            'round_trips_per_call': self.round_trips / calls if calls else None,
+        }
+
+class HysenStats:
+    # Statistics shared by any number of devices (see HysenDevice.set_stats)
+    # operations = per public method (get_device_status, set_period3, ...) latency and round trips,
+    #              only the outermost call is counted (set_period3 includes its status read)
+    # devices = per device (unique_id) round trip time, timeouts, re-resolutions and authentications
+    def __init__(self, buckets=HYSEN_STATS_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.operations = {}
+        self.devices = {}
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    # Register a callback called with a HysenStatsEvent for every recorded event
+    # Callbacks run in the thread talking to the device, they should be quick
+    def add_callback(self, callback):
+        self._callbacks.append(callback)
+
+    def remove_callback(self, callback):
+        self._callbacks.remove(callback)
+
+    def _device(self, device_id):
+        device_stats = self.devices.get(device_id)
+        if device_stats is None:
+            device_stats = self.devices[device_id] = HysenDeviceStats(self.buckets)
+        return device_stats
+
+    def _notify(self, event):
+        for callback in self._callbacks:
+            callback(event)
+
+    def record_operation(self, device_id, name, seconds, round_trips, error):
+        with self._lock:
+            operation = self.operations.get(name)
+            if operation is None:
+                operation = self.operations[name] = HysenOperationStats(self.buckets)
+            operation.latency.record(seconds)
+            operation.round_trips += round_trips
+            device_stats = self._device(device_id)
+            device_stats.operations += 1
+            if error:
+                operation.errors += 1
+                device_stats.errors += 1
+        if self._callbacks:
+            self._notify(HysenStatsEvent(HYSEN_STATS_OPERATION, device_id, name, seconds, round_trips, error))
+
+    def record_round_trip(self, device_id, packet_type, seconds):
+        with self._lock:
+            device_stats = self._device(device_id)
+            device_stats.rtt.record(seconds)
+            device_stats.round_trips += 1
+        if self._callbacks:
+            self._notify(HysenStatsEvent(HYSEN_STATS_ROUND_TRIP, device_id, packet_type, seconds, 1, False))
+
+    # kind = HYSEN_STATS_TIMEOUT, HYSEN_STATS_RESOLVE or HYSEN_STATS_AUTH
+    def record_event(self, device_id, kind):
+        with self._lock:
+            device_stats = self._device(device_id)
+            if kind == HYSEN_STATS_TIMEOUT:
+                device_stats.timeouts += 1
+            elif kind == HYSEN_STATS_RESOLVE:
+                device_stats.resolves += 1
+            elif kind == HYSEN_STATS_AUTH:
+                device_stats.auths += 1
+        if self._callbacks:
+            self._notify(HysenStatsEvent(kind, device_id, None, None, None, None))
+
+    # Devices sorted by mean round trip time, slowest first
+    def slowest_devices(self, count=10):
+        with self._lock:
+            measured = [
+                (device_stats.rtt.sum / device_stats.rtt.count, device_id)
+                for device_id, device_stats in self.devices.items()
+                if device_stats.rtt.count]
+        measured.sort(reverse=True)
+        return [(device_id, mean) for mean, device_id in measured[:count]]
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                'operations': {name: operation.as_dict() for name, operation in self.operations.items()},
+                'devices': {device_id: device_stats.as_dict() for device_id, device_stats in self.devices.items()},
+            }
+
+    def reset(self):
+        with self._lock:
+            self.operations = {}
+            self.devices = {}
@@ -0,0 +1,144 @@
+"""
+Hysen thermostats change stream
+Pushes the status changes of a HysenFleet to any number of clients (server-sent events, see HysenGateway),
+each client has a bounded buffer of pending changes where superseded updates are merged,
+so a slow client never grows memory without bound nor blocks the fleet poller
+"""
+
+import collections
+import json
+import threading
+
+# Devices with pending changes a client may have, beyond that its pending changes are dropped
+# and it is sent a full snapshot instead
+HYSEN_STREAM_MAX_PENDING        = 1024
+
+# Seconds without any event after which a keepalive comment is sent
+HYSEN_STREAM_KEEPALIVE          = 15
+
+# Seconds a write to a client may block before the client is dropped
+HYSEN_STREAM_SEND_TIMEOUT       = 60
+
+HYSEN_STREAM_CONTENT_TYPE       = 'text/event-stream'
+
+# A server-sent event, data must be a single line (e.g. compact JSON)
+def sse_event(event, data, event_id=None):
+    lines = ['event: %s' % event]
+    if event_id is not None:
+        lines.append('id: %s' % event_id)
+    lines.append('data: %s' % data)
+    return ('\n'.join(lines) + '\n\n').encode('utf-8')
+
+class HysenStreamClient:
+    # Pending changes of one client, {device_id: [fleet version, {field: new value}]} in arrival order
+    # A change of a device already pending is merged into it (the newer values win), so the buffer holds
+    # at most one entry per device whatever the rate of changes
+    # When more than max_pending devices are pending, they are dropped and resync is set:
+    # the client must be sent a full snapshot
+    def __init__(self, max_pending=HYSEN_STREAM_MAX_PENDING):
+        self.max_pending = max_pending
+        self.pending = collections.OrderedDict()
+        self.resync = False
+        self.closed = False
+        self.coalesced = 0
+        self.resyncs = 0
+        self._condition = threading.Condition()
+
+    # Called from the fleet poller, never blocks on the client
+    def push(self, device_id, changes, version):
+        with self._condition:
+            if self.closed or self.resync:
+                return
+            pending = self.pending.get(device_id)
+            if pending is not None:
+                pending[0] = version
+                pending[1].update(changes)
+                self.coalesced += 1
+            elif len(self.pending) >= self.max_pending:
+                self.pending.clear()
+                self.resync = True
+                self.resyncs += 1
+            else:
+                self.pending[device_id] = [version, dict(changes)]
+            self._condition.notify()
+
+    # Wait up to timeout seconds for changes
+    # Returns (resync, [(device_id, version, changes), ...]), (False, []) on timeout or once closed
+    def get(self, timeout=None):
+        with self._condition:
+            self._condition.wait_for(lambda: self.pending or self.resync or self.closed, timeout)
+            resync = self.resync
+            changes = [(device_id, version, changes) for device_id, (version, changes) in self.pending.items()]
+            self.pending.clear()
+            self.resync = False
+            return resync, changes
+
+    def close(self):
+        with self._condition:
+            self.closed = True
+            self._condition.notify_all()
+
+class HysenChangeStream:
+    # Fans the change callbacks of a fleet out to the subscribed clients
+    def __init__(self, fleet, max_pending=HYSEN_STREAM_MAX_PENDING, keepalive=HYSEN_STREAM_KEEPALIVE):
+        self.fleet = fleet
+        self.max_pending = max_pending
+        self.keepalive = keepalive
+        self.clients = set()
+        self._lock = threading.Lock()
+        fleet.add_change_callback(self.publish)
+
+    def subscribe(self):
+        client = HysenStreamClient(self.max_pending)
+        with self._lock:
+            self.clients.add(client)
+        return client
+
+    def unsubscribe(self, client):
+        client.close()
+        with self._lock:
+            self.clients.discard(client)
+
+    # Fleet change callback, costs one merge per client
+    def publish(self, device_id, changes):
+        state = self.fleet.states.get(device_id)
+        version = state.version if state is not None else self.fleet.version
+        with self._lock:
+            clients = list(self.clients)
+        for client in clients:
+            client.push(device_id, changes, version)
+
+    # Close every client and stop listening to the fleet
+    def close(self):
+        try:
+            self.fleet.remove_change_callback(self.publish)
+        except ValueError:
+            pass
+        with self._lock:
+            clients = list(self.clients)
+            self.clients.clear()
+        for client in clients:
+            client.close()
+
+    # Events of a client as bytes, until it is closed: a "snapshot" event ({device_id: status}) first
+    # and after every resync, then one "change" event ({"device_id", "version", "changes"}) per device
+    # with pending changes, and a keepalive comment after keepalive seconds without any event
+    def events(self, client):
+        resync = True
+        while not client.closed:
+            if resync:
+                version, states = self.fleet.snapshot()
+                yield sse_event(
+                    'snapshot',
+                    json.dumps({state.device_id: state.status for state in states}, sort_keys=True),
+                    version)
+            resync, changes = client.get(self.keepalive)
+            if resync:
+                continue
+            if not changes and not client.closed:
+                yield b': keepalive\n\n'
+            for device_id, version, device_changes in changes:
+                yield sse_event(
+                    'change',
+                    json.dumps({'device_id': device_id, 'version': version, 'changes': device_changes}, sort_keys=True),
+                    version)
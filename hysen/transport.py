@@ -0,0 +1,164 @@
+"""
+Hysen thermostats transports
+The send/receive step of a broadlink packet, used by HysenDevice
+"""
+
+import random
+import socket
+import time
+
+from broadlink.const import DEFAULT_RETRY_INTVL
+from broadlink.exceptions import NetworkTimeoutError
+
+def _timeout_error(timeout):
+    return NetworkTimeoutError(
+        -4000,
+        'Network timeout',
+        'No response received within %ss' % timeout)
+
+class HysenTransport:
+    # Send a packet to host (ip, port) and return the response packet
+    # Raises NetworkTimeoutError if no response is received within timeout seconds
+    def exchange(self, packet, host, timeout):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+class UdpTransport(HysenTransport):
+    # broadlink's UDP exchange: a socket per packet, resent every retry_interval until timeout
+    def __init__(self, retry_interval=DEFAULT_RETRY_INTVL):
+        self.retry_interval = retry_interval
+
+    def exchange(self, packet, host, timeout):
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as conn:
+            start_time = time.time()
+            while True:
+                time_left = timeout - (time.time() - start_time)
+                conn.settimeout(max(min(self.retry_interval, time_left), 0.001))
+                conn.sendto(packet, host)
+                try:
+                    return conn.recvfrom(2048)[0]
+                except socket.timeout as err:
+                    if (time.time() - start_time) > timeout:
+                        raise _timeout_error(timeout) from err
+
+class LoopbackTransport(HysenTransport):
+    # In-process transport, packets are handed to emulated devices without any socket
+    # devices are objects with a handle(packet) method returning the response or None,
+    # e.g. emulator.HysenEmulatedDevice
+    # A dropped packet raises NetworkTimeoutError at once instead of waiting for timeout
+    def __init__(self, devices=None):
+        self.devices = {}
+        self._next_port = 1
+        for device in devices or []:
+            self.add_device(device)
+
+    # Register a device under host, by default its own host or a new loopback address
+    # Returns the host the device answers on
+    def add_device(self, device, host=None):
+        if host is None:
+            host = getattr(device, 'host', None)
+        if host is None:
+            host = ('127.0.0.1', self._next_port)
+            self._next_port += 1
+            device.host = host
+        self.devices[tuple(host)] = device
+        return tuple(host)
+
+    def exchange(self, packet, host, timeout):
+        device = self.devices.get(tuple(host))
+        if device is None:
+            raise _timeout_error(timeout)
+        response = device.handle(bytes(packet))
+        if response is None:
+            raise _timeout_error(timeout)
+        return response
+
+class ImpairedTransport(HysenTransport):
+    # Wraps another transport and injects network impairments
+    # loss = probability of losing the request or the response of each attempt,
+    #        a lost attempt costs retry_interval and is resent until timeout, like broadlink does
+    # latency, jitter = round trip delay in seconds, latency + uniform(0, jitter)
+    # reorder = probability that a response arrives late: the attempt is lost for its exchange (the request is resent
+    #           or the exchange times out), then the late response is delivered to the next exchange with the same host,
+    #           whose own response is dropped, so that exchange returns a stale response
+    # corruption = probability of corrupting a byte of the encrypted payload of a response,
+    #              the packet checksum is kept valid so the corruption reaches the Hysen CRC check
+    # seed makes the impairments deterministic
+    # sleep is called with every delay, with sleep=None delays are only added up in elapsed
+    def __init__(
+        self,
+        transport,
+        loss=0.0,
+        latency=0.0,
+        jitter=0.0,
+        reorder=0.0,
+        corruption=0.0,
+        retry_interval=DEFAULT_RETRY_INTVL,
+        seed=None,
+        sleep=time.sleep):
+        self.transport = transport
+        self.loss = loss
+        self.latency = latency
+        self.jitter = jitter
+        self.reorder = reorder
+        self.corruption = corruption
+        self.retry_interval = retry_interval
+        self.sleep = sleep
+        self.elapsed = 0.0
+        self.exchanges = 0
+        self.lost = 0
+        self.reordered = 0
+        self.corrupted = 0
+        self._random = random.Random(seed)
+        # host -> (number of the exchange it was held back from, late response)
+        self._held = {}
+
+    def _delay(self, seconds):
+        self.elapsed += seconds
+        if self.sleep is not None and seconds > 0:
+            self.sleep(seconds)
+
+    def exchange(self, packet, host, timeout):
+        self.exchanges += 1
+        host = tuple(host)
+        waited = 0.0
+        while True:
+            if self._random.random() < self.loss:
+                # request lost
+                self.lost += 1
+            else:
+                response = self.transport.exchange(packet, host, timeout - waited)
+                if self._random.random() < self.loss:
+                    # response lost
+                    self.lost += 1
+                else:
+                    held = self._held.get(host)
+                    if held is not None and held[0] != self.exchanges:
+                        # a response held back by a previous exchange arrives first
+                        del self._held[host]
+                        response = held[1]
+                        break
+                    if self._random.random() >= self.reorder:
+                        break
+                    self.reordered += 1
+                    self._held[host] = (self.exchanges, response)
+            if (self.retry_interval <= 0) or (waited + self.retry_interval > timeout):
+                self._delay(timeout - waited)
+                raise _timeout_error(timeout)
+            waited += self.retry_interval
+            self._delay(self.retry_interval)
+        self._delay(self.latency + self._random.uniform(0, self.jitter))
+        if len(response) > 0x38 and self._random.random() < self.corruption:
+            self.corrupted += 1
+            response = bytearray(response)
+            position = self._random.randrange(0x38, len(response))
+            response[position] ^= 1 << self._random.randrange(8)
+            checksum = (sum(response, 0xBEAF) - sum(response[0x20:0x22])) & 0xFFFF
+            response[0x20:0x22] = checksum.to_bytes(2, 'little')
+            response = bytes(response)
+        return response
+
+    def close(self):
+        self.transport.close()
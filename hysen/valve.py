@@ -0,0 +1,171 @@
+"""
+Hysen thermostats valve analytics
+Valve runtime and duty cycle of each device over any time window,
+from the time_valve_on counter of 2 pipe fan coil devices or the valve_state of heating devices
+"""
+
+import array
+import threading
+import time
+
+HYSEN_VALVE_DEFAULT_CAPACITY    = 10080
+
+# Heating devices: a gap between samples longer than this (seconds) is not counted,
+# the valve state is unknown during the gap
+HYSEN_VALVE_MAX_GAP             = 900
+
+HYSEN_VALVE_COUNTER_RANGE       = 1 << 32
+
+class HysenDeviceValve:
+    # Cumulative valve runtime and observed time of a device, checkpointed at every sample
+    # in a ring of the last capacity samples, so a window costs two binary searches
+    # counter = True: runtime from the time_valve_on counter (seconds), with wraparound and reset handling
+    # counter = False: runtime integrated from valve_state, the state of a sample is held until the next one
+    def __init__(self, counter, capacity=HYSEN_VALVE_DEFAULT_CAPACITY, max_gap=HYSEN_VALVE_MAX_GAP):
+        self.counter = counter
+        self.capacity = capacity
+        self.max_gap = max_gap
+        self.runtime = 0.0
+        self.observed = 0.0
+        self.resets = 0
+        self.wraps = 0
+        self.count = 0
+        self._next = 0
+        self._timestamps = array.array('d', bytes(8 * capacity))
+        self._runtimes = array.array('d', bytes(8 * capacity))
+        self._observed = array.array('d', bytes(8 * capacity))
+        self._last_timestamp = None
+        self._last_value = None
+
+    # Add a status (a status_snapshot dict) read at timestamp, in O(1)
+    # Returns False if the sample is older than the previous one and was dropped
+    def add(self, timestamp, status):
+        value = status['time_valve_on'] if self.counter else status['valve_state']
+        if self._last_timestamp is not None:
+            elapsed = timestamp - self._last_timestamp
+            if elapsed < 0:
+                return False
+            if self.counter:
+                delta = value - self._last_value
+                if delta < 0:
+                    if self._last_value >= HYSEN_VALVE_COUNTER_RANGE // 2 and \
+                       value < HYSEN_VALVE_COUNTER_RANGE // 2:
+                        delta += HYSEN_VALVE_COUNTER_RANGE
+                        self.wraps += 1
+                    else:
+                        # counter reset (e.g. power cycle), the valve ran value seconds since
+                        delta = value
+                        self.resets += 1
+                # the valve can't have run longer than the time between the samples
+                self.runtime += min(delta, elapsed)
+                self.observed += elapsed
+            elif (self.max_gap is None) or (elapsed <= self.max_gap):
+                if self._last_value:
+                    self.runtime += elapsed
+                self.observed += elapsed
+        self._last_timestamp = timestamp
+        self._last_value = value
+        position = self._next
+        self._timestamps[position] = timestamp
+        self._runtimes[position] = self.runtime
+        self._observed[position] = self.observed
+        self._next = (position + 1) % self.capacity
+        if self.count < self.capacity:
+            self.count += 1
+        return True
+
+    def _position(self, index):
+        return (self._next - self.count + index) % self.capacity
+
+    # Cumulative (runtime, observed) at timestamp, interpolated between the checkpoints around it
+    # and clamped to the oldest and newest kept checkpoints
+    def _cumulative(self, timestamp):
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self._timestamps[self._position(middle)] <= timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        if low == 0:
+            position = self._position(0)
+            return self._runtimes[position], self._observed[position]
+        before = self._position(low - 1)
+        if low == self.count:
+            return self._runtimes[before], self._observed[before]
+        after = self._position(low)
+        span = self._timestamps[after] - self._timestamps[before]
+        fraction = (timestamp - self._timestamps[before]) / span if span else 0.0
+        return (
+            self._runtimes[before] + fraction * (self._runtimes[after] - self._runtimes[before]),
+            self._observed[before] + fraction * (self._observed[after] - self._observed[before]))
+
+    # Valve runtime over [start, end), None = since the oldest kept sample / until the last sample
+    # Returns {'runtime': seconds, 'observed': seconds, 'duty_cycle': runtime / observed or None}
+    def window(self, start=None, end=None):
+        if not self.count:
+            return {'runtime': 0.0, 'observed': 0.0, 'duty_cycle': None}
+        if start is None:
+            start = self._timestamps[self._position(0)]
+        if end is None:
+            end = self._timestamps[self._position(self.count - 1)]
+        start_runtime, start_observed = self._cumulative(start)
+        end_runtime, end_observed = self._cumulative(end)
+        runtime = end_runtime - start_runtime
+        observed = end_observed - start_observed
+        return {
+            'runtime': runtime,
+            'observed': observed,
+            'duty_cycle': runtime / observed if observed > 0 else None,
+        }
+
+class HysenValveAnalytics:
+    # Valve analytics of many devices, created on their first sample
+    # Devices with a time_valve_on field (2 pipe fan coil) use the counter, the others valve_state
+    def __init__(self, capacity=HYSEN_VALVE_DEFAULT_CAPACITY, max_gap=HYSEN_VALVE_MAX_GAP):
+        self.capacity = capacity
+        self.max_gap = max_gap
+        self.devices = {}
+        self._lock = threading.Lock()
+
+    def record(self, device_id, status, timestamp=None):
+        if timestamp is None:
+            timestamp = time.time()
+        with self._lock:
+            valve = self.devices.get(device_id)
+            if valve is None:
+                valve = self.devices[device_id] = HysenDeviceValve(
+                    'time_valve_on' in status, self.capacity, self.max_gap)
+            return valve.add(timestamp, status)
+
+    # Sample every fleet poll (see HysenFleet.add_status_callback)
+    def attach_fleet(self, fleet):
+        def record_state(device_id, changes):
+            state = fleet.states.get(device_id)
+            if state is not None:
+                self.record(device_id, state.status, state.updated)
+        fleet.add_status_callback(record_state)
+
+    # Sample every status read by device.get_device_status
+    def attach_device(self, device):
+        device.add_status_callback(
+            lambda device, changes: self.record(device.unique_id, device.status_snapshot()))
+
+    # Valve runtime of a device over [start, end), see HysenDeviceValve.window
+    def window(self, device_id, start=None, end=None):
+        with self._lock:
+            valve = self.devices.get(device_id)
+            if valve is None:
+                raise ValueError('Can\'t compute valve runtime (unknown device %s)' % (
+                    device_id))
+            return valve.window(start, end)
+
+    # Valve runtime of every device over [start, end)
+    # Returns ({device_id: window}, total runtime, total observed time)
+    def report(self, start=None, end=None):
+        with self._lock:
+            windows = {device_id: valve.window(start, end) for device_id, valve in self.devices.items()}
+        return (
+            windows,
+            sum(window['runtime'] for window in windows.values()),
+            sum(window['observed'] for window in windows.values()))
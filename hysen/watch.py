@@ -0,0 +1,58 @@
+"""
+Hysen thermostats watch
+Iterate, synchronously or with async for, over the status of a device or a fleet as it is polled
+"""
+
+import asyncio
+import threading
+import time
+
+HYSEN_WATCH_DEFAULT_INTERVAL    = 60
+
+class HysenWatch:
+    # Iterable and async iterable calling poll every interval seconds and yielding its results
+    # poll returns the item to yield, or None when there is nothing to yield for this poll
+    # on_start and on_end are called when an iteration starts and ends (e.g. to register a callback)
+    # poll runs in the iterating thread, or in the default executor of the event loop for async for
+    # Errors raised by poll end the iteration in the consumer
+    # on_end runs when the iterator is closed, for an async for left early that is when the event loop
+    # finalizes it, wrap it in contextlib.aclosing to end it at once
+    def __init__(self, poll, interval=HYSEN_WATCH_DEFAULT_INTERVAL, on_start=None, on_end=None):
+        self.poll = poll
+        self.interval = interval
+        self.on_start = on_start
+        self.on_end = on_end
+        self._stop = threading.Event()
+
+    # End every iteration of the watch, at once for a waiting iterator, after the current wait with async for
+    def stop(self):
+        self._stop.set()
+
+    def __iter__(self):
+        if self.on_start is not None:
+            self.on_start()
+        try:
+            while not self._stop.is_set():
+                start = time.monotonic()
+                item = self.poll()
+                if item is not None:
+                    yield item
+                self._stop.wait(max(0.0, self.interval - (time.monotonic() - start)))
+        finally:
+            if self.on_end is not None:
+                self.on_end()
+
+    async def __aiter__(self):
+        loop = asyncio.get_running_loop()
+        if self.on_start is not None:
+            self.on_start()
+        try:
+            while not self._stop.is_set():
+                start = time.monotonic()
+                item = await loop.run_in_executor(None, self.poll)
+                if item is not None:
+                    yield item
+                await asyncio.sleep(max(0.0, self.interval - (time.monotonic() - start)))
+        finally:
+            if self.on_end is not None:
+                self.on_end()
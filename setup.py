@@ -17,7 +17,8 @@ setup(
     url='http://github.com/uspass/hysen',
     packages=find_packages(),
     scripts=[],
-    install_requires=['broadlink==0.18.0'],
+    install_requires=['broadlink==0.18.0', 'cryptography'],
+    extras_require={'numpy': ['numpy']},
 
     classifiers=[
         'Programming Language :: Python :: 3',
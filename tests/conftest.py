@@ -0,0 +1,35 @@
+import pytest
+
+from hysen.discovery import HYSEN_DEVICE_CLASSES
+from hysen.emulator import HysenEmulatedDevice, HysenEmulator
+from hysen.hysenheating import HYSENHEAT_DEV_TYPE
+from hysen.hysen2pfc import HYSEN2PFC_DEV_TYPE
+from hysen.transport import LoopbackTransport
+
+# A device of type devtype talking to a new emulated thermostat through a loopback transport
+# Returns (device, emulated device), the device is authenticated and its status read
+def emulated_device(devtype, transport=None, timeout=1):
+    emulated = HysenEmulatedDevice(devtype)
+    if transport is None:
+        transport = LoopbackTransport()
+    transport.add_device(emulated)
+    device = HYSEN_DEVICE_CLASSES[devtype](emulated.host, emulated.mac, timeout, False, 0)
+    device.transport = transport
+    device.resolve_after_timeouts = 0
+    device.get_device_status()
+    return device, emulated
+
+@pytest.fixture
+def heating():
+    return emulated_device(HYSENHEAT_DEV_TYPE)
+
+@pytest.fixture
+def fancoil():
+    return emulated_device(HYSEN2PFC_DEV_TYPE)
+
+# UDP emulator on 127.0.0.1, stopped after the test
+@pytest.fixture
+def emulator():
+    emulator = HysenEmulator()
+    yield emulator
+    emulator.stop()
@@ -0,0 +1,89 @@
+import os
+import threading
+
+import pytest
+from broadlink.device import Device as broadlink_device
+
+from hysen.hysenheating import HysenHeatingDevice
+
+def _device():
+    return HysenHeatingDevice(('127.0.0.1', 80), bytes(6), 1, False, 0)
+
+# broadlink's encrypt / decrypt, a new CBC context for every call
+def _broadlink(device):
+    reference = broadlink_device(('127.0.0.1', 80), bytes(6), 0)
+    reference.update_aes(device._aes_key)
+    return reference
+
+def _broadlink_encrypt(device, payload):
+    return broadlink_device.encrypt(_broadlink(device), payload)
+
+def _broadlink_decrypt(device, payload):
+    return broadlink_device.decrypt(_broadlink(device), payload)
+
+def test_encrypt_decrypt_match_broadlink():
+    device = _device()
+    for key in (None, os.urandom(16)):
+        if key is not None:
+            device.update_aes(key)
+        for blocks in range(8):
+            payload = os.urandom(16 * blocks)
+            encrypted = device.encrypt(payload)
+            assert encrypted == _broadlink_encrypt(device, payload)
+            assert device.decrypt(encrypted) == _broadlink_decrypt(device, encrypted) == payload
+
+def test_decrypt_into_buffer():
+    device = _device()
+    payload = os.urandom(64)
+    encrypted = device.encrypt(payload)
+    buffer = bytearray(len(encrypted) + 16)
+    decrypted = device._decrypt_into(memoryview(encrypted), buffer)
+    assert isinstance(decrypted, memoryview)
+    assert bytes(decrypted) == payload
+
+def test_contexts_chained_back_to_iv():
+    device = _device()
+    payloads = [os.urandom(16 * blocks) for blocks in (1, 4, 2, 8, 3)]
+    # interleaved, every payload is encrypted and decrypted from the IV whatever came before
+    for payload in payloads * 3:
+        encrypted = device.encrypt(payload)
+        assert encrypted == _broadlink_encrypt(device, payload)
+        assert device.decrypt(_broadlink_encrypt(device, payload)) == payload
+
+def test_concurrent_encrypt_decrypt():
+    device = _device()
+    payload = os.urandom(64)
+    encrypted = _broadlink_encrypt(device, payload)
+    errors = []
+    def run():
+        for _ in range(500):
+            if device.encrypt(payload) != encrypted or device.decrypt(encrypted) != payload:
+                errors.append(threading.current_thread())
+    threads = [threading.Thread(target=run) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+
+def test_new_session_key_invalidates_contexts():
+    device = _device()
+    payload = os.urandom(32)
+    initial = device.encrypt(payload)
+    device.update_aes(os.urandom(16))
+    assert device.encrypt(payload) != initial
+    assert device.encrypt(payload) == _broadlink_encrypt(device, payload)
+
+def test_partial_block_rejected():
+    device = _device()
+    with pytest.raises(ValueError):
+        device.encrypt(bytes(15))
+    with pytest.raises(ValueError):
+        device.decrypt(bytes(17))
+
+def test_session_with_emulated_device(heating):
+    device, emulated = heating
+    assert device._aes_key == emulated._session_key
+    device.get_device_status()
+    device.auth()
+    device.get_device_status()
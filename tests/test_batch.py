@@ -0,0 +1,65 @@
+import os
+
+import pytest
+
+numpy = pytest.importorskip('numpy')
+
+from hysen.batch import as_structured, decode_batch, snapshot_log_records
+from hysen.hysenheating import HysenHeatingDevice, HYSENHEAT_DEV_TYPE
+from hysen.hysen2pfc import Hysen2PipeFanCoilDevice, HYSEN2PFC_DEV_TYPE
+from hysen.snapshotlog import HysenSnapshotLog
+
+MODELS = (
+    (HYSENHEAT_DEV_TYPE, HysenHeatingDevice, 49),
+    (HYSEN2PFC_DEV_TYPE, Hysen2PipeFanCoilDevice, 35),
+)
+
+# Decode payloads one by one with the device class, as {field: [value, ...]}
+def _decode_each(device_class, payloads):
+    decoder = device_class(('0.0.0.0', 0), bytes(6), 0, False, 0)
+    decoded = {}
+    for payload in payloads:
+        decoder._decode_status(payload)
+        for field, value in decoder.status_snapshot().items():
+            decoded.setdefault(field, []).append(value)
+    del decoded['fwversion']
+    return decoded
+
+@pytest.mark.parametrize('devtype, device_class, length', MODELS)
+def test_batch_matches_device_decoding(devtype, device_class, length):
+    payloads = [os.urandom(length) for _ in range(500)]
+    expected = _decode_each(device_class, payloads)
+    columns = decode_batch(devtype, payloads)
+    assert set(columns) == set(expected)
+    for field, values in expected.items():
+        assert columns[field].tolist() == pytest.approx(values), field
+
+def test_array_input():
+    payloads = numpy.frombuffer(os.urandom(35 * 10), dtype=numpy.uint8).reshape(10, 35)
+    columns = decode_batch(HYSEN2PFC_DEV_TYPE, payloads)
+    assert columns['room_temp'].tolist() == payloads[:, 7].tolist()
+    assert len(decode_batch(HYSEN2PFC_DEV_TYPE, [])['room_temp']) == 0
+
+def test_errors():
+    with pytest.raises(ValueError):
+        decode_batch(0x2712, [])
+    with pytest.raises(ValueError):
+        decode_batch(HYSENHEAT_DEV_TYPE, numpy.zeros((2, 35), dtype=numpy.uint8))
+
+def test_as_structured():
+    columns = decode_batch(HYSENHEAT_DEV_TYPE, [os.urandom(49) for _ in range(3)])
+    records = as_structured(columns)
+    assert len(records) == 3
+    assert records['target_temp'].tolist() == columns['target_temp'].tolist()
+
+def test_snapshot_log_records(tmp_path, heating, fancoil):
+    with HysenSnapshotLog(str(tmp_path / 'snapshots.log'), growth=2) as log:
+        for timestamp in range(5):
+            device = heating[0] if timestamp % 2 else fancoil[0]
+            log.append(device, float(timestamp))
+        records = snapshot_log_records(log)
+    assert records['timestamp'].tolist() == [0.0, 1.0, 2.0, 3.0, 4.0]
+    heating_records = records[records['devtype'] == HYSENHEAT_DEV_TYPE]
+    assert bytes(heating_records['mac'][0]) == heating[0].mac
+    columns = decode_batch(HYSENHEAT_DEV_TYPE, heating_records['payload'])
+    assert columns['target_temp'].tolist() == [heating[0].target_temp] * 2
@@ -0,0 +1,38 @@
+import importlib.util
+import json
+import os
+
+BENCH_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks', 'bench_hysen.py')
+
+def _bench():
+    spec = importlib.util.spec_from_file_location('bench_hysen', BENCH_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def test_measure():
+    calls = []
+    result = _bench().measure(lambda: calls.append(None), 0.01)
+    assert result['iterations'] == len(calls) - 1
+    assert result['ops_per_sec'] > 0
+
+def test_round_trips():
+    round_trips = _bench().bench_round_trips()
+    assert round_trips['heating.get_device_status'] == 2
+    assert round_trips['2pfc.get_device_status'] == 2
+    assert round_trips['heating.set_target_temp'] == 3
+
+def test_main_writes_json(tmp_path):
+    output = tmp_path / 'results.json'
+    _bench().main([
+        '--duration', '0.001',
+        '--devices', '2',
+        '--workers', '2',
+        '--fleet-duration', '0.2',
+        '--output', str(output)])
+    results = json.loads(output.read_text())
+    assert set(results) >= {'codec', 'status', 'round_trips', 'fleet'}
+    assert results['fleet']['devices'] == 2
+    assert results['fleet']['requests'] > 0
+    assert results['fleet']['errors'] == 0
+    assert results['codec']['crc16_6_bytes']['iterations'] > 0
@@ -0,0 +1,71 @@
+import pytest
+
+from hysen.capture import HysenCaptureRecorder, HysenCaptureReplayer, read_capture, HYSEN_CAPTURE_RECORD
+from hysen.hysenheating import HYSENHEAT_STATUS_REQUEST
+
+def _capture(path, device, reads=3):
+    with HysenCaptureRecorder(str(path)) as recorder:
+        recorder.attach(device)
+        for _ in range(reads):
+            device.get_device_status()
+        device.set_target_temp(21)
+        recorder.detach(device)
+        device.get_device_status()
+    return recorder
+
+def test_record_and_read(tmp_path, heating):
+    device, emulated = heating
+    path = tmp_path / 'traffic.cap'
+    recorder = _capture(path, device)
+    records = list(read_capture(str(path)))
+    assert len(records) == recorder.records == 3 + 2
+    assert all(record.devtype == device.devtype and record.mac == bytes(device.mac) for record in records)
+    assert records[0].request == HYSENHEAT_STATUS_REQUEST
+    assert [record.timestamp for record in records] == sorted(record.timestamp for record in records)
+
+def test_replay_decodes_like_device(tmp_path, fancoil):
+    device, emulated = fancoil
+    path = tmp_path / 'traffic.cap'
+    with HysenCaptureRecorder(str(path)) as recorder:
+        recorder.attach(device)
+        device.get_device_status()
+    replayer = HysenCaptureReplayer()
+    results = list(replayer.replay(str(path)))
+    assert [error for record, replayed, error in results] == [None]
+    replayed = replayer.devices[device.unique_id].status_snapshot()
+    status = device.status_snapshot()
+    # the firmware version is not read by the status request
+    del replayed['fwversion'], status['fwversion']
+    assert replayed == status
+    assert replayer.statuses == 1
+
+def test_truncated_record_ignored(tmp_path, heating):
+    device, emulated = heating
+    path = tmp_path / 'traffic.cap'
+    _capture(path, device, reads=1)
+    data = path.read_bytes()
+    path.write_bytes(data[:-1])
+    assert len(list(read_capture(str(path)))) == 2
+
+def test_not_a_capture(tmp_path):
+    path = tmp_path / 'other.cap'
+    path.write_bytes(b'not a capture')
+    with pytest.raises(ValueError):
+        list(read_capture(str(path)))
+
+def test_corrupted_response_reported(tmp_path, heating):
+    device, emulated = heating
+    path = tmp_path / 'traffic.cap'
+    with HysenCaptureRecorder(str(path)) as recorder:
+        recorder.attach(device)
+        device.get_device_status()
+        device.get_device_status()
+    data = bytearray(path.read_bytes())
+    data[8 + HYSEN_CAPTURE_RECORD.size + len(HYSENHEAT_STATUS_REQUEST) + 10] ^= 0xFF
+    path.write_bytes(bytes(data))
+    replayer = HysenCaptureReplayer()
+    results = list(replayer.replay(str(path)))
+    assert isinstance(results[0][2], ValueError)
+    assert results[1][2] is None
+    assert replayer.errors == 1
+    assert replayer.statuses == 1
@@ -0,0 +1,60 @@
+from hysen.hysendevice import status_delta, HYSEN_STATUS_CLOCK_FIELDS
+
+def test_status_delta():
+    previous = {'room_temp': 20.0, 'target_temp': 22.0, 'clock_minute': 1}
+    assert status_delta(None, previous) == previous
+    assert status_delta(previous, dict(previous)) == {}
+    assert status_delta(previous, dict(previous, target_temp=21.5)) == {'target_temp': 21.5}
+    assert status_delta(previous, dict(previous, fwversion=53)) == {'fwversion': 53}
+
+def test_status_delta_ignores_clock():
+    previous = {field: 0 for field in HYSEN_STATUS_CLOCK_FIELDS}
+    previous['room_temp'] = 20.0
+    status = {field: 1 for field in HYSEN_STATUS_CLOCK_FIELDS}
+    status['room_temp'] = 20.0
+    assert status_delta(previous, status) == {}
+    assert status_delta(previous, status, ignored=()) == {field: 1 for field in HYSEN_STATUS_CLOCK_FIELDS}
+
+def test_change_callbacks(heating):
+    device, emulated = heating
+    calls = []
+    device.add_change_callback(lambda changed, changes: calls.append((changed, changes)))
+    device.get_device_status()
+    assert calls == [(device, device.status_snapshot())]
+    device.get_device_status()
+    assert len(calls) == 1
+    device.set_target_temp(25)
+    device.get_device_status()
+    assert calls[-1] == (device, {'target_temp': 25.0})
+
+def test_clock_is_not_a_change(heating):
+    device, emulated = heating
+    changes = []
+    statuses = []
+    device.add_change_callback(lambda changed, device_changes: changes.append(device_changes))
+    device.add_status_callback(lambda changed, device_changes: statuses.append(device_changes))
+    device.get_device_status()
+    clock_hour = (device.clock_hour + 1) % 24
+    device.set_time(clock_hour, 0, 0, device.clock_weekday)
+    device.get_device_status()
+    assert device.clock_hour == clock_hour
+    assert len(changes) == 1
+    assert statuses[1:] == [{}]
+
+def test_remove_change_callback(fancoil):
+    device, emulated = fancoil
+    calls = []
+    callback = lambda changed, changes: calls.append(changes)
+    device.add_change_callback(callback)
+    device.get_device_status()
+    device.remove_change_callback(callback)
+    device.set_target_temp(20)
+    assert len(calls) == 1
+
+def test_status_changes(fancoil):
+    device, emulated = fancoil
+    assert device.status_changes() == device.status_snapshot()
+    assert device.status_changes() == {}
+    device.set_target_temp(20)
+    device.get_device_status()
+    assert device.status_changes() == {'target_temp': 20}
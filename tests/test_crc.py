@@ -0,0 +1,73 @@
+import os
+
+import pytest
+
+from hysen.hysendevice import crc16, precompute_request, _frame_request, _precomputed_frames
+from hysen.hysenheating import HysenHeatingDevice, HYSENHEAT_STATUS_REQUEST
+from hysen.hysen2pfc import Hysen2PipeFanCoilDevice, HYSEN2PFC_STATUS_REQUEST
+
+# Bit by bit CRC-16/MODBUS, the reference for the table driven crc16
+def _crc16_bitwise(data):
+    crc = 0xFFFF
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            if crc & 1:
+                crc = (crc >> 1) ^ 0xA001
+            else:
+                crc >>= 1
+    return crc
+
+class _Sent(Exception):
+    pass
+
+# Record the request frames passed to send_packet by device, no packet is sent
+def _record_frames(device):
+    frames = []
+    def send_packet(packet_type, payload):
+        frames.append(bytes(payload))
+        raise _Sent()
+    device.send_packet = send_packet
+    return frames
+
+def test_crc16_check_value():
+    assert crc16(b'123456789') == 0x4B37
+    assert crc16(b'') == 0xFFFF
+
+def test_crc16_matches_bitwise():
+    for length in range(64):
+        data = os.urandom(length)
+        assert crc16(data) == _crc16_bitwise(data)
+        assert crc16(bytearray(data)) == crc16(memoryview(data)) == crc16(list(data))
+
+def test_frame_request():
+    payload = bytes([0x01, 0x06, 0x00, 0x01, 0x00, 0x2C])
+    frame = _frame_request(payload)
+    crc = _crc16_bitwise(payload)
+    assert frame == bytes([len(payload) + 2, 0x00]) + payload + bytes([crc & 0xFF, crc >> 8])
+
+def test_precomputed_status_requests():
+    for request in (HYSENHEAT_STATUS_REQUEST, HYSEN2PFC_STATUS_REQUEST):
+        assert type(request) is bytes
+        assert _precomputed_frames[request] == _frame_request(request)
+
+def test_precompute_request():
+    request = precompute_request([0x01, 0x03, 0x00, 0x02, 0x00, 0x01])
+    assert request == bytes([0x01, 0x03, 0x00, 0x02, 0x00, 0x01])
+    assert _precomputed_frames[request] == _frame_request(request)
+
+def test_precomputed_frame_sent_like_plain_frame():
+    device = HysenHeatingDevice(('127.0.0.1', 80), bytes(6), 1, False, 0)
+    frames = _record_frames(device)
+    for request in (HYSENHEAT_STATUS_REQUEST, bytearray(HYSENHEAT_STATUS_REQUEST)):
+        with pytest.raises(_Sent):
+            device._send_request(request)
+    assert frames == [_frame_request(HYSENHEAT_STATUS_REQUEST)] * 2
+
+def test_status_read_uses_precomputed_frame():
+    device = Hysen2PipeFanCoilDevice(('127.0.0.1', 80), bytes(6), 1, False, 0)
+    device._authenticated = True
+    frames = _record_frames(device)
+    with pytest.raises(_Sent):
+        device.get_device_status()
+    assert frames == [_precomputed_frames[HYSEN2PFC_STATUS_REQUEST]]
@@ -0,0 +1,133 @@
+import os
+import random
+
+import pytest
+
+from hysen.delta import HysenDeltaReader, HysenDeltaWriter, HYSEN_DELTA_INDEX_SUFFIX
+from hysen.hysenheating import HYSENHEAT_DEV_TYPE
+from hysen.hysen2pfc import HYSEN2PFC_DEV_TYPE
+
+MACS = (bytes.fromhex('024859000101'), bytes.fromhex('024859000102'))
+
+# Payloads of two devices changing a few bytes at a time, as [(devtype, mac, timestamp, payload)]
+def _payloads(count, seed=1):
+    generator = random.Random(seed)
+    payloads = {MACS[0]: bytearray(49), MACS[1]: bytearray(35)}
+    records = []
+    for index in range(count):
+        mac = MACS[index % 2]
+        payload = payloads[mac]
+        for _ in range(generator.randrange(4)):
+            payload[generator.randrange(len(payload))] = generator.randrange(256)
+        devtype = HYSENHEAT_DEV_TYPE if mac == MACS[0] else HYSEN2PFC_DEV_TYPE
+        records.append((devtype, mac, 1000.0 + index * 0.5, bytes(payload)))
+    return records
+
+def _write(path, records, keyframe_interval=8):
+    with HysenDeltaWriter(path, keyframe_interval) as writer:
+        for devtype, mac, timestamp, payload in records:
+            writer.append_payload(devtype, mac, payload, timestamp)
+    return writer
+
+def _expected(records, mac, start=None, end=None):
+    return [
+        (timestamp, payload) for devtype, record_mac, timestamp, payload in records
+        if record_mac == mac and (start is None or timestamp >= start) and (end is None or timestamp < end)]
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / 'history.delta')
+    records = _payloads(200)
+    writer = _write(path, records)
+    assert writer.records == 200
+    # first payload of each device, then every 8 payloads
+    assert writer.keyframes == 2 * 13
+    assert os.path.getsize(path) < sum(len(payload) for devtype, mac, timestamp, payload in records)
+    with HysenDeltaReader(path) as reader:
+        assert reader.devices() == {MACS[0].hex(): HYSENHEAT_DEV_TYPE, MACS[1].hex(): HYSEN2PFC_DEV_TYPE}
+        for mac in MACS:
+            assert list(reader.payloads(mac.hex())) == _expected(records, mac)
+        assert list(reader.payloads('unknown')) == []
+
+def test_range(tmp_path):
+    path = str(tmp_path / 'history.delta')
+    records = _payloads(200)
+    _write(path, records)
+    with HysenDeltaReader(path) as reader:
+        for start, end in ((1010.0, 1020.0), (1033.25, 1060.0), (None, 1001.0), (1090.0, None), (2000.0, None)):
+            assert list(reader.payloads(MACS[1].hex(), start, end)) == _expected(records, MACS[1], start, end)
+
+def test_decoded_range(tmp_path, heating):
+    device, emulated = heating
+    path = str(tmp_path / 'history.delta')
+    with HysenDeltaWriter(path) as writer:
+        writer.append(device, 1.0)
+        device.set_target_temp(25)
+        device.get_device_status()
+        writer.append(device, 2.0)
+    status = device.status_snapshot()
+    del status['fwversion']
+    with HysenDeltaReader(path) as reader:
+        statuses = list(reader.range(device.unique_id))
+    assert [timestamp for timestamp, decoded in statuses] == [1.0, 2.0]
+    assert statuses[0][1]['target_temp'] == 22.0
+    assert statuses[1][1] == status
+
+def test_sessions_and_index(tmp_path):
+    path = str(tmp_path / 'history.delta')
+    records = _payloads(100)
+    _write(path, records[:60])
+    _write(path, records[60:])
+    with HysenDeltaReader(path) as reader:
+        for mac in MACS:
+            assert list(reader.payloads(mac.hex())) == _expected(records, mac)
+    index_size = os.path.getsize(path + HYSEN_DELTA_INDEX_SUFFIX)
+    os.remove(path + HYSEN_DELTA_INDEX_SUFFIX)
+    with HysenDeltaReader(path) as reader:
+        assert list(reader.payloads(MACS[0].hex(), 1020.0)) == _expected(records, MACS[0], 1020.0)
+    assert os.path.getsize(path + HYSEN_DELTA_INDEX_SUFFIX) == index_size
+
+def test_index_of_another_file_rebuilt(tmp_path):
+    path = str(tmp_path / 'history.delta')
+    other = str(tmp_path / 'other.delta')
+    records = _payloads(100)
+    _write(path, records)
+    _write(other, _payloads(100, seed=2), keyframe_interval=3)
+    os.replace(other + HYSEN_DELTA_INDEX_SUFFIX, path + HYSEN_DELTA_INDEX_SUFFIX)
+    with HysenDeltaReader(path) as reader:
+        assert list(reader.payloads(MACS[1].hex())) == _expected(records, MACS[1])
+
+def test_writer_without_index(tmp_path):
+    path = str(tmp_path / 'history.delta')
+    records = _payloads(100)
+    _write(path, records[:50])
+    os.remove(path + HYSEN_DELTA_INDEX_SUFFIX)
+    _write(path, records[50:])
+    with HysenDeltaReader(path) as reader:
+        assert list(reader.payloads(MACS[0].hex(), 1010.0)) == _expected(records, MACS[0], 1010.0)
+
+def test_truncated_record_ignored(tmp_path):
+    path = str(tmp_path / 'history.delta')
+    records = _payloads(50)
+    _write(path, records)
+    with open(path, 'r+b') as f:
+        f.truncate(os.path.getsize(path) - 1)
+    with HysenDeltaReader(path) as reader:
+        assert list(reader.payloads(MACS[1].hex())) == _expected(records, MACS[1])[:-1]
+
+def test_payloads_kept_in_time_order(tmp_path):
+    path = str(tmp_path / 'history.delta')
+    with HysenDeltaWriter(path) as writer:
+        assert writer.append_payload(HYSENHEAT_DEV_TYPE, MACS[0], bytes(49), 10.0)
+        assert not writer.append_payload(HYSENHEAT_DEV_TYPE, MACS[0], bytes([1]) + bytes(48), 5.0)
+        # the order is kept per device
+        assert writer.append_payload(HYSENHEAT_DEV_TYPE, MACS[1], bytes(49), 5.0)
+        assert writer.append_payload(HYSENHEAT_DEV_TYPE, MACS[0], bytes([2]) + bytes(48), 10.0)
+        assert writer.records == 3
+    with HysenDeltaReader(path) as reader:
+        assert [(timestamp, payload[0]) for timestamp, payload in reader.payloads(MACS[0].hex())] == [(10.0, 0), (10.0, 2)]
+
+def test_not_a_delta_file(tmp_path):
+    path = tmp_path / 'other.delta'
+    path.write_bytes(b'not a delta file')
+    with pytest.raises(ValueError):
+        HysenDeltaReader(str(path))
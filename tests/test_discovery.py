@@ -0,0 +1,64 @@
+from hysen import discovery
+from hysen.discovery import discover, find_host
+from hysen.hysenheating import HysenHeatingDevice, HYSENHEAT_DEV_TYPE
+from hysen.hysen2pfc import Hysen2PipeFanCoilDevice, HYSEN2PFC_DEV_TYPE
+
+HEATING_MAC = bytes.fromhex('34ea34000001')
+FANCOIL_MAC = bytes.fromhex('34ea34000002')
+
+# Replace broadlink's scan: a probe to discover_ip_address answers with responses[discover_ip_address],
+# a list of (devtype, host, mac), a probe to any other address fails with OSError
+# Returns the list of (local_ip_address, discover_ip_address, discover_ip_port) of the probes
+def _fake_scan(monkeypatch, responses):
+    probes = []
+    def scan(timeout, local_ip_address, discover_ip_address, discover_ip_port):
+        probes.append((local_ip_address, discover_ip_address, discover_ip_port))
+        if discover_ip_address not in responses:
+            raise OSError('Network is unreachable')
+        for devtype, host, mac in responses[discover_ip_address]:
+            yield devtype, host, mac, 'Hysen', False
+    monkeypatch.setattr(discovery, 'scan', scan)
+    return probes
+
+def test_discover_yields_ready_devices(monkeypatch):
+    _fake_scan(monkeypatch, {'10.0.0.255': [
+        (HYSENHEAT_DEV_TYPE, ('10.0.0.2', 80), HEATING_MAC),
+        (HYSEN2PFC_DEV_TYPE, ('10.0.0.3', 80), FANCOIL_MAC)]})
+    heating, fancoil = discover(timeout=1, discover_ip_addresses=['10.0.0.255'], device_timeout=2)
+    assert isinstance(heating, HysenHeatingDevice)
+    assert (heating.host, heating.mac, heating.timeout) == (('10.0.0.2', 80), HEATING_MAC, 2)
+    assert isinstance(fancoil, Hysen2PipeFanCoilDevice)
+    assert (fancoil.host, fancoil.mac) == (('10.0.0.3', 80), FANCOIL_MAC)
+
+def test_discover_probes_every_address_pair(monkeypatch):
+    response = [(HYSENHEAT_DEV_TYPE, ('10.0.0.2', 80), HEATING_MAC)]
+    probes = _fake_scan(monkeypatch, {'10.0.0.255': response, '10.1.0.255': response})
+    devices = list(discover(
+        timeout=1,
+        local_ip_addresses=['10.0.0.1', '10.1.0.1'],
+        discover_ip_addresses=['10.0.0.255', '10.1.0.255'],
+        discover_ip_port=8080))
+    assert sorted(probes) == [
+        ('10.0.0.1', '10.0.0.255', 8080),
+        ('10.0.0.1', '10.1.0.255', 8080),
+        ('10.1.0.1', '10.0.0.255', 8080),
+        ('10.1.0.1', '10.1.0.255', 8080)]
+    # answered to the four probes, yielded once
+    assert [device.mac for device in devices] == [HEATING_MAC]
+
+def test_discover_drops_other_device_types(monkeypatch):
+    _fake_scan(monkeypatch, {'10.0.0.255': [(0x2712, ('10.0.0.2', 80), HEATING_MAC)]})
+    assert list(discover(timeout=1, discover_ip_addresses=['10.0.0.255'])) == []
+
+def test_discover_survives_failed_probes(monkeypatch):
+    _fake_scan(monkeypatch, {'10.0.0.255': [(HYSEN2PFC_DEV_TYPE, ('10.0.0.3', 80), FANCOIL_MAC)]})
+    devices = list(discover(timeout=1, discover_ip_addresses=['10.0.0.255', '10.2.0.255']))
+    assert [device.mac for device in devices] == [FANCOIL_MAC]
+
+def test_find_host(monkeypatch):
+    _fake_scan(monkeypatch, {'10.0.0.255': [
+        (HYSEN2PFC_DEV_TYPE, ('10.0.0.3', 80), FANCOIL_MAC),
+        (HYSENHEAT_DEV_TYPE, ('10.0.0.4', 80), HEATING_MAC)]})
+    assert find_host(HEATING_MAC, 1, None, ['10.0.0.255', '10.2.0.255']) == ('10.0.0.4', 80)
+    assert find_host(bytearray(HEATING_MAC), 1, None, ['10.0.0.255']) == ('10.0.0.4', 80)
+    assert find_host(bytes(6), 1, None, ['10.0.0.255']) is None
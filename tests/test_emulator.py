@@ -0,0 +1,117 @@
+import time
+
+import pytest
+
+from hysen.discovery import discover, find_host
+from hysen.emulator import (
+    HysenEmulatedDevice,
+    EMULATOR_ERROR_LENGTH,
+    EMULATOR_ERROR_UNKNOWN_COMMAND,
+    EMULATOR_ERROR_WRONG_LENGTH,
+)
+from hysen.hysenheating import HysenHeatingDevice, HYSENHEAT_DEV_TYPE, HYSENHEAT_POWER_OFF
+from hysen.hysen2pfc import HYSEN2PFC_DEV_TYPE, HYSEN2PFC_MODE_COOL, HYSEN2PFC_VALVE_ON
+
+def test_unsupported_device_type():
+    with pytest.raises(ValueError):
+        HysenEmulatedDevice(0x2712)
+
+def test_unique_macs():
+    assert HysenEmulatedDevice(HYSENHEAT_DEV_TYPE).mac != HysenEmulatedDevice(HYSENHEAT_DEV_TYPE).mac
+
+def test_execute_read():
+    emulated = HysenEmulatedDevice(HYSENHEAT_DEV_TYPE)
+    response = emulated.execute(bytes([0x01, 0x03, 0x00, 0x01, 0x00, 0x02]))
+    assert response == bytes([0x01, 0x03, 0x04]) + bytes(emulated.memory[2:6])
+
+def test_execute_write_keeps_device_bits():
+    emulated = HysenEmulatedDevice(HYSENHEAT_DEV_TYPE)
+    room_temp = emulated.memory[2]
+    assert emulated.execute(bytes([0x01, 0x06, 0x00, 0x01, 0xFF, 0x30])) == bytes([0x01, 0x06, 0x00, 0x01, 0xFF, 0x30])
+    assert emulated.memory[2] == room_temp
+    assert emulated.memory[3] == 0x30
+
+def test_execute_multi_write():
+    emulated = HysenEmulatedDevice(HYSENHEAT_DEV_TYPE)
+    command = bytes([0x01, 0x10, 0x00, 0x0A, 0x00, 0x02, 0x04, 7, 15, 8, 45])
+    assert emulated.execute(command) == command[0:6]
+    assert emulated.memory[20:24] == bytes([7, 15, 8, 45])
+
+def test_execute_errors():
+    emulated = HysenEmulatedDevice(HYSEN2PFC_DEV_TYPE)
+    assert emulated.execute(bytes([0x01, 0x42])) == bytes([0x01, 0xC2, EMULATOR_ERROR_UNKNOWN_COMMAND])
+    assert emulated.execute(bytes([0x02, 0x03])) == bytes([0x01, 0x80, EMULATOR_ERROR_UNKNOWN_COMMAND])
+    assert emulated.execute(bytes([0x01, 0x03, 0x00])) == bytes([0x01, 0x83, EMULATOR_ERROR_WRONG_LENGTH])
+    assert emulated.execute(bytes([0x01, 0x03, 0x00, 0x00, 0x00, 0x11])) == bytes([0x01, 0x83, EMULATOR_ERROR_LENGTH])
+    assert emulated.execute(bytes([0x01, 0x06, 0x00, 0x10, 0x00, 0x00])) == bytes([0x01, 0x86, EMULATOR_ERROR_LENGTH])
+    assert emulated.execute(bytes([0x01, 0x10, 0x00, 0x00, 0x00, 0x01, 0x03, 0x00, 0x00])) == \
+        bytes([0x01, 0x90, EMULATOR_ERROR_WRONG_LENGTH])
+
+def test_setters_round_trip(heating):
+    device, emulated = heating
+    device.set_target_temp(25.5)
+    device.set_power(HYSENHEAT_POWER_OFF)
+    device.get_device_status()
+    assert device.target_temp == 25.5
+    assert device.power_state == HYSENHEAT_POWER_OFF
+    assert emulated.memory[3] == 51
+
+def test_set_time(heating):
+    device, emulated = heating
+    device.set_time(13, 30, 0, 3)
+    device.get_device_status()
+    assert (device.clock_weekday, device.clock_hour, device.clock_minute) == (3, 13, 30)
+
+def test_room_simulation(fancoil):
+    device, emulated = fancoil
+    emulated.time_scale = 3600 * 100
+    device.set_operation_mode(HYSEN2PFC_MODE_COOL)
+    device.get_device_status()
+    assert device.valve_state == HYSEN2PFC_VALVE_ON
+    time.sleep(0.01)
+    device.get_device_status()
+    assert device.room_temp < 24
+
+def test_udp_emulator(emulator):
+    emulated = emulator.add_device(HYSENHEAT_DEV_TYPE)
+    emulator.start()
+    device = HysenHeatingDevice(emulated.host, emulated.mac, 1, False, 0)
+    device.get_device_status()
+    assert device.target_temp == 22
+    assert device.fwversion == emulated.fwversion
+    assert emulated.requests == 1
+
+def test_session_key(heating):
+    device, emulated = heating
+    assert device._aes_key == emulated._session_key
+    device.get_device_status()
+    device.auth()
+    device.get_device_status()
+
+def test_discovered(emulator):
+    emulated = emulator.add_device(HYSEN2PFC_DEV_TYPE)
+    emulator.start()
+    devices = list(discover(
+        timeout=0.5,
+        local_ip_addresses=['127.0.0.1'],
+        discover_ip_addresses=['127.0.0.1'],
+        discover_ip_port=emulated.host[1]))
+    assert [(device.mac, device.host) for device in devices] == [(emulated.mac, emulated.host)]
+    devices[0].get_device_status()
+    assert devices[0].room_temp == round(emulated.room_temp)
+    assert find_host(emulated.mac, 0.5, ['127.0.0.1'], ['127.0.0.1'], emulated.host[1]) == emulated.host
+
+# The device moved from 127.0.0.2 (its old lease) to the emulator on 127.0.0.1
+def test_host_resolved(emulator):
+    emulated = emulator.add_device(HYSENHEAT_DEV_TYPE)
+    emulator.start()
+    device = HysenHeatingDevice(emulated.host, emulated.mac, 0.3, False, 0)
+    device.auth()
+    device.resolve_after_timeouts = 1
+    device.resolve_timeout = 0.5
+    device.local_ip_addresses = ['127.0.0.1']
+    device.discover_ip_addresses = ['127.0.0.1']
+    device.host = ('127.0.0.2', emulated.host[1])
+    device.get_device_status()
+    assert device.host == emulated.host
+    assert device.target_temp == 22
@@ -0,0 +1,80 @@
+import urllib.error
+import urllib.request
+
+import pytest
+from conftest import emulated_device
+
+from hysen.exporter import HysenPrometheusExporter, render_metrics
+from hysen.fleet import HysenFleet
+from hysen.hysenheating import HYSENHEAT_DEV_TYPE
+from hysen.hysen2pfc import HYSEN2PFC_DEV_TYPE
+
+def _samples(page):
+    samples = {}
+    for line in page.decode('utf-8').splitlines():
+        if line and not line.startswith('#'):
+            name, value = line.rsplit(' ', 1)
+            samples[name] = float(value)
+    return samples
+
+def _fleet():
+    heating = emulated_device(HYSENHEAT_DEV_TYPE)[0]
+    fancoil = emulated_device(HYSEN2PFC_DEV_TYPE)[0]
+    return HysenFleet([heating, fancoil], workers=2), heating, fancoil
+
+def test_render_metrics():
+    fleet, heating, fancoil = _fleet()
+    fleet.poll()
+    version, page = render_metrics(fleet)
+    assert version == fleet.version
+    samples = _samples(page)
+    labels = '{device_id="%s",model="heating"}' % heating.unique_id
+    assert samples['hysen_target_temperature_celsius' + labels] == heating.target_temp
+    assert samples['hysen_up' + labels] == 1
+    assert samples['hysen_polls_total' + labels] == 1
+    fancoil_labels = '{device_id="%s",model="2pfc"}' % fancoil.unique_id
+    assert samples['hysen_time_valve_on_seconds_total' + fancoil_labels] == fancoil.time_valve_on
+    assert 'hysen_external_temperature_celsius' + fancoil_labels not in samples
+    fleet.stop()
+
+def test_up_follows_last_poll():
+    fleet, heating, fancoil = _fleet()
+    fleet.poll()
+    labels = '{device_id="%s",model="heating"}' % heating.unique_id
+    host = heating.host
+    heating.host = ('127.0.0.1', 65000)
+    fleet.poll()
+    samples = _samples(render_metrics(fleet)[1])
+    assert samples['hysen_up' + labels] == 0
+    assert samples['hysen_poll_errors_total' + labels] == 1
+    heating.host = host
+    fleet.poll()
+    assert _samples(render_metrics(fleet)[1])['hysen_up' + labels] == 1
+    fleet.stop()
+
+def test_http_server():
+    fleet, heating, fancoil = _fleet()
+    fleet.poll()
+    exporter = HysenPrometheusExporter(fleet, port=0)
+    exporter.start()
+    try:
+        url = 'http://%s:%s' % (exporter.host, exporter.port)
+        with urllib.request.urlopen(url + '/metrics') as response:
+            assert response.headers['Content-Type'].startswith('text/plain')
+            assert response.read() == exporter.metrics()
+        with pytest.raises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen(url + '/other')
+        assert error.value.code == 404
+    finally:
+        exporter.stop()
+        fleet.stop()
+
+def test_page_rendered_again_on_change():
+    fleet, heating, fancoil = _fleet()
+    exporter = HysenPrometheusExporter(fleet, port=0)
+    page = exporter.metrics()
+    assert exporter.metrics() is page
+    fleet.poll()
+    assert exporter.metrics() is not page
+    exporter.stop()
+    fleet.stop()
@@ -0,0 +1,202 @@
+import threading
+import time
+
+import pytest
+from conftest import emulated_device
+
+from hysen.fleet import HysenFleet, HYSEN_FLEET_INDEXED_FIELDS
+from hysen.hysenheating import HYSENHEAT_DEV_TYPE
+from hysen.hysen2pfc import HYSEN2PFC_DEV_TYPE, HYSEN2PFC_MODE_COOL, HYSEN2PFC_MODE_HEAT
+
+def _fleet(devtypes=(HYSENHEAT_DEV_TYPE, HYSEN2PFC_DEV_TYPE)):
+    devices = [emulated_device(devtype)[0] for devtype in devtypes]
+    return HysenFleet(devices, workers=2), devices
+
+def test_poll_caches_state():
+    fleet, devices = _fleet()
+    assert fleet.poll() == 2
+    for device in devices:
+        state = fleet.state(device.unique_id)
+        assert state.ok
+        assert state.polls == 1
+        assert state.status == device.status_snapshot()
+        assert state.updated is not None
+    assert {fleet.states[device.unique_id].model for device in devices} == {'heating', '2pfc'}
+    fleet.stop()
+
+def test_poll_errors_are_counted():
+    fleet, devices = _fleet((HYSENHEAT_DEV_TYPE,))
+    device = devices[0]
+    fleet.poll()
+    status = fleet.state(device.unique_id).status
+    device.host = ('127.0.0.1', 65000)
+    assert fleet.poll() == 0
+    state = fleet.state(device.unique_id)
+    assert not state.ok
+    assert state.errors == 1
+    assert state.last_error is not None
+    assert state.status == status
+    fleet.stop()
+
+def test_version_and_snapshot():
+    fleet, devices = _fleet()
+    version = fleet.version
+    fleet.poll()
+    assert fleet.version == version + 2
+    snapshot_version, states = fleet.snapshot()
+    assert snapshot_version == fleet.version
+    assert {state.device_id for state in states} == {device.unique_id for device in devices}
+    states[0].polls = 42
+    assert fleet.states[states[0].device_id].polls == 1
+    fleet.stop()
+
+def test_revision():
+    fleet, devices = _fleet((HYSENHEAT_DEV_TYPE,))
+    device = devices[0]
+    fleet.poll()
+    revision = fleet.revision
+    assert fleet.state(device.unique_id).revision == revision
+    # a poll that changed nothing moves the version only
+    version = fleet.version
+    fleet.poll()
+    assert (fleet.version, fleet.revision) == (version + 1, revision)
+    fleet.set_zone(device.unique_id, 'kitchen')
+    assert fleet.revision == revision + 1
+    host = device.host
+    device.host = ('127.0.0.1', 65000)
+    fleet.poll()
+    fleet.poll()
+    assert fleet.revision == revision + 3
+    device.host = host
+    fleet.poll()
+    assert fleet.state(device.unique_id).revision == fleet.revision == revision + 4
+    fleet.stop()
+
+def test_add_remove_device():
+    fleet, devices = _fleet()
+    fleet.remove_device(devices[0].unique_id)
+    assert fleet.poll() == 1
+    assert fleet.state(devices[0].unique_id) is None
+    assert not fleet.poll_device(devices[0].unique_id)
+    fleet.stop()
+
+def test_background_polling():
+    fleet, devices = _fleet()
+    fleet.start(0.01)
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline and min(state.polls for state in fleet.states.values()) < 3:
+        time.sleep(0.01)
+    fleet.stop()
+    assert min(state.polls for state in fleet.states.values()) >= 3
+
+def test_change_callbacks():
+    fleet, devices = _fleet()
+    changes = []
+    statuses = []
+    fleet.add_change_callback(lambda device_id, device_changes: changes.append((device_id, device_changes)))
+    fleet.add_status_callback(lambda device_id, device_changes: statuses.append((device_id, device_changes)))
+    fleet.poll()
+    assert sorted(changes) == sorted((device.unique_id, device.status_snapshot()) for device in devices)
+    fleet.poll()
+    assert len(changes) == 2
+    assert len(statuses) == 4
+    assert statuses[2][1] == statuses[3][1] == {}
+    devices[0].set_target_temp(25)
+    fleet.poll()
+    assert changes[2:] == [(devices[0].unique_id, {'target_temp': 25.0})]
+    assert fleet.state(devices[0].unique_id).changes == {'target_temp': 25.0}
+    fleet.stop()
+
+def test_failed_poll_calls_no_callback():
+    fleet, devices = _fleet((HYSENHEAT_DEV_TYPE,))
+    calls = []
+    fleet.add_change_callback(lambda device_id, changes: calls.append(changes))
+    fleet.add_status_callback(lambda device_id, changes: calls.append(changes))
+    devices[0].host = ('127.0.0.1', 65000)
+    fleet.poll()
+    assert calls == []
+    fleet.stop()
+
+# The fleet indexes must match a scan of the device states
+def _check_indexes(fleet):
+    for field in ('model', 'zone') + HYSEN_FLEET_INDEXED_FIELDS:
+        expected = {}
+        for device_id, state in fleet.states.items():
+            if field in ('model', 'zone'):
+                value = getattr(state, field)
+            elif state.status is not None and field in state.status:
+                value = state.status[field]
+            else:
+                continue
+            expected.setdefault(value, set()).add(device_id)
+        assert fleet.counts(field) == {value: len(device_ids) for value, device_ids in expected.items()}, field
+        for value, device_ids in expected.items():
+            assert fleet.find(**{field: value}) == device_ids, field
+
+def test_indexes_follow_updates():
+    fleet, devices = _fleet((HYSENHEAT_DEV_TYPE, HYSEN2PFC_DEV_TYPE, HYSEN2PFC_DEV_TYPE))
+    heating, first, second = (device.unique_id for device in devices)
+    # never polled, only model and zone are indexed
+    assert fleet.find(model='2pfc') == {first, second}
+    assert fleet.find(operation_mode=HYSEN2PFC_MODE_COOL) == set()
+    fleet.poll()
+    _check_indexes(fleet)
+    assert fleet.find(model='2pfc', operation_mode=HYSEN2PFC_MODE_COOL) == {first, second}
+    devices[1].set_operation_mode(HYSEN2PFC_MODE_HEAT)
+    fleet.poll()
+    _check_indexes(fleet)
+    assert fleet.find(model='2pfc', operation_mode=HYSEN2PFC_MODE_COOL) == {second}
+    assert fleet.find(operation_mode=HYSEN2PFC_MODE_HEAT) == {first}
+    fleet.set_zone(first, 'kitchen')
+    fleet.set_zone(heating, 'kitchen')
+    _check_indexes(fleet)
+    assert fleet.find(zone='kitchen') == {heating, first}
+    fleet.set_zone(heating, 'hall')
+    assert fleet.counts('zone') == {'kitchen': 1, 'hall': 1, None: 1}
+    fleet.remove_device(first)
+    _check_indexes(fleet)
+    assert fleet.find(zone='kitchen') == set()
+    assert HYSEN2PFC_MODE_HEAT not in fleet.counts('operation_mode')
+    # added again, the device status is indexed from its next poll
+    fleet.add_device(devices[2], zone='kitchen')
+    _check_indexes(fleet)
+    assert fleet.find(zone='kitchen') == {second}
+    assert fleet.find(operation_mode=HYSEN2PFC_MODE_COOL) == set()
+    fleet.poll()
+    _check_indexes(fleet)
+    assert fleet.find(operation_mode=HYSEN2PFC_MODE_COOL) == {second}
+    fleet.stop()
+
+def test_unindexed_field():
+    fleet, devices = _fleet()
+    with pytest.raises(ValueError):
+        fleet.find(room_temp=20)
+    with pytest.raises(ValueError):
+        fleet.counts('room_temp')
+    assert fleet.find() == {device.unique_id for device in devices}
+    fleet.stop()
+
+def test_poll_while_devices_change():
+    fleet, devices = _fleet()
+    extra = [emulated_device(HYSENHEAT_DEV_TYPE)[0] for _ in range(20)]
+    stop = threading.Event()
+    errors = []
+    def churn():
+        try:
+            while not stop.is_set():
+                for device in extra:
+                    fleet.add_device(device)
+                for device in extra:
+                    fleet.remove_device(device.unique_id)
+        except Exception as err:
+            errors.append(err)
+    thread = threading.Thread(target=churn)
+    thread.start()
+    try:
+        for _ in range(50):
+            assert fleet.poll() >= 2
+    finally:
+        stop.set()
+        thread.join()
+    assert errors == []
+    fleet.stop()
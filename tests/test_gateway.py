@@ -0,0 +1,226 @@
+import json
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+from conftest import emulated_device
+
+from hysen.fleet import HysenFleet
+from hysen.gateway import HysenGateway, HysenWriteQueue
+from hysen.hysenheating import HYSENHEAT_DEV_TYPE
+from hysen.hysen2pfc import HYSEN2PFC_DEV_TYPE
+
+def _fleet():
+    heating, emulated = emulated_device(HYSENHEAT_DEV_TYPE)
+    fancoil = emulated_device(HYSEN2PFC_DEV_TYPE)[0]
+    return HysenFleet([heating, fancoil], workers=2), heating, emulated
+
+# (status, headers, body) of a request, HTTP errors included
+def _request(url, body=None, headers=None):
+    if body is not None and not isinstance(body, bytes):
+        body = json.dumps(body).encode('utf-8')
+    request = urllib.request.Request(url, body, headers or {})
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status, response.headers, response.read()
+    except urllib.error.HTTPError as err:
+        with err:
+            return err.code, err.headers, err.read()
+
+def _wait_started(writes, device_id):
+    deadline = time.monotonic() + 5
+    while writes._queues.get(device_id):
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+@pytest.fixture
+def gateway():
+    fleet, heating, emulated = _fleet()
+    fleet.poll()
+    gateway = HysenGateway(fleet, port=0, write_timeout=5)
+    gateway.start(poll_interval=None)
+    yield gateway, 'http://%s:%s' % (gateway.host, gateway.port), heating, emulated
+    gateway.stop()
+    fleet.stop()
+
+def test_etag_and_not_modified(gateway):
+    gateway, url, heating, emulated = gateway
+    status, headers, body = _request(url + '/devices')
+    assert status == 200
+    devices = json.loads(body)
+    assert devices[heating.unique_id]['status']['target_temp'] == heating.target_temp
+    etag = headers['ETag']
+    status, headers, body = _request(url + '/devices', headers={'If-None-Match': etag})
+    assert (status, headers['ETag'], body) == (304, etag, b'')
+    # polls that change nothing keep the ETag
+    gateway.fleet.poll()
+    assert _request(url + '/devices', headers={'If-None-Match': etag})[0] == 304
+    device_url = url + '/devices/' + heating.unique_id
+    status, headers, body = _request(device_url)
+    assert json.loads(body) == devices[heating.unique_id]
+    device_etag = headers['ETag']
+    assert _request(device_url, headers={'If-None-Match': '"other", ' + device_etag})[0] == 304
+    # a write polls the device, both pages change
+    assert _request(device_url + '/set_target_temp', [25])[0] == 200
+    status, headers, body = _request(device_url, headers={'If-None-Match': device_etag})
+    assert status == 200 and headers['ETag'] != device_etag
+    assert json.loads(body)['status']['target_temp'] == 25
+    assert _request(url + '/devices', headers={'If-None-Match': etag})[0] == 200
+
+def test_pages_rendered_again_on_change(gateway):
+    gateway, url, heating, emulated = gateway
+    page = gateway.device_page(heating.unique_id)
+    assert gateway.device_page(heating.unique_id)[1] is page[1]
+    gateway.fleet.poll()
+    assert gateway.device_page(heating.unique_id)[1] is page[1]
+    emulated.memory[3] = 2 * 24
+    gateway.fleet.poll()
+    assert gateway.device_page(heating.unique_id)[0] != page[0]
+    assert gateway.device_page('unknown') is None
+
+def test_errors(gateway):
+    gateway, url, heating, emulated = gateway
+    device_url = url + '/devices/' + heating.unique_id
+    assert _request(url + '/devices/unknown')[0] == 404
+    assert _request(url + '/other')[0] == 404
+    assert _request(url + '/devices/unknown/set_target_temp', [25])[0] == 404
+    for setter, body in (
+        ('set_target_temp', b'{'),
+        ('set_target_temp', 25),
+        ('get_device_status', []),
+        ('set_stats', [None]),
+        ('set_target_temp', [1, 2, 3]),
+        ('set_target_temp', {'temperature': 25})):
+        status, headers, body = _request(device_url + '/' + setter, body)
+        assert status == 400, setter
+        assert 'error' in json.loads(body)
+    assert emulated.memory[3] == 2 * 22
+    # rejected by the setter once queued, as any device error
+    status, headers, body = _request(device_url + '/set_target_temp', [99])
+    assert status == 502
+    assert 'maximum' in json.loads(body)['error']
+    emulated.handle = lambda packet: None
+    status, headers, body = _request(device_url + '/set_target_temp', [23])
+    assert status == 502
+    del emulated.handle
+    status, headers, body = _request(device_url + '/set_target_temp', {'temp': 23})
+    assert (status, json.loads(body)) == (200, {'result': None})
+    assert emulated.memory[3] == 2 * 23
+
+def test_writes_coalesced():
+    fleet, heating, emulated = _fleet()
+    fleet.poll()
+    writes = HysenWriteQueue(fleet)
+    device_id = heating.unique_id
+    # the device is busy, the first write waits for it and the next ones stay queued
+    with fleet.device_lock(device_id):
+        first = writes.submit(device_id, 'set_target_temp', (23,))
+        _wait_started(writes, device_id)
+        second = writes.submit(device_id, 'set_target_temp', (24,))
+        third = writes.submit(device_id, 'set_target_temp', (25,))
+        key_lock = writes.submit(device_id, 'set_key_lock', (1,))
+        assert third is second and second.args == (25,)
+        # the same parameter passed by keyword
+        assert writes.submit(device_id, 'set_target_temp', kwargs={'temp': 26}) is second
+        assert key_lock is not second
+        assert len(writes._queues[device_id]) == 2
+        assert emulated.memory[3] == 2 * 22
+        assert not first.done.is_set()
+    for write in (first, second, key_lock):
+        assert write.done.wait(5)
+        assert write.error is None
+    assert emulated.memory[3] == 2 * 26
+    # answered once the cached state is refreshed
+    assert fleet.state(device_id).status['target_temp'] == 26
+    assert fleet.state(device_id).status['key_lock'] == 1
+    writes.close()
+    fleet.stop()
+
+def test_partial_writes_not_coalesced():
+    fleet, heating, emulated = _fleet()
+    writes = HysenWriteQueue(fleet)
+    device_id = heating.unique_id
+    with fleet.device_lock(device_id):
+        first = writes.submit(device_id, 'set_target_temp', (23,))
+        _wait_started(writes, device_id)
+        hour = writes.submit(device_id, 'set_period1', (7, None, None))
+        minute = writes.submit(device_id, 'set_period1', (None, 45, None))
+        # the same parameter by keyword supersedes the positional call
+        assert writes.submit(device_id, 'set_period1', kwargs={'period1_hour': 7}) is hour
+        assert minute is not hour
+    for write in (first, hour, minute):
+        assert write.done.wait(5)
+        assert write.error is None
+    status = fleet.state(device_id).status
+    assert (status['period1_hour'], status['period1_min']) == (7, 45)
+    writes.close()
+    fleet.stop()
+
+def test_writes_answered_by_batch():
+    fleet, heating, emulated = _fleet()
+    writes = HysenWriteQueue(fleet, batch=2)
+    device_id = heating.unique_id
+    submitted = []
+    answered = []
+    poll_device = fleet.poll_device
+    def tracked(device_id):
+        answered.append([write.done.is_set() for write in submitted])
+        return poll_device(device_id)
+    fleet.poll_device = tracked
+    with fleet.device_lock(device_id):
+        submitted.append(writes.submit(device_id, 'set_target_temp', (23,)))
+        _wait_started(writes, device_id)
+        submitted.append(writes.submit(device_id, 'set_key_lock', (1,)))
+        submitted.append(writes.submit(device_id, 'set_period1', (7, None, None)))
+        submitted.append(writes.submit(device_id, 'set_period1', (None, 45, None)))
+        submitted.append(writes.submit(device_id, 'set_target_temp', (24,)))
+    for write in submitted:
+        assert write.done.wait(5)
+        assert write.error is None
+    # a poll and answers every 2 writes, not once the queue is empty
+    assert answered == [
+        [False] * 5,
+        [True] * 2 + [False] * 3,
+        [True] * 4 + [False]]
+    writes.close()
+    fleet.stop()
+
+def test_writes_serialized():
+    fleet, heating, emulated = _fleet()
+    writes = HysenWriteQueue(fleet, workers=4)
+    device_id = heating.unique_id
+    running = []
+    overlaps = []
+    set_target_temp = heating.set_target_temp
+    def tracked(temp):
+        overlaps.append(len(running))
+        running.append(temp)
+        time.sleep(0.01)
+        set_target_temp(temp)
+        running.remove(temp)
+    heating.set_target_temp = tracked
+    submitted = [writes.submit(device_id, 'set_target_temp', kwargs={'temp': 20 + index % 5}) for index in range(5)]
+    submitted += [writes.submit(device_id, 'set_target_temp', (20 + index % 5,)) for index in range(5)]
+    for write in submitted:
+        assert write.done.wait(5)
+    assert overlaps and set(overlaps) == {0}
+    writes.close()
+    fleet.stop()
+
+def test_write_errors():
+    fleet, heating, emulated = _fleet()
+    writes = HysenWriteQueue(fleet)
+    with pytest.raises(KeyError):
+        writes.submit('unknown', 'set_target_temp', (25,))
+    with pytest.raises(ValueError):
+        writes.submit(heating.unique_id, 'get_device_status')
+    # arguments are checked against the setter signature before queueing
+    with pytest.raises(ValueError):
+        writes.submit(heating.unique_id, 'set_target_temp', (1, 2))
+    assert not writes._queues
+    with pytest.raises(ValueError):
+        writes.call(heating.unique_id, 'set_target_temp', (99,))
+    assert writes.call(heating.unique_id, 'set_target_temp', (24,)) is None
+    writes.close()
+    fleet.stop()
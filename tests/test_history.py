@@ -0,0 +1,87 @@
+import pytest
+from conftest import emulated_device
+
+from hysen.fleet import HysenFleet
+from hysen.history import HysenDeviceHistory, HysenHistory
+from hysen.hysenheating import HYSENHEAT_DEV_TYPE
+from hysen.hysen2pfc import HYSEN2PFC_DEV_TYPE
+
+def _status(index):
+    return {
+        'room_temp': 20 + index / 2,
+        'target_temp': 22.0,
+        'operation_mode': 2,
+        'fan_mode': index % 4 + 1,
+        'schedule': 0,
+        'time_valve_on': 1000 * index,
+        'power_state': 1,
+        'valve_state': index % 2,
+        'key_lock': 0,
+        'frost_protection': 1,
+        'fan_control': 0,
+    }
+
+def test_round_trip(fancoil):
+    device, emulated = fancoil
+    history = HysenDeviceHistory('2pfc', 4)
+    status = device.status_snapshot()
+    history.append(100.0, status)
+    timestamp, latest = history.latest()
+    assert timestamp == 100.0
+    assert latest == {field: status[field] for field in history.fields}
+
+def test_ring_keeps_last_records():
+    history = HysenDeviceHistory('2pfc', 4)
+    assert history.latest() is None
+    for index in range(10):
+        history.append(float(index), _status(index))
+    assert history.count == 4
+    window = history.window()
+    assert window['timestamp'] == [6.0, 7.0, 8.0, 9.0]
+    assert window['room_temp'] == [23.0, 23.5, 24.0, 24.5]
+    assert window['time_valve_on'] == [6000, 7000, 8000, 9000]
+    assert window['valve_state'] == [0, 1, 0, 1]
+    assert window['frost_protection'] == [1, 1, 1, 1]
+
+def test_window_range():
+    history = HysenDeviceHistory('2pfc', 8)
+    for index in range(13):
+        history.append(float(index), _status(index))
+    assert history.window(7, 10)['timestamp'] == [7.0, 8.0, 9.0]
+    assert history.window(6.5, 7.5)['fan_mode'] == [4]
+    assert history.window(None, 6)['timestamp'] == [5.0]
+    assert history.window(20)['timestamp'] == []
+    assert history.window(9, 9)['timestamp'] == []
+
+def test_window_fields():
+    history = HysenDeviceHistory('2pfc', 4)
+    history.append(1.0, _status(1))
+    assert set(history.window(fields=('room_temp', 'valve_state'))) == {'timestamp', 'room_temp', 'valve_state'}
+
+def test_unknown_model():
+    with pytest.raises(ValueError):
+        HysenDeviceHistory('other')
+
+def test_nbytes():
+    assert HysenDeviceHistory('heating', 100).nbytes() == 100 * (8 + 2 + 2 + 2 + 1 + 1)
+
+def test_attach_fleet():
+    device, emulated = emulated_device(HYSENHEAT_DEV_TYPE)
+    fleet = HysenFleet([device])
+    history = HysenHistory(16)
+    history.attach_fleet(fleet)
+    for _ in range(3):
+        fleet.poll()
+    window = history.window(device.unique_id)
+    assert len(window['timestamp']) == 3
+    assert window['target_temp'] == [22.0] * 3
+    assert window['timestamp'][-1] == fleet.state(device.unique_id).updated
+    fleet.stop()
+
+def test_attach_device():
+    device, emulated = emulated_device(HYSEN2PFC_DEV_TYPE)
+    history = HysenHistory(16)
+    history.attach_device(device)
+    device.get_device_status()
+    device.get_device_status()
+    assert history.window(device.unique_id)['target_temp'] == [22, 22]
@@ -0,0 +1,67 @@
+import pytest
+from broadlink.exceptions import NetworkTimeoutError
+
+from hysen import discovery
+from hysen.hysendevice import HysenDevice, HYSEN_AUTH_PACKET_TYPE
+from hysen.hysenheating import HysenHeatingDevice
+
+MAC = bytes.fromhex('34ea34000001')
+OLD_HOST = ('10.0.0.2', 80)
+NEW_HOST = ('10.0.0.3', 80)
+
+# A device that moved from OLD_HOST (its old lease) to NEW_HOST: packets to any other host time out
+# and a lookup by MAC address finds found
+# Returns (device, packets sent as (host, packet type), lookups, hosts authenticated with)
+def _moved_device(monkeypatch, resolve_after_timeouts, found=NEW_HOST):
+    sent = []
+    lookups = []
+    auths = []
+    def send_packet(self, packet_type, payload):
+        sent.append((self.host, packet_type))
+        if self.host != NEW_HOST:
+            raise NetworkTimeoutError(-4000, 'Network timeout', 'No response received within 0.3s')
+        return b'response'
+    def find_host(mac, timeout, local_ip_addresses, discover_ip_addresses, discover_ip_port):
+        lookups.append((mac, timeout, discover_ip_port))
+        return found
+    monkeypatch.setattr(HysenDevice, '_send_packet', send_packet)
+    monkeypatch.setattr(discovery, 'find_host', find_host)
+    device = HysenHeatingDevice(OLD_HOST, MAC, 0.3, False, 0)
+    device.resolve_after_timeouts = resolve_after_timeouts
+    device.resolve_timeout = 0.5
+    device.auth = lambda: auths.append(device.host) or True
+    return device, sent, lookups, auths
+
+def test_resolve_after_timeouts(monkeypatch):
+    device, sent, lookups, auths = _moved_device(monkeypatch, 2)
+    with pytest.raises(NetworkTimeoutError):
+        device.send_packet(0x6a, b'')
+    assert lookups == []
+    assert device.send_packet(0x6a, b'') == b'response'
+    assert sent == [(OLD_HOST, 0x6a), (OLD_HOST, 0x6a), (NEW_HOST, 0x6a)]
+    assert lookups == [(MAC, 0.5, 80)]
+    assert device.host == NEW_HOST
+    assert auths == [NEW_HOST]
+    assert device._consecutive_timeouts == 0
+
+def test_resolve_disabled(monkeypatch):
+    device, sent, lookups, auths = _moved_device(monkeypatch, 0)
+    for _ in range(3):
+        with pytest.raises(NetworkTimeoutError):
+            device.send_packet(0x6a, b'')
+    assert lookups == []
+    assert device.host == OLD_HOST
+
+def test_resolve_device_gone(monkeypatch):
+    device, sent, lookups, auths = _moved_device(monkeypatch, 1, found=None)
+    with pytest.raises(NetworkTimeoutError):
+        device.send_packet(0x6a, b'')
+    assert len(lookups) == 1
+    assert device.host == OLD_HOST
+    assert auths == []
+
+def test_auth_resent_without_auth(monkeypatch):
+    device, sent, lookups, auths = _moved_device(monkeypatch, 1)
+    assert device.send_packet(HYSEN_AUTH_PACKET_TYPE, b'') == b'response'
+    assert sent == [(OLD_HOST, HYSEN_AUTH_PACKET_TYPE), (NEW_HOST, HYSEN_AUTH_PACKET_TYPE)]
+    assert auths == []
@@ -0,0 +1,94 @@
+import threading
+
+import pytest
+
+from hysen.hysendevice import crc16
+from hysen.hysenheating import HysenHeatingDevice, HYSENHEAT_STATUS_REQUEST
+
+# Memory words of a heating thermostat, target temperature 22 degrees
+HEATING_MEMORY = bytes.fromhex('0001282c30002a02230500000000000000000001060008000b1e0c1e111e160008001700281e1e1e2c1e2c1e0102')
+
+# An authenticated heating device whose send_packet answers reads and writes from memory (a bytearray),
+# and firmware version requests with version 0, no packet is sent
+def _device(memory):
+    device = HysenHeatingDevice(('127.0.0.1', 80), bytes(6), 1, False, 0)
+    device._authenticated = True
+    def send_packet(packet_type, payload):
+        if len(payload) == 1:
+            return bytes(0x38) + device.encrypt(bytes(16))
+        request = bytes(payload[2:payload[0]])
+        start = 2 * request[3]
+        if request[1] == 0x03:
+            return_payload = bytes([0x01, 0x03, 2 * request[5]]) + bytes(memory[start:start + 2 * request[5]])
+        elif request[1] == 0x06:
+            memory[start:start + 2] = request[4:6]
+            return_payload = request
+        else:
+            memory[start:start + request[6]] = request[7:]
+            return_payload = request[0:6]
+        crc = crc16(return_payload)
+        frame = bytes([len(return_payload) + 2, 0]) + return_payload + bytes([crc & 0xFF, crc >> 8])
+        return bytes(0x38) + device.encrypt(frame + bytes(-len(frame) % 16))
+    device.send_packet = send_packet
+    return device
+
+def test_response_buffer_per_thread():
+    memory = bytearray(HEATING_MEMORY)
+    device = _device(memory)
+    first = device._send_request(HYSENHEAT_STATUS_REQUEST)
+    first_bytes = bytes(first)
+    # another thread decrypts into a buffer of its own
+    responses = []
+    memory[3] = 50
+    thread = threading.Thread(target=lambda: responses.append(bytes(device._send_request(HYSENHEAT_STATUS_REQUEST))))
+    thread.start()
+    thread.join()
+    assert bytes(first) == first_bytes
+    assert responses[0][3 + 3] == 50
+    # the thread's buffer is reused by its next request
+    second = device._send_request(HYSENHEAT_STATUS_REQUEST)
+    assert second.obj is first.obj
+    assert first[3 + 3] == 50
+
+# Answer every request of device with frame (a decrypted response payload)
+def _answer(device, frame):
+    device.send_packet = lambda packet_type, payload: bytes(0x38) + device.encrypt(frame + bytes(-len(frame) % 16))
+
+def test_short_responses_rejected():
+    device = _device(bytearray(HEATING_MEMORY))
+    # no length, then a wrong CRC
+    for frame in (b'', bytes([4, 0, 0x01, 0x03])):
+        _answer(device, frame)
+        with pytest.raises(ValueError):
+            device._send_request(HYSENHEAT_STATUS_REQUEST)
+    # a valid length and CRC, but too short for a read
+    return_payload = bytes([0x01, 0x03])
+    crc = crc16(return_payload)
+    _answer(device, bytes([4, 0]) + return_payload + bytes([crc & 0xFF, crc >> 8]))
+    device.auth = lambda: True
+    with pytest.raises(ValueError) as error:
+        device._send_request(HYSENHEAT_STATUS_REQUEST)
+    assert 'Hysen_response_error' in str(error.value)
+
+def test_concurrent_requests():
+    memory = bytearray(HEATING_MEMORY)
+    device = _device(memory)
+    errors = []
+    def run(action):
+        try:
+            for _ in range(200):
+                action()
+        except Exception as err:
+            errors.append(err)
+    threads = [
+        threading.Thread(target=run, args=(device.get_device_status,)),
+        threading.Thread(target=run, args=(lambda: device.set_target_temp(21),)),
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    device.get_device_status()
+    assert device.target_temp == 21
+    assert memory[3] == 2 * 21
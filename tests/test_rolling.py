@@ -0,0 +1,79 @@
+import random
+
+import pytest
+from conftest import emulated_device
+
+from hysen.fleet import HysenFleet
+from hysen.hysenheating import HYSENHEAT_DEV_TYPE
+from hysen.rolling import HysenRollingStats, HysenRollingWindow
+
+# Statistics of the samples (timestamp, value, target) of the window ending at the last one, from scratch
+def _brute_force(samples, window):
+    cutoff = samples[-1][0] - window
+    kept = [sample for sample in samples if sample[0] >= cutoff]
+    count = len(kept)
+    values = [value for timestamp, value, target in kept]
+    mean_t = sum(timestamp for timestamp, value, target in kept) / count
+    mean_v = sum(values) / count
+    variance = sum((timestamp - mean_t) ** 2 for timestamp, value, target in kept)
+    rate = None
+    if count >= 2 and variance > 0:
+        rate = sum((timestamp - mean_t) * (value - mean_v) for timestamp, value, target in kept) / variance * 3600
+    above = sum(
+        kept[index + 1][0] - kept[index][0]
+        for index in range(count - 1) if kept[index][1] > kept[index][2])
+    return {'samples': count, 'mean': mean_v, 'min': min(values), 'max': max(values), 'rate': rate, 'time_above_target': above}
+
+def test_matches_brute_force():
+    generator = random.Random(1)
+    rolling = HysenRollingWindow(600)
+    samples = []
+    timestamp = 1.7e9
+    for _ in range(2000):
+        timestamp += generator.choice((0, 10, 30, 60, 300))
+        sample = (timestamp, round(generator.uniform(18, 24) * 2) / 2, 21.0)
+        samples.append(sample)
+        assert rolling.add(timestamp, {'room_temp': sample[1], 'target_temp': sample[2]})
+        expected = _brute_force(samples, 600)
+        actual = rolling.as_dict()
+        for key, value in expected.items():
+            if value is None:
+                assert actual[key] is None, key
+            else:
+                assert actual[key] == pytest.approx(value, rel=1e-6, abs=1e-6), key
+
+def test_rate():
+    rolling = HysenRollingWindow(3600)
+    assert rolling.rate is None
+    for minute in range(10):
+        rolling.add(minute * 60.0, {'room_temp': 20 + minute * 0.1, 'target_temp': 30})
+    assert rolling.rate == pytest.approx(6.0)
+    assert rolling.time_above_target == 0
+
+def test_late_sample_dropped():
+    rolling = HysenRollingWindow(60)
+    rolling.add(10.0, {'room_temp': 20, 'target_temp': 21})
+    assert not rolling.add(5.0, {'room_temp': 30, 'target_temp': 21})
+    assert rolling.maximum == 20
+
+def test_select():
+    stats = HysenRollingStats(600)
+    for minute in range(5):
+        stats.record('warming', {'room_temp': 18 + minute, 'target_temp': 21}, minute * 60.0)
+        stats.record('steady', {'room_temp': 21, 'target_temp': 21}, minute * 60.0)
+    assert set(stats.select(lambda current: current['rate'] is not None and current['rate'] > 1)) == {'warming'}
+    assert stats.stats('steady')['rate'] == 0
+    with pytest.raises(ValueError):
+        stats.stats('unknown')
+
+def test_attach_fleet():
+    device, emulated = emulated_device(HYSENHEAT_DEV_TYPE)
+    fleet = HysenFleet([device])
+    stats = HysenRollingStats()
+    stats.attach_fleet(fleet)
+    fleet.poll()
+    fleet.poll()
+    current = stats.stats(device.unique_id)
+    assert current['samples'] == 2
+    assert current['mean'] == device.room_temp
+    fleet.stop()
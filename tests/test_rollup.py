@@ -0,0 +1,117 @@
+import math
+import random
+
+import pytest
+from conftest import emulated_device
+
+from hysen.fleet import HysenFleet
+from hysen.hysen2pfc import HYSEN2PFC_DEV_TYPE
+from hysen.rollup import HysenDeviceRollup, HysenRollups, lttb
+
+def _samples(count, step, seed=1):
+    generator = random.Random(seed)
+    return [
+        (1000.0 + index * step, {
+            'room_temp': round(generator.uniform(15, 25) * 2) / 2,
+            'target_temp': 21.0,
+            'external_temp': 10.0,
+            'valve_state': generator.randrange(2)})
+        for index in range(count)]
+
+# Buckets computed from all the samples at once
+def _expected(samples, resolution):
+    buckets = {}
+    for timestamp, status in samples:
+        buckets.setdefault(timestamp - timestamp % resolution, []).append(status)
+    expected = {'start': [], 'samples': [], 'valve_on': [], 'room_temp_min': [], 'room_temp_max': [], 'room_temp_mean': []}
+    for start in sorted(buckets):
+        statuses = buckets[start]
+        values = [status['room_temp'] for status in statuses]
+        expected['start'].append(start)
+        expected['samples'].append(len(statuses))
+        expected['valve_on'].append(sum(status['valve_state'] for status in statuses) / len(statuses))
+        expected['room_temp_min'].append(min(values))
+        expected['room_temp_max'].append(max(values))
+        expected['room_temp_mean'].append(sum(values) / len(values))
+    return expected
+
+def test_lttb_keeps_ends_and_peaks():
+    x = list(range(1000))
+    y = [math.sin(value / 50.0) for value in x]
+    y[500] = 10.0
+    y[700] = -10.0
+    sampled_x, sampled_y = lttb(x, y, 50)
+    assert len(sampled_x) == len(sampled_y) == 50
+    assert (sampled_x[0], sampled_x[-1]) == (0, 999)
+    assert sampled_x == sorted(sampled_x)
+    assert 10.0 in sampled_y and -10.0 in sampled_y
+
+def test_lttb_small_inputs():
+    assert lttb([1, 2, 3], [4, 5, 6], 10) == ([1, 2, 3], [4, 5, 6])
+    assert lttb([1, 2, 3, 4], [4, 5, 6, 7], 2) == ([1, 2, 3, 4], [4, 5, 6, 7])
+
+@pytest.mark.parametrize('resolution', [60, 3600])
+def test_buckets_match_samples(resolution):
+    samples = _samples(3000, 7.0)
+    rollup = HysenDeviceRollup(resolution, 10000, ('room_temp',))
+    for timestamp, status in samples:
+        assert rollup.add(timestamp, status)
+    buckets = rollup.buckets()
+    expected = _expected(samples, resolution)
+    for key, values in expected.items():
+        assert buckets[key] == pytest.approx(values), key
+
+def test_ring_and_range():
+    samples = _samples(600, 10.0)
+    rollup = HysenDeviceRollup(60, 5, ('room_temp',))
+    for timestamp, status in samples:
+        rollup.add(timestamp, status)
+    expected = _expected(samples, 60)
+    buckets = rollup.buckets()
+    assert buckets['start'] == expected['start'][-6:]
+    assert buckets['room_temp_mean'] == pytest.approx(expected['room_temp_mean'][-6:])
+    start, end = expected['start'][-4], expected['start'][-2]
+    assert rollup.buckets(start, end)['start'] == expected['start'][-4:-2]
+    assert not rollup.covers(None)
+    assert rollup.covers(expected['start'][-6])
+
+def test_late_sample_dropped():
+    rollup = HysenDeviceRollup(60, 10, ('room_temp',))
+    assert rollup.add(120.0, {'room_temp': 20.0})
+    assert not rollup.add(30.0, {'room_temp': 30.0})
+    assert rollup.add(130.0, {'room_temp': 22.0})
+    assert rollup.buckets()['room_temp_max'] == [22.0]
+
+def test_rollups_and_chart():
+    rollups = HysenRollups()
+    samples = _samples(5000, 60.0)
+    for timestamp, status in samples:
+        rollups.record('device', status, timestamp)
+    assert rollups.buckets('device', 3600)['start'] == _expected(samples, 3600)['start']
+    # the minute buckets no longer hold the first samples, the hour buckets are charted as is
+    x, y = rollups.chart('device', 'room_temp', points=100)
+    assert x == _expected(samples, 3600)['start']
+    # the last 1000 minutes fit in the minute buckets, downsampled to 100 points
+    start = samples[-1000][0]
+    x, y = rollups.chart('device', 'room_temp', start, points=100)
+    assert len(x) == 100
+    assert x[0] >= start and x[0] % 60 == 0
+    with pytest.raises(ValueError):
+        rollups.buckets('device', 10)
+    with pytest.raises(ValueError):
+        rollups.chart('unknown', 'room_temp')
+    with pytest.raises(ValueError):
+        rollups.chart('device', 'fan_mode')
+
+def test_attach_fleet():
+    device, emulated = emulated_device(HYSEN2PFC_DEV_TYPE)
+    fleet = HysenFleet([device])
+    rollups = HysenRollups()
+    rollups.attach_fleet(fleet)
+    fleet.poll()
+    fleet.poll()
+    buckets = rollups.buckets(device.unique_id, 60)
+    assert sum(buckets['samples']) == 2
+    assert 'external_temp_mean' not in buckets
+    assert buckets['target_temp_mean'][-1] == device.target_temp
+    fleet.stop()
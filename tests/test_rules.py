@@ -0,0 +1,95 @@
+import pytest
+from conftest import emulated_device
+
+from hysen.fleet import HysenFleet
+from hysen.hysenheating import HYSENHEAT_DEV_TYPE
+from hysen.rules import HysenRule, HysenRuleEngine, HYSEN_ALERT_CLEARED, HYSEN_ALERT_FIRED
+
+def _too_cold(device_id, status):
+    return status['room_temp'] < status['target_temp'] - 2
+
+def _kinds(alerts):
+    return [(alert.rule, alert.device_id, alert.kind) for alert in alerts]
+
+def test_fire_and_clear():
+    engine = HysenRuleEngine()
+    engine.add_rule(HysenRule('too_cold', ('room_temp', 'target_temp'), _too_cold))
+    alerts = []
+    engine.add_callback(alerts.append)
+    status = {'room_temp': 18.0, 'target_temp': 21.0}
+    assert _kinds(engine.update('a', status, status, 0.0)) == [('too_cold', 'a', HYSEN_ALERT_FIRED)]
+    status = dict(status, room_temp=17.0)
+    assert engine.update('a', {'room_temp': 17.0}, status, 1.0) == []
+    status = dict(status, room_temp=20.0)
+    cleared = engine.update('a', {'room_temp': 20.0}, status, 2.0)
+    assert _kinds(cleared) == [('too_cold', 'a', HYSEN_ALERT_CLEARED)]
+    assert cleared[0].since == 0.0
+    assert _kinds(alerts) == [('too_cold', 'a', HYSEN_ALERT_FIRED), ('too_cold', 'a', HYSEN_ALERT_CLEARED)]
+    assert engine.active == {}
+
+def test_only_rules_of_changed_fields_evaluated():
+    evaluated = []
+    def condition(device_id, status):
+        evaluated.append(device_id)
+        return False
+    engine = HysenRuleEngine()
+    engine.add_rule(HysenRule('room', ('room_temp',), condition))
+    engine.update('a', {'fan_mode': 2}, {'fan_mode': 2, 'room_temp': 20.0})
+    assert evaluated == []
+    engine.update('a', {'room_temp': 21.0}, {'fan_mode': 2, 'room_temp': 21.0})
+    assert evaluated == ['a']
+
+def test_duration():
+    engine = HysenRuleEngine()
+    engine.add_rule(HysenRule('too_cold', ('room_temp',), _too_cold, duration=600))
+    cold = {'room_temp': 18.0, 'target_temp': 21.0}
+    assert engine.update('a', cold, cold, 0.0) == []
+    assert ('too_cold', 'a') in engine.active
+    assert engine.tick(599.0) == []
+    fired = engine.tick(600.0)
+    assert _kinds(fired) == [('too_cold', 'a', HYSEN_ALERT_FIRED)]
+    assert (fired[0].timestamp, fired[0].since, fired[0].status) == (600.0, 0.0, cold)
+    assert engine.tick(10000.0) == []
+
+def test_duration_interrupted():
+    engine = HysenRuleEngine()
+    engine.add_rule(HysenRule('too_cold', ('room_temp',), _too_cold, duration=600))
+    cold = {'room_temp': 18.0, 'target_temp': 21.0}
+    warm = {'room_temp': 21.0, 'target_temp': 21.0}
+    engine.update('a', cold, cold, 0.0)
+    assert engine.update('a', warm, warm, 300.0) == []
+    engine.update('a', cold, cold, 400.0)
+    assert engine.tick(700.0) == []
+    assert engine.update('a', {'room_temp': 17.0}, dict(cold, room_temp=17.0), 1000.0)[0].since == 400.0
+
+def test_change_rule():
+    engine = HysenRuleEngine()
+    engine.add_rule(HysenRule('key_lock_changed', ('key_lock',)))
+    assert engine.update('a', {'key_lock': 0}, {'key_lock': 0}) == []
+    assert _kinds(engine.update('a', {'key_lock': 1}, {'key_lock': 1})) == [('key_lock_changed', 'a', HYSEN_ALERT_FIRED)]
+
+def test_add_remove_rule():
+    engine = HysenRuleEngine()
+    engine.add_rule(HysenRule('too_cold', ('room_temp',), _too_cold))
+    with pytest.raises(ValueError):
+        engine.add_rule(HysenRule('too_cold', ('room_temp',), _too_cold))
+    cold = {'room_temp': 18.0, 'target_temp': 21.0}
+    engine.update('a', cold, cold)
+    engine.remove_rule('too_cold')
+    assert engine.active == {} and engine.fired == set()
+    assert engine.update('a', cold, cold) == []
+
+def test_attach_fleet():
+    device, emulated = emulated_device(HYSENHEAT_DEV_TYPE)
+    fleet = HysenFleet([device])
+    engine = HysenRuleEngine()
+    engine.add_rule(HysenRule('too_cold', ('room_temp', 'target_temp'), _too_cold))
+    engine.attach_fleet(fleet)
+    alerts = []
+    engine.add_callback(alerts.append)
+    fleet.poll()
+    assert alerts == []
+    emulated.memory[3] = 2 * 25
+    fleet.poll()
+    assert _kinds(alerts) == [('too_cold', device.unique_id, HYSEN_ALERT_FIRED)]
+    fleet.stop()
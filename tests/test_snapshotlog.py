@@ -0,0 +1,85 @@
+import pytest
+from conftest import emulated_device
+
+from hysen.fleet import HysenFleet
+from hysen.hysenheating import HYSENHEAT_DEV_TYPE
+from hysen.hysen2pfc import HYSEN2PFC_DEV_TYPE
+from hysen.snapshotlog import HysenSnapshotLog
+
+def _status(device):
+    status = device.status_snapshot()
+    del status['fwversion']
+    return status
+
+def test_round_trip(tmp_path, heating, fancoil):
+    path = str(tmp_path / 'snapshots.log')
+    with HysenSnapshotLog(path) as log:
+        for timestamp, (device, emulated) in enumerate((heating, fancoil, heating)):
+            log.append(device, float(timestamp))
+        assert len(log) == 3
+        timestamp, devtype, mac, payload = log.record(1)
+        assert (timestamp, devtype, mac, payload) == (1.0, fancoil[0].devtype, fancoil[0].mac, fancoil[0].status_payload)
+    with HysenSnapshotLog(path, readonly=True) as log:
+        assert log.decode(0) == (0.0, heating[0].unique_id, _status(heating[0]))
+        assert log.decode(1) == (1.0, fancoil[0].unique_id, _status(fancoil[0]))
+
+def test_growth(tmp_path, heating):
+    device, emulated = heating
+    path = str(tmp_path / 'snapshots.log')
+    with HysenSnapshotLog(path, growth=4) as log:
+        reader = HysenSnapshotLog(path, readonly=True)
+        for timestamp in range(10):
+            log.append(device, float(timestamp))
+        assert len(reader) == 10
+        assert [timestamp for timestamp, device_id, status in reader.range()] == [float(t) for t in range(10)]
+        reader.close()
+
+def test_range(tmp_path, heating, fancoil):
+    path = str(tmp_path / 'snapshots.log')
+    with HysenSnapshotLog(path) as log:
+        for timestamp in range(10):
+            device = heating[0] if timestamp % 2 else fancoil[0]
+            log.append(device, float(timestamp))
+        assert log.bisect(4.5) == 5
+        assert [timestamp for timestamp, device_id, status in log.range(3, 7)] == [3.0, 4.0, 5.0, 6.0]
+        assert [timestamp for timestamp, device_id, status in log.range(2, None, heating[0].unique_id)] == \
+            [3.0, 5.0, 7.0, 9.0]
+        assert list(log.range(20)) == []
+
+def test_records_kept_in_time_order(tmp_path, heating):
+    device, emulated = heating
+    path = str(tmp_path / 'snapshots.log')
+    with HysenSnapshotLog(path) as log:
+        assert log.append(device, 10.0)
+        assert not log.append(device, 5.0)
+        assert log.append(device, 10.0)
+        assert log.append(device, 11.0)
+        assert [log.timestamp(index) for index in range(len(log))] == [10.0, 10.0, 11.0]
+        # records stamped by the log never go back in time
+        assert log.append(device)
+        assert log.timestamp(3) >= 11.0
+
+def test_errors(tmp_path):
+    path = tmp_path / 'other.log'
+    path.write_bytes(bytes(64))
+    with pytest.raises(ValueError):
+        HysenSnapshotLog(str(path))
+    with HysenSnapshotLog(str(tmp_path / 'snapshots.log')) as log:
+        with pytest.raises(ValueError):
+            log.append_payload(HYSENHEAT_DEV_TYPE, bytes(6), bytes(50))
+        log.append_payload(0x2712, bytes(6), bytes(10), 1.0)
+        with pytest.raises(ValueError):
+            log.decode(0)
+
+def test_attach_fleet(tmp_path):
+    devices = [emulated_device(devtype)[0] for devtype in (HYSENHEAT_DEV_TYPE, HYSEN2PFC_DEV_TYPE)]
+    fleet = HysenFleet(devices, workers=2)
+    with HysenSnapshotLog(str(tmp_path / 'snapshots.log')) as log:
+        log.attach_fleet(fleet)
+        for _ in range(5):
+            fleet.poll()
+        assert len(log) == 10
+        timestamps = [log.timestamp(index) for index in range(10)]
+        assert timestamps == sorted(timestamps)
+        assert {device_id for timestamp, device_id, status in log.range()} == {device.unique_id for device in devices}
+    fleet.stop()
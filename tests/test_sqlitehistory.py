@@ -0,0 +1,76 @@
+import sqlite3
+import time
+
+import pytest
+from conftest import emulated_device
+
+from hysen.fleet import HysenFleet
+from hysen.hysenheating import HYSENHEAT_DEV_TYPE
+from hysen.hysen2pfc import HYSEN2PFC_DEV_TYPE
+from hysen.sqlitehistory import HysenSqliteHistory
+
+# Rows written to the database, as seen by another connection
+def _written(path, model='heating'):
+    with sqlite3.connect(path) as connection:
+        return connection.execute('SELECT COUNT(*) FROM hysen_%s_status' % model).fetchone()[0]
+
+def test_round_trip(tmp_path, heating):
+    device, emulated = heating
+    path = str(tmp_path / 'history.db')
+    status = device.status_snapshot()
+    with HysenSqliteHistory(path, flush_interval=None) as history:
+        history.record(device.unique_id, 'heating', status, 100.0)
+        assert history.query(device.unique_id) == [(100.0, status)]
+    with HysenSqliteHistory(path, flush_interval=None) as history:
+        assert history.devices() == {device.unique_id: 'heating'}
+        assert history.query(device.unique_id) == [(100.0, status)]
+        assert history.query('unknown') == []
+
+def test_range_and_fields(tmp_path, fancoil):
+    device, emulated = fancoil
+    status = device.status_snapshot()
+    with HysenSqliteHistory(str(tmp_path / 'history.db'), flush_interval=None) as history:
+        for timestamp in range(10):
+            history.record(device.unique_id, '2pfc', dict(status, room_temp=timestamp), float(timestamp))
+        rows = history.query(device.unique_id, 3, 6, fields=('room_temp',))
+        assert rows == [(3.0, {'room_temp': 3}), (4.0, {'room_temp': 4}), (5.0, {'room_temp': 5})]
+        with pytest.raises(ValueError):
+            history.query(device.unique_id, fields=('external_temp',))
+        with pytest.raises(ValueError):
+            history.record(device.unique_id, 'other', status)
+
+def test_batch_flush(tmp_path, heating):
+    device, emulated = heating
+    path = str(tmp_path / 'history.db')
+    status = device.status_snapshot()
+    with HysenSqliteHistory(path, batch_size=3, flush_interval=None) as history:
+        history.record(device.unique_id, 'heating', status)
+        history.record(device.unique_id, 'heating', status)
+        assert _written(path) == 0
+        history.record(device.unique_id, 'heating', status)
+        assert _written(path) == 3
+        history.record(device.unique_id, 'heating', status)
+    assert _written(path) == 4
+
+def test_time_flush(tmp_path, heating):
+    device, emulated = heating
+    path = str(tmp_path / 'history.db')
+    with HysenSqliteHistory(path, flush_interval=0.05) as history:
+        history.record(device.unique_id, 'heating', device.status_snapshot())
+        deadline = time.monotonic() + 5
+        while _written(path) == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert _written(path) == 1
+
+def test_attach_fleet(tmp_path):
+    devices = [emulated_device(devtype)[0] for devtype in (HYSENHEAT_DEV_TYPE, HYSEN2PFC_DEV_TYPE)]
+    fleet = HysenFleet(devices, workers=2)
+    with HysenSqliteHistory(str(tmp_path / 'history.db'), flush_interval=None) as history:
+        history.attach_fleet(fleet)
+        for _ in range(3):
+            fleet.poll()
+        for device in devices:
+            rows = history.query(device.unique_id)
+            assert len(rows) == 3
+            assert rows[-1] == (fleet.state(device.unique_id).updated, device.status_snapshot())
+    fleet.stop()
@@ -0,0 +1,119 @@
+import threading
+import time
+
+import pytest
+from broadlink.exceptions import NetworkTimeoutError
+
+from hysen.hysenheating import HysenHeatingDevice
+from hysen.stats import (
+    HysenStats,
+    LatencyHistogram,
+    HYSEN_STATS_AUTH,
+    HYSEN_STATS_OPERATION,
+    HYSEN_STATS_ROUND_TRIP,
+)
+
+def test_histogram():
+    histogram = LatencyHistogram((0.01, 0.1, 1.0))
+    for seconds in (0.005, 0.05, 0.05, 0.5, 5.0):
+        histogram.record(seconds)
+    assert histogram.counts == [1, 2, 1, 1]
+    assert histogram.percentile(0.5) == 0.1
+    assert histogram.percentile(0.99) == 5.0
+    assert (histogram.min, histogram.max) == (0.005, 5.0)
+    assert LatencyHistogram().percentile(0.5) is None
+
+def test_operations_and_round_trips(heating):
+    device, emulated = heating
+    stats = HysenStats()
+    device.set_stats(stats)
+    device.get_device_status()
+    device.set_target_temp(21)
+    operations = stats.as_dict()['operations']
+    assert operations['get_device_status']['calls'] == 1
+    assert operations['get_device_status']['round_trips'] == 2
+    assert operations['set_target_temp']['calls'] == 1
+    assert operations['set_target_temp']['round_trips'] == 3
+    assert stats.devices[device.unique_id].round_trips == 5
+
+def test_errors_counted(heating):
+    device, emulated = heating
+    stats = HysenStats()
+    device.set_stats(stats)
+    with pytest.raises(ValueError):
+        device.set_target_temp(99)
+    assert stats.operations['set_target_temp'].errors == 1
+    assert stats.devices[device.unique_id].errors == 1
+
+def test_events(heating):
+    device, emulated = heating
+    stats = HysenStats()
+    events = []
+    stats.add_callback(events.append)
+    device.set_stats(stats)
+    device.auth()
+    kinds = [event.kind for event in events]
+    assert kinds == [HYSEN_STATS_AUTH, HYSEN_STATS_ROUND_TRIP, HYSEN_STATS_OPERATION]
+    assert stats.devices[device.unique_id].auths == 1
+
+def test_timeouts(heating):
+    device, emulated = heating
+    stats = HysenStats()
+    device.set_stats(stats)
+    device.host = ('127.0.0.1', 65000)
+    with pytest.raises(NetworkTimeoutError):
+        device.get_device_status()
+    assert stats.devices[device.unique_id].timeouts == 1
+    assert stats.operations['get_device_status'].errors == 1
+
+def test_set_stats_none_removes_wrappers(heating):
+    device, emulated = heating
+    device.set_stats(HysenStats())
+    assert 'get_device_status' in vars(device)
+    device.set_stats(None)
+    assert 'get_device_status' not in vars(device)
+    assert device.get_device_status.__func__ is HysenHeatingDevice.get_device_status
+
+def test_concurrent_operations(heating):
+    device, emulated = heating
+    stats = HysenStats()
+    device.set_stats(stats)
+    def run(action):
+        for _ in range(100):
+            action()
+    threads = [
+        threading.Thread(target=run, args=(device.get_device_status,)),
+        threading.Thread(target=run, args=(lambda: device.set_target_temp(21),)),
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert stats.operations['get_device_status'].latency.count == 100
+    assert stats.operations['get_device_status'].round_trips == 200
+    assert stats.operations['set_target_temp'].latency.count == 100
+    assert stats.operations['set_target_temp'].round_trips == 300
+
+def test_slowest_devices():
+    stats = HysenStats()
+    stats.record_round_trip('a', 0x6a, 0.1)
+    stats.record_round_trip('b', 0x6a, 0.3)
+    stats.record_round_trip('b', 0x6a, 0.1)
+    assert stats.slowest_devices(1) == [('b', pytest.approx(0.2))]
+    stats.reset()
+    assert stats.slowest_devices() == []
+
+def test_round_trip_excludes_lock_wait(heating):
+    device, emulated = heating
+    stats = HysenStats()
+    device.set_stats(stats)
+    # the exchange waits for another user of the device, the wait is not a round trip
+    with device.lock:
+        thread = threading.Thread(target=device.get_device_status)
+        thread.start()
+        time.sleep(0.2)
+    thread.join()
+    rtt = stats.devices[device.unique_id].rtt
+    assert rtt.count == 2
+    assert rtt.max < 0.1
+    assert stats.operations['get_device_status'].latency.max >= 0.2
@@ -0,0 +1,120 @@
+import json
+import threading
+import urllib.request
+
+from conftest import emulated_device
+
+from hysen.fleet import HysenFleet
+from hysen.gateway import HysenGateway
+from hysen.hysenheating import HYSENHEAT_DEV_TYPE
+from hysen.hysen2pfc import HYSEN2PFC_DEV_TYPE
+from hysen.stream import HysenChangeStream, HysenStreamClient, sse_event
+
+# (event, id, data) of a server-sent event
+def _parse(event):
+    fields = dict(line.split(': ', 1) for line in event.decode('utf-8').strip().split('\n'))
+    return fields['event'], fields.get('id'), json.loads(fields['data'])
+
+def _fleet():
+    heating, emulated = emulated_device(HYSENHEAT_DEV_TYPE)
+    fancoil = emulated_device(HYSEN2PFC_DEV_TYPE)[0]
+    return HysenFleet([heating, fancoil], workers=2), heating, emulated
+
+def test_sse_event():
+    assert sse_event('change', '{}', 3) == b'event: change\nid: 3\ndata: {}\n\n'
+    assert sse_event('snapshot', '[]') == b'event: snapshot\ndata: []\n\n'
+
+def test_push_coalesced():
+    client = HysenStreamClient()
+    client.push('a', {'room_temp': 20, 'valve_state': 1}, 1)
+    client.push('b', {'room_temp': 18}, 2)
+    client.push('a', {'room_temp': 21}, 3)
+    assert client.coalesced == 1
+    # one entry per device, in arrival order, the newer values win
+    assert client.get(0) == (False, [('a', 3, {'room_temp': 21, 'valve_state': 1}), ('b', 2, {'room_temp': 18})])
+    assert client.get(0) == (False, [])
+
+def test_push_overflow_resync():
+    client = HysenStreamClient(max_pending=3)
+    for index in range(3):
+        client.push(index, {'room_temp': index}, index)
+    # merged into a pending device, no overflow
+    client.push(0, {'room_temp': 10}, 3)
+    assert not client.resync
+    client.push(3, {'room_temp': 3}, 4)
+    assert (client.resync, client.resyncs, len(client.pending)) == (True, 1, 0)
+    # nothing is buffered until the client resyncs
+    client.push(4, {'room_temp': 4}, 5)
+    assert client.get(0) == (True, [])
+    client.push(4, {'room_temp': 4}, 6)
+    assert client.get(0) == (False, [(4, 6, {'room_temp': 4})])
+
+def test_get_wakes_up_and_close():
+    client = HysenStreamClient()
+    timer = threading.Timer(0.05, client.push, ('a', {'room_temp': 20}, 1))
+    timer.start()
+    assert client.get(5) == (False, [('a', 1, {'room_temp': 20})])
+    timer = threading.Timer(0.05, client.close)
+    timer.start()
+    assert client.get(5) == (False, [])
+    client.push('a', {'room_temp': 21}, 2)
+    assert not client.pending
+
+def test_events():
+    fleet, heating, emulated = _fleet()
+    fleet.poll()
+    stream = HysenChangeStream(fleet, max_pending=1, keepalive=0.01)
+    client = stream.subscribe()
+    events = stream.events(client)
+    event, event_id, data = _parse(next(events))
+    assert (event, int(event_id)) == ('snapshot', fleet.version)
+    assert data[heating.unique_id] == fleet.state(heating.unique_id).status
+    assert next(events) == b': keepalive\n\n'
+    emulated.memory[3] = 2 * 25
+    fleet.poll()
+    event, event_id, data = _parse(next(events))
+    assert event == 'change'
+    assert data == {'device_id': heating.unique_id, 'version': int(event_id), 'changes': {'target_temp': 25}}
+    # changes of two devices overflow a buffer of one device, the client is sent a snapshot again
+    stream.publish(heating.unique_id, {'target_temp': 26})
+    stream.publish('other', {'target_temp': 26})
+    assert client.resyncs == 1
+    event, event_id, data = _parse(next(events))
+    assert event == 'snapshot'
+    assert data[heating.unique_id]['target_temp'] == 25
+    stream.close()
+    assert client.closed and not stream.clients
+    assert list(events) == []
+    # no longer listening to the fleet
+    assert stream.publish not in fleet._change_callbacks
+    fleet.stop()
+
+def test_unsubscribe():
+    fleet, heating, emulated = _fleet()
+    stream = HysenChangeStream(fleet)
+    client = stream.subscribe()
+    stream.unsubscribe(client)
+    assert client.closed and not stream.clients
+    stream.publish(heating.unique_id, {'target_temp': 25})
+    assert not client.pending
+    stream.close()
+    fleet.stop()
+
+def test_gateway_events():
+    fleet, heating, emulated = _fleet()
+    fleet.poll()
+    gateway = HysenGateway(fleet, port=0, write_timeout=5)
+    gateway.start(poll_interval=None)
+    url = 'http://%s:%s' % (gateway.host, gateway.port)
+    try:
+        with urllib.request.urlopen(url + '/events', timeout=5) as response:
+            assert response.headers['Content-Type'] == 'text/event-stream'
+            # read up to the end of the snapshot event
+            assert _parse(b''.join(iter(response.readline, b'\n')))[0] == 'snapshot'
+            urllib.request.urlopen(urllib.request.Request(
+                url + '/devices/' + heating.unique_id + '/set_target_temp', b'[24]')).close()
+            event, event_id, data = _parse(b''.join(iter(response.readline, b'\n')))
+            assert (event, data['device_id'], data['changes']) == ('change', heating.unique_id, {'target_temp': 24})
+    finally:
+        gateway.stop()
+        fleet.stop()
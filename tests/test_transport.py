@@ -0,0 +1,107 @@
+import pytest
+from broadlink.exceptions import NetworkTimeoutError
+
+from hysen.hysenheating import HysenHeatingDevice, HYSENHEAT_DEV_TYPE, HYSENHEAT_STATUS_REQUEST
+from hysen.transport import ImpairedTransport, LoopbackTransport, UdpTransport
+
+HOST = ('127.0.0.1', 1)
+
+# Answers every packet with a response numbered in arrival order
+class _Counter:
+    def __init__(self):
+        self.host = HOST
+        self.packets = 0
+
+    def handle(self, packet):
+        self.packets += 1
+        return self.packets.to_bytes(4, 'little')
+
+def test_loopback():
+    counter = _Counter()
+    transport = LoopbackTransport([counter])
+    assert transport.exchange(b'', HOST, 1) == (1).to_bytes(4, 'little')
+    with pytest.raises(NetworkTimeoutError):
+        transport.exchange(b'', ('127.0.0.1', 2), 1)
+
+def test_loopback_assigns_hosts():
+    transport = LoopbackTransport()
+    first = _Counter()
+    second = _Counter()
+    first.host = second.host = None
+    assert transport.add_device(first) != transport.add_device(second)
+    assert first.host != second.host
+
+def test_impaired_loss_is_retried():
+    transport = ImpairedTransport(LoopbackTransport([_Counter()]), loss=0.3, retry_interval=1, seed=3, sleep=None)
+    for _ in range(50):
+        try:
+            transport.exchange(b'', HOST, 100)
+        except NetworkTimeoutError:
+            pass
+    assert transport.lost > 0
+    assert transport.elapsed == transport.lost * 1
+
+def test_impaired_total_loss_times_out():
+    transport = ImpairedTransport(LoopbackTransport([_Counter()]), loss=1.0, retry_interval=1, sleep=None)
+    with pytest.raises(NetworkTimeoutError):
+        transport.exchange(b'', HOST, 5)
+    assert transport.elapsed == 5
+
+def test_impaired_latency():
+    transport = ImpairedTransport(LoopbackTransport([_Counter()]), latency=0.5, jitter=0.25, sleep=None)
+    for _ in range(10):
+        transport.exchange(b'', HOST, 1)
+    assert 5 <= transport.elapsed <= 7.5
+
+def test_impaired_reorder_delivers_held_response_next():
+    counter = _Counter()
+    transport = ImpairedTransport(LoopbackTransport([counter]), reorder=1.0, retry_interval=1, sleep=None)
+    # every response arrives late, the exchange times out
+    with pytest.raises(NetworkTimeoutError):
+        transport.exchange(b'', HOST, 2.5)
+    assert (transport.reordered, counter.packets) == (3, 3)
+    # the next exchange gets the last late response instead of its own
+    transport.reorder = 0.0
+    assert transport.exchange(b'', HOST, 10) == (3).to_bytes(4, 'little')
+    assert counter.packets == 4
+    assert transport.exchange(b'', HOST, 10) == (5).to_bytes(4, 'little')
+
+def test_impaired_reorder_reaches_response_check(heating):
+    device, emulated = heating
+    device.transport = ImpairedTransport(device.transport, reorder=1.0, retry_interval=0.1, sleep=None)
+    with pytest.raises(NetworkTimeoutError):
+        device._send_request(HYSENHEAT_STATUS_REQUEST)
+    # the late status response is taken as the answer of the write, which doesn't echo it
+    device.transport.reorder = 0.0
+    with pytest.raises(ValueError) as error:
+        device._send_request(bytearray([0x01, 0x06, 0x00, 0x01, 0x00, 2 * 23]))
+    assert 'Hysen_response_error' in str(error.value)
+    assert emulated.memory[3] == 2 * 23
+
+def test_device_through_impaired_transport(heating):
+    device, emulated = heating
+    device.transport = ImpairedTransport(device.transport, loss=0.2, latency=0.01, retry_interval=0.1, seed=5, sleep=None)
+    for _ in range(20):
+        device.get_device_status()
+    assert device.transport.lost > 0
+    assert device.target_temp == 22
+
+def test_udp_transport(emulator):
+    emulated = emulator.add_device(HYSENHEAT_DEV_TYPE)
+    emulator.start()
+    device = HysenHeatingDevice(emulated.host, emulated.mac, 1, False, 0)
+    assert isinstance(device.transport, UdpTransport)
+    device.get_device_status()
+    assert device.target_temp == 22
+    emulator.stop()
+    device.resolve_after_timeouts = 0
+    device.timeout = 0.2
+    with pytest.raises(NetworkTimeoutError):
+        device.get_device_status()
+
+def test_corrupted_response_rejected(heating):
+    device, emulated = heating
+    device.transport = ImpairedTransport(device.transport, corruption=1.0, seed=1, sleep=None)
+    for _ in range(20):
+        with pytest.raises(ValueError):
+            device._send_request(HYSENHEAT_STATUS_REQUEST)
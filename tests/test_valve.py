@@ -0,0 +1,82 @@
+import pytest
+from conftest import emulated_device
+
+from hysen.fleet import HysenFleet
+from hysen.hysen2pfc import HYSEN2PFC_DEV_TYPE
+from hysen.valve import HysenDeviceValve, HysenValveAnalytics, HYSEN_VALVE_COUNTER_RANGE
+
+def test_state_runtime():
+    valve = HysenDeviceValve(False, max_gap=None)
+    for timestamp, state in ((0, 1), (60, 0), (120, 1), (150, 1), (180, 0)):
+        assert valve.add(float(timestamp), {'valve_state': state})
+    assert valve.window() == {'runtime': 120.0, 'observed': 180.0, 'duty_cycle': pytest.approx(2 / 3)}
+    window = valve.window(30, 135)
+    assert window['runtime'] == pytest.approx(30 + 15)
+    assert window['observed'] == pytest.approx(105)
+
+def test_state_gap_not_counted():
+    valve = HysenDeviceValve(False, max_gap=100)
+    valve.add(0.0, {'valve_state': 1})
+    valve.add(1000.0, {'valve_state': 1})
+    valve.add(1060.0, {'valve_state': 0})
+    assert valve.window() == {'runtime': 60.0, 'observed': 60.0, 'duty_cycle': 1.0}
+
+def test_counter_runtime():
+    valve = HysenDeviceValve(True)
+    for timestamp, counter in ((0, 1000), (60, 1030), (120, 1030), (180, 1090)):
+        valve.add(float(timestamp), {'time_valve_on': counter})
+    assert valve.window()['runtime'] == 90.0
+    assert valve.window(60, 120)['runtime'] == 0.0
+    assert valve.window(90, 150)['runtime'] == pytest.approx(30.0)
+
+def test_counter_wrap_and_reset():
+    valve = HysenDeviceValve(True)
+    valve.add(0.0, {'time_valve_on': HYSEN_VALVE_COUNTER_RANGE - 10})
+    valve.add(60.0, {'time_valve_on': 20})
+    assert (valve.runtime, valve.wraps) == (30.0, 1)
+    valve.add(120.0, {'time_valve_on': 5})
+    assert (valve.runtime, valve.resets) == (35.0, 1)
+    # never more than the time between the samples
+    valve.add(180.0, {'time_valve_on': 1000})
+    assert valve.runtime == 95.0
+
+def test_late_sample_dropped():
+    valve = HysenDeviceValve(False)
+    valve.add(10.0, {'valve_state': 1})
+    assert not valve.add(5.0, {'valve_state': 0})
+    assert valve.count == 1
+
+def test_ring_keeps_last_checkpoints():
+    valve = HysenDeviceValve(False, capacity=4, max_gap=None)
+    for timestamp in range(10):
+        valve.add(float(timestamp * 10), {'valve_state': timestamp % 2})
+    assert valve.count == 4
+    # checkpoints 60 (off), 70 (on), 80 (off) and 90 (on) are kept
+    assert valve.window() == {'runtime': 10.0, 'observed': 30.0, 'duty_cycle': pytest.approx(1 / 3)}
+    assert valve.window(0, 1000)['observed'] == 30.0
+
+def test_empty_window():
+    assert HysenDeviceValve(True).window() == {'runtime': 0.0, 'observed': 0.0, 'duty_cycle': None}
+
+def test_analytics_report():
+    analytics = HysenValveAnalytics(max_gap=None)
+    for timestamp in range(3):
+        analytics.record('heating', {'valve_state': 1}, float(timestamp * 60))
+        analytics.record('2pfc', {'valve_state': 0, 'time_valve_on': timestamp * 30}, float(timestamp * 60))
+    windows, runtime, observed = analytics.report()
+    assert windows['heating']['runtime'] == 120.0
+    assert windows['2pfc']['runtime'] == 60.0
+    assert (runtime, observed) == (180.0, 240.0)
+    with pytest.raises(ValueError):
+        analytics.window('unknown')
+
+def test_attach_fleet():
+    device, emulated = emulated_device(HYSEN2PFC_DEV_TYPE)
+    fleet = HysenFleet([device])
+    analytics = HysenValveAnalytics()
+    analytics.attach_fleet(fleet)
+    fleet.poll()
+    fleet.poll()
+    assert analytics.devices[device.unique_id].counter
+    assert analytics.devices[device.unique_id].count == 2
+    fleet.stop()
@@ -0,0 +1,85 @@
+import asyncio
+import itertools
+import threading
+
+from conftest import emulated_device
+
+from hysen.fleet import HysenFleet
+from hysen.hysenheating import HYSENHEAT_DEV_TYPE
+from hysen.hysen2pfc import HYSEN2PFC_DEV_TYPE
+from hysen.watch import HysenWatch
+
+def test_watch_skips_none():
+    results = iter([1, None, 2, None, 3])
+    watch = HysenWatch(lambda: next(results), 0)
+    assert list(itertools.islice(watch, 3)) == [1, 2, 3]
+
+def test_watch_start_end():
+    events = []
+    watch = HysenWatch(lambda: 1, 0, on_start=lambda: events.append('start'), on_end=lambda: events.append('end'))
+    iterator = iter(watch)
+    next(iterator)
+    assert events == ['start']
+    iterator.close()
+    assert events == ['start', 'end']
+
+def test_watch_stop():
+    watch = HysenWatch(lambda: 1, 60)
+    items = []
+    def consume():
+        for item in watch:
+            items.append(item)
+    thread = threading.Thread(target=consume)
+    thread.start()
+    while not items:
+        thread.join(0.01)
+    watch.stop()
+    thread.join(5)
+    assert not thread.is_alive()
+    assert items == [1]
+
+def test_async_watch():
+    results = iter([None, 1, 2])
+    watch = HysenWatch(lambda: next(results), 0)
+    async def collect():
+        items = []
+        async for item in watch:
+            items.append(item)
+            if len(items) == 2:
+                break
+        return items
+    assert asyncio.run(collect()) == [1, 2]
+
+def test_device_watch(heating):
+    device, emulated = heating
+    statuses = list(itertools.islice(device.watch(0), 2))
+    assert statuses[0]['target_temp'] == 22
+    assert set(statuses[1]) == set(device.STATUS_FIELDS)
+
+def test_device_watch_changes(heating):
+    device, emulated = heating
+    iterator = iter(device.watch(0, changes=True))
+    assert next(iterator) == device.status_snapshot()
+    emulated.memory[3] = 46
+    assert next(iterator) == {'target_temp': 23.0}
+    iterator.close()
+
+def test_fleet_watch_changes():
+    devices = [emulated_device(devtype) for devtype in (HYSENHEAT_DEV_TYPE, HYSEN2PFC_DEV_TYPE)]
+    fleet = HysenFleet([device for device, emulated in devices], workers=2)
+    watch = fleet.watch(0, changes=True)
+    iterator = iter(watch)
+    first = next(iterator)
+    assert set(first) == {device.unique_id for device, emulated in devices}
+    devices[1][1].memory[5] = 23
+    assert next(iterator) == {devices[1][0].unique_id: {'target_temp': 23}}
+    iterator.close()
+    assert fleet._change_callbacks == []
+    fleet.stop()
+
+def test_fleet_watch_statuses():
+    device, emulated = emulated_device(HYSENHEAT_DEV_TYPE)
+    fleet = HysenFleet([device])
+    statuses = next(iter(fleet.watch(0)))
+    assert statuses == {device.unique_id: device.status_snapshot()}
+    fleet.stop()